@@ -0,0 +1,7 @@
+"""Performance benchmarks.
+
+Generate a synthetic MovieLens shaped dataset, then time the pipeline on it:
+    cd src
+    python -m benchmark.synth --scale 1x --out /tmp/ml-1x
+    python -m benchmark.run --data /tmp/ml-1x --out bench.json
+"""
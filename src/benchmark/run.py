@@ -0,0 +1,317 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import scipy
+from benchmark.synth import generate, load_manifest
+from recommender import TAG_THRESHOLD, Recommender
+from services.analytics import build_analytics
+from services.catalog import build_catalog
+from services.score import calc_avg_score, load_rating_stats
+from services.search import TitleIndex
+from services.shard import ShardedIndex
+from services.quantize import PRECISIONS, QuantizedIndex, compare_precisions
+from services.index import SimilarityIndex
+from services.tag import get_top_k, init_matrix
+
+try:
+    import resource
+
+    def peak_rss() -> int:
+        #ru_maxrss is KiB on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+except ImportError:
+    def peak_rss() -> int:
+        return None
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+class Paths:
+    """The dataset files of one benchmark directory"""
+    def __init__(self, data_dir: str):
+        self.dir = data_dir
+        self.tag = os.path.join(data_dir, "genome_scores.csv")
+        self.movie = os.path.join(data_dir, "movie.csv")
+        self.rating = os.path.join(data_dir, "rating.csv")
+        self.link = os.path.join(data_dir, "link.csv")
+        self.avg = os.path.join(data_dir, "avg_rating.csv")
+
+
+def summarize(latencies: list[float], items: int = 1) -> dict:
+    """Latency percentiles in ms and throughput in operations (x items) per second"""
+    lat = np.asarray(latencies, dtype=np.float64)
+    out = {
+        "n": len(lat),
+        "mean_ms": float(lat.mean() * 1000),
+        "min_ms": float(lat.min() * 1000),
+        "max_ms": float(lat.max() * 1000),
+    }
+    for p, v in zip(PERCENTILES, np.percentile(lat, PERCENTILES)):
+        out[f"p{p}_ms"] = float(v * 1000)
+    out["throughput_per_s"] = float(len(lat) * items / lat.sum()) if lat.sum() > 0 else None
+    return out
+
+def measure(op, args_list: list, warmup: int = 1, before=None) -> list[float]:
+    """Wall time of op(*args) for every args in args_list, after `warmup` untimed calls.
+    before(), if given, runs untimed ahead of each call"""
+    for args in args_list[:warmup]:
+        if before is not None:
+            before()
+        op(*args)
+    latencies = []
+    for args in args_list:
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        op(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def make_profiles(movie_ids, n: int, seed: int = 0, max_len: int = 10) -> list[tuple[list[int], list[int]]]:
+    """Deterministic (movieids, stars) queries over movies of the tag matrix"""
+    rng = np.random.default_rng(seed)
+    movie_ids = np.asarray(list(movie_ids))
+    profiles = []
+    for _ in range(n):
+        size = int(rng.integers(1, max_len + 1))
+        ids = rng.choice(movie_ids, size=min(size, len(movie_ids)), replace=False)
+        profiles.append(([int(m) for m in ids], [int(s) for s in rng.integers(1, 6, size=len(ids))]))
+    return profiles
+
+def make_search_queries(titles: list[str], n: int, seed: int = 0) -> list[str]:
+    """Title fragments as a user would type them: a prefix, one word, or a word with a typo"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for title in rng.choice(np.array(titles, dtype=object), size=n):
+        words = title.split(" (")[0].split()
+        kind = rng.integers(0, 3)
+        if kind == 0:
+            queries.append(" ".join(words)[:int(rng.integers(3, 12))])
+        elif kind == 1:
+            queries.append(words[int(rng.integers(0, len(words)))].lower())
+        else:
+            word = list(words[0].lower())
+            pos = int(rng.integers(0, len(word)))
+            word[pos] = "xyzq"[int(rng.integers(0, 4))]
+            queries.append("".join(word))
+    return queries
+
+
+#Every case gets (paths, repeat) and returns (latencies, items per operation)
+def bench_init_matrix(paths: Paths, repeat: int):
+    return measure(init_matrix, [(paths.tag, TAG_THRESHOLD)] * repeat, warmup=0), 1
+
+def bench_get_top_k(paths: Paths, repeat: int):
+    movie2idx, _, X = init_matrix(paths.tag, TAG_THRESHOLD)
+    profiles = make_profiles(movie2idx, repeat)
+    return measure(lambda q: get_top_k(q, X, movie2idx, 10), [(q,) for q in profiles]), 1
+
+def bench_sharded_top_k(paths: Paths, repeat: int):
+    #Exact scoring over one row block per core, compare with get_top_k across machines
+    movie2idx, _, X = init_matrix(paths.tag, TAG_THRESHOLD)
+    sharded = ShardedIndex(SimilarityIndex(X, movie2idx), min_shard_nnz=1)
+    try:
+        profiles = make_profiles(movie2idx, repeat)
+        return measure(lambda q: sharded.top_k(q, 10), [(q,) for q in profiles]), 1
+    finally:
+        sharded.close()
+
+def quantized_top_k(precision: str):
+    def bench(paths: Paths, repeat: int):
+        #Only the reduced copy stays resident, as with SCORING_BACKEND=quantized
+        movie2idx, _, X = init_matrix(paths.tag, TAG_THRESHOLD)
+        index = SimilarityIndex(X, movie2idx)
+        quantized = QuantizedIndex(index, precision)
+        index.release_normalized()
+        profiles = make_profiles(movie2idx, repeat)
+        return measure(lambda q: quantized.top_k(q, 10), [(q,) for q in profiles]), 1
+    return bench
+
+def bench_recommend(paths: Paths, repeat: int):
+    movie2idx, tag2idx, X = init_matrix(paths.tag, TAG_THRESHOLD)
+    rcm = Recommender(build_catalog(paths.movie, paths.avg), (movie2idx, tag2idx, X))
+    #Every query is scored, the result cache would only measure dict lookups
+    rcm.cache = None
+    profiles = make_profiles(movie2idx, repeat)
+    return measure(lambda q: rcm.recommend(q, 10), [(q,) for q in profiles]), 1
+
+def bench_calc_avg_score(paths: Paths, repeat: int):
+    work = tempfile.mkdtemp(prefix="bench-avg-")
+    result_path = os.path.join(work, "avg_rating.csv")
+    state_path = os.path.join(work, "rating.stats.npz")
+
+    def cold():
+        #Full aggregation from an empty stats store
+        for path in (result_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+    try:
+        return measure(calc_avg_score, [(paths.rating, result_path, state_path)] * repeat, warmup=0, before=cold), 1
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def bench_catalog(paths: Paths, repeat: int):
+    return measure(build_catalog, [(paths.movie, paths.avg)] * repeat), 1
+
+def bench_search_suggest(paths: Paths, repeat: int):
+    index = TitleIndex.from_frame(pd.read_csv(paths.movie))
+    queries = make_search_queries(index.titles, repeat)
+    return measure(lambda q: index.search(q, limit=10, score_cutoff=60), [(q,) for q in queries]), 1
+
+def bench_analytics(paths: Paths, repeat: int):
+    #Every aggregate the analytics page plots
+    return measure(build_analytics, [(paths.movie, paths.avg)] * repeat, warmup=0), 1
+
+def bench_controversy(paths: Paths, repeat: int):
+    #The controversy donut: up to date stats store -> per movie std
+    def op():
+        load_rating_stats(paths.rating).to_frame()
+    return measure(op, [()] * repeat), 1
+
+CASES = {
+    "init_matrix": (bench_init_matrix, 3),
+    "get_top_k": (bench_get_top_k, 100),
+    "sharded_top_k": (bench_sharded_top_k, 100),
+    **{f"top_k_{p}": (quantized_top_k(p), 100) for p in PRECISIONS},
+    "recommend": (bench_recommend, 300),
+    "calc_avg_score": (bench_calc_avg_score, 3),
+    "catalog": (bench_catalog, 5),
+    "search_suggest": (bench_search_suggest, 500),
+    "analytics": (bench_analytics, 3),
+    "controversy": (bench_controversy, 10),
+}
+
+
+def run_case(name: str, data_dir: str, repeat: int) -> dict:
+    fn, default_repeat = CASES[name]
+    #Interpreter + imports, so the case's own footprint is peak - baseline
+    baseline = peak_rss()
+    start = time.perf_counter()
+    latencies, items = fn(Paths(data_dir), repeat or default_repeat)
+    result = summarize(latencies, items)
+    result["wall_s"] = time.perf_counter() - start
+    result["peak_rss_bytes"] = peak_rss()
+    result["baseline_rss_bytes"] = baseline
+    return result
+
+def _child(name: str, data_dir: str, repeat: int, conn):
+    try:
+        conn.send(("ok", run_case(name, data_dir, repeat)))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+def run_isolated(name: str, data_dir: str, repeat: int) -> dict:
+    """Run one case in a fresh interpreter so its peak RSS is its own
+    (setup included) and no case warms another's caches"""
+    ctx = mp.get_context("spawn")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(name, data_dir, repeat, send))
+    proc.start()
+    send.close()
+    try:
+        status, payload = recv.recv()
+    except EOFError:
+        status, payload = "error", None
+    proc.join()
+    if payload is None:
+        payload = f"worker exited with code {proc.exitcode}"
+    if status != "ok":
+        raise RuntimeError(f"Benchmark {name} failed: {payload}")
+    return payload
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def prepare(data_dir: str, scale: str, seed: int):
+    """Generate the dataset if it is missing and derive avg_rating.csv once,
+    the catalog and analytics cases read it"""
+    paths = Paths(data_dir)
+    if not all(os.path.exists(p) for p in (paths.tag, paths.movie, paths.rating, paths.link)):
+        print(f"Generating {scale} dataset in {data_dir}....", file=sys.stderr)
+        generate(data_dir, scale, seed)
+    calc_avg_score(paths.rating, paths.avg)
+
+def precision_report(data_dir: str, n_profiles: int = 200, k: int = 10) -> dict:
+    """Memory, latency and top-k overlap of every reduced precision against float64"""
+    movie2idx, _, X = init_matrix(Paths(data_dir).tag, TAG_THRESHOLD)
+    return compare_precisions(SimilarityIndex(X, movie2idx), make_profiles(movie2idx, n_profiles), k)
+
+def run(data_dir: str, cases: list[str] = None, repeat: int = None, isolate: bool = True) -> dict:
+    results = {}
+    for name in cases or list(CASES):
+        print(f"{name}....", file=sys.stderr)
+        results[name] = run_isolated(name, data_dir, repeat) if isolate else run_case(name, data_dir, repeat)
+        print(f"{name} p50 {results[name]['p50_ms']:.2f}ms", file=sys.stderr)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "cpu_affinity": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+            "isolated": isolate,
+            "dataset": load_manifest(data_dir),
+        },
+        "results": results,
+    }
+
+def compare(old: dict, new: dict) -> str:
+    """p50 and peak RSS of two result files side by side"""
+    lines = [f"{'case':<18}{'p50 old':>12}{'p50 new':>12}{'ratio':>8}{'rss old':>10}{'rss new':>10}"]
+    for name, res in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            continue
+        ratio = res["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("nan")
+        mib = lambda r: f"{r['peak_rss_bytes'] / 2**20:.0f}M" if r.get("peak_rss_bytes") else "-"
+        lines.append(f"{name:<18}{before['p50_ms']:>10.2f}ms{res['p50_ms']:>10.2f}ms{ratio:>8.2f}{mib(before):>10}{mib(res):>10}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the recommender pipeline on a synthetic dataset")
+    parser.add_argument("--data", required=True, help="dataset directory, generated when missing")
+    parser.add_argument("--scale", default="1x", help="scale to generate when --data is missing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), help="default: all")
+    parser.add_argument("--repeat", type=int, help="override every case's iteration count")
+    parser.add_argument("--no-isolate", action="store_true", help="run all cases in this process")
+    parser.add_argument("--out", help="write the json here instead of stdout")
+    parser.add_argument("--baseline", help="earlier result json to compare against")
+    parser.add_argument("--precision-report", action="store_true", help="also compare float32/float16/uint8 scoring with float64")
+    args = parser.parse_args()
+
+    prepare(args.data, args.scale, args.seed)
+    report = run(args.data, args.cases, args.repeat, not args.no_isolate)
+    if args.precision_report:
+        report["precision"] = precision_report(args.data)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            print(compare(json.load(f), report), file=sys.stderr)
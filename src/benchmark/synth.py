@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+#Sizes of MovieLens 20M, the "1x" scale
+ML20M = {
+    "movies": 27278,
+    "genome_movies": 10381,
+    "tags": 1128,
+    "users": 138493,
+    "ratings": 20000263,
+}
+SCALES = {"1x": 1.0, "10x": 10.0}
+GENRES = [
+    "Action", "Adventure", "Animation", "Children", "Comedy", "Crime", "Documentary",
+    "Drama", "Fantasy", "Film-Noir", "Horror", "IMAX", "Musical", "Mystery", "Romance",
+    "Sci-Fi", "Thriller", "War", "Western",
+]
+SYLLABLES = [
+    "ka", "ro", "mi", "ta", "ne", "lo", "sha", "dar", "vin", "el", "mo", "ra", "tu", "bel",
+    "gor", "an", "is", "que", "zen", "pol", "ver", "li", "son", "ma", "den", "cor", "fa", "nu",
+]
+N_TOPICS = 32
+GENOME_BLOCK = 1000
+RATING_BLOCK = 2_000_000
+
+
+def parse_scale(scale) -> float:
+    """"1x", "10x", "0.01x" or a plain number"""
+    if isinstance(scale, str):
+        if scale in SCALES:
+            return SCALES[scale]
+        return float(scale.rstrip("x"))
+    return float(scale)
+
+def sizes(scale: float) -> dict:
+    """Row counts at this scale. The tag vocabulary does not grow with the catalog"""
+    out = {name: max(1, int(round(n * scale))) for name, n in ML20M.items()}
+    out["tags"] = ML20M["tags"]
+    return out
+
+def write_csv(df: pd.DataFrame, path: str, first: bool, **kwargs):
+    df.to_csv(path, mode="w" if first else "a", header=first, index=False, **kwargs)
+
+
+def make_words(rng: np.random.Generator, n: int = 4000) -> np.ndarray:
+    parts = rng.integers(0, len(SYLLABLES), size=(n, 3))
+    lengths = rng.integers(1, 4, size=n)
+    words = {
+        "".join(SYLLABLES[p] for p in row[:length]).capitalize()
+        for row, length in zip(parts, lengths)
+    }
+    return np.array(sorted(words), dtype=object)
+
+def gen_movies(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    #Sparse ids like the real data (ML-20M goes up to 131262 for 27278 movies)
+    ids = np.sort(rng.choice(np.arange(1, int(n * 4.8) + 2), size=n, replace=False))
+    words = make_words(rng)
+    n_words = rng.integers(1, 5, size=n)
+    picks = rng.integers(0, len(words), size=(n, 4))
+    years = np.clip(2016 - rng.gamma(2.0, 12.0, size=n).astype(np.int64), 1900, 2015)
+    #A few titles carry no year, as in movie.csv
+    has_year = rng.random(n) > 0.01
+    titles = [
+        " ".join(words[row[:k]]) + (f" ({year})" if ok else "")
+        for row, k, year, ok in zip(picks, n_words, years, has_year)
+    ]
+
+    n_genres = rng.integers(1, 4, size=n)
+    genre_picks = rng.integers(0, len(GENRES), size=(n, 3))
+    genres = [
+        "|".join(dict.fromkeys(GENRES[g] for g in row[:k]))
+        for row, k in zip(genre_picks, n_genres)
+    ]
+    return pd.DataFrame({"movieId": ids, "title": titles, "genres": genres})
+
+def gen_links(rng: np.random.Generator, movie_ids: np.ndarray) -> pd.DataFrame:
+    n = len(movie_ids)
+    imdb = rng.choice(np.arange(1, n * 40 + 1), size=n, replace=False)
+    tmdb = pd.array(rng.choice(np.arange(1, n * 15 + 1), size=n, replace=False), dtype="Int64")
+    #About 1% of movies have no TMDB id
+    tmdb[rng.random(n) < 0.01] = pd.NA
+    return pd.DataFrame({"movieId": movie_ids, "imdbId": imdb, "tmdbId": tmdb})
+
+def write_genome(rng: np.random.Generator, movie_ids: np.ndarray, n_tags: int, path: str) -> int:
+    """Dense movie x tag relevance in [0, 1]. Mostly low noise like the real genome,
+    raised on the tags of two latent topics per movie so neighbours are meaningful"""
+    tag_topic = rng.integers(0, N_TOPICS, size=n_tags)
+    tag_load = rng.uniform(0.3, 1.0, size=n_tags)
+    tag_ids = np.arange(1, n_tags + 1)
+    rows = 0
+    for start in range(0, len(movie_ids), GENOME_BLOCK):
+        block = movie_ids[start:start + GENOME_BLOCK]
+        m = len(block)
+        topics = np.zeros((m, N_TOPICS))
+        for _ in range(2):
+            topics[np.arange(m), rng.integers(0, N_TOPICS, size=m)] += rng.uniform(0.2, 0.6, size=m)
+        affinity = topics[:, tag_topic] * tag_load
+        base = rng.beta(0.5, 4.0, size=(m, n_tags))
+        rel = 1.0 - (1.0 - base) * (1.0 - np.clip(affinity, 0.0, 1.0))
+        write_csv(
+            pd.DataFrame({
+                "movieId": np.repeat(block, n_tags),
+                "tagId": np.tile(tag_ids, m),
+                "relevance": rel.ravel(),
+            }),
+            path, start == 0, float_format="%.5f"
+        )
+        rows += m * n_tags
+    return rows
+
+def write_ratings(rng: np.random.Generator, movie_ids: np.ndarray, n_users: int, n_ratings: int, path: str) -> int:
+    """Zipf-like movie popularity, a per-movie quality, half star ratings,
+    rows grouped by user as in rating.csv"""
+    n = len(movie_ids)
+    popularity = 1.0 / (np.arange(n) + 10.0)
+    popularity = popularity[rng.permutation(n)]
+    popularity /= popularity.sum()
+    quality = rng.normal(3.4, 0.45, size=n)
+    spread = rng.uniform(0.6, 1.3, size=n)
+    lo_ts = pd.Timestamp("1995-01-09").value // 10**9
+    hi_ts = pd.Timestamp("2015-03-31").value // 10**9
+
+    written = 0
+    first_user = 1
+    while written < n_ratings:
+        count = min(RATING_BLOCK, n_ratings - written)
+        last_user = first_user + max(1, int(round(n_users * count / n_ratings))) - 1
+        users = np.sort(rng.integers(first_user, last_user + 1, size=count))
+        movies = rng.choice(n, size=count, p=popularity)
+        stars = np.clip(np.rint((quality[movies] + rng.normal(0, 1, size=count) * spread[movies]) * 2) / 2, 0.5, 5.0)
+        ts = pd.to_datetime(rng.integers(lo_ts, hi_ts, size=count), unit="s")
+        write_csv(
+            pd.DataFrame({"userId": users, "movieId": movie_ids[movies], "rating": stars, "timestamp": ts}),
+            path, written == 0, date_format="%Y-%m-%d %H:%M:%S"
+        )
+        written += count
+        first_user = last_user + 1
+    return written
+
+
+def generate(out_dir: str, scale="1x", seed: int = 0) -> dict:
+    """Write genome_scores.csv, movie.csv, rating.csv and link.csv shaped like
+    MovieLens 20M at the given scale. Same (scale, seed) gives the same files.
+    A manifest.json next to them records what was generated"""
+    scale = parse_scale(scale)
+    n = sizes(scale)
+    os.makedirs(out_dir, exist_ok=True)
+    #Independent streams so changing one file's generator leaves the others identical
+    movie_rng, link_rng, genome_rng, rating_rng = (
+        np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(4)
+    )
+
+    movies = gen_movies(movie_rng, n["movies"])
+    movies.to_csv(os.path.join(out_dir, "movie.csv"), index=False)
+    gen_links(link_rng, movies["movieId"].to_numpy()).to_csv(os.path.join(out_dir, "link.csv"), index=False)
+
+    genome_ids = np.sort(genome_rng.choice(movies["movieId"].to_numpy(), size=min(n["genome_movies"], len(movies)), replace=False))
+    genome_rows = write_genome(genome_rng, genome_ids, n["tags"], os.path.join(out_dir, "genome_scores.csv"))
+    rating_rows = write_ratings(rating_rng, movies["movieId"].to_numpy(), n["users"], n["ratings"], os.path.join(out_dir, "rating.csv"))
+
+    manifest = {
+        "scale": scale,
+        "seed": seed,
+        "movies": len(movies),
+        "genome_movies": len(genome_ids),
+        "tags": n["tags"],
+        "genome_rows": genome_rows,
+        "ratings": rating_rows,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def load_manifest(data_dir: str) -> dict:
+    path = os.path.join(data_dir, "manifest.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic MovieLens 20M shaped dataset")
+    parser.add_argument("--out", required=True, help="directory for the csv files")
+    parser.add_argument("--scale", default="1x", help="1x, 10x or any factor such as 0.05x")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.out, args.scale, args.seed), indent=2))
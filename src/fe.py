@@ -1,3 +1,4 @@
-from recommender import db, rcm
+from recommender import get_recommender
 
-print(db[0].title)
\ No newline at end of file
+rcm = get_recommender()
+print(rcm.movies[0].title)
\ No newline at end of file
@@ -2,8 +2,14 @@ import streamlit as st
 import pandas as pd
 import os
 import visualize
-from rapidfuzz import process
-from recommender import MOVIE_PATH, rcm
+from recommender import MOVIE_PATH, load_recommender
+from model_host import MODEL_STORE, attach_recommender
+from services.poster import get_manifest
+from services.thumbnail import (
+    CARD_SIZE, RETINA_SIZE, fit_image, load_thumbnail_index, size_name, thumbnail_index_mtime, thumbnail_path,
+)
+from services.search import TitleIndex
+from services.analytics import load_analytics, source_fingerprint
 from PIL import Image
 
 # ================== PATH CHUẨN ==================
@@ -17,44 +23,55 @@ def load_poster_fit(path: str, target_w: int = 130, target_h: int = 180):
     """
     Center-crop ảnh về đúng tỉ lệ rồi resize về target_w x target_h
     => Ảnh luôn full khung, không méo
+    Chỉ dùng khi poster chưa có thumbnail dựng sẵn (services/thumbnail.py)
     """
     img = Image.open(path).convert("RGB")
-    w, h = img.size
-
-    target_ratio = target_w / target_h
-    src_ratio = w / h
-
-    if src_ratio > target_ratio:
-        new_w = int(h * target_ratio)
-        left = (w - new_w) // 2
-        img = img.crop((left, 0, left + new_w, h))
-    else:
-        new_h = int(w / target_ratio)
-        top = (h - new_h) // 2
-        img = img.crop((0, top, w, top + new_h))
-
-    img = img.resize((target_w, target_h))
-    return img
+    return fit_image(img, target_w, target_h)
+
+poster_manifest = get_manifest(POSTER_DIR)
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_thumbnail_index(mtime_ns: int):
+    """Đọc thumbs.json một lần cho mỗi phiên bản file (khóa theo mtime), không đọc lại mỗi lần rerun"""
+    return load_thumbnail_index(POSTER_DIR)
+
+def thumbnail_for(movie_id):
+    """Thumbnail dựng sẵn của phim: bản retina (2x) nếu có, None nếu chưa dựng"""
+    entry = get_thumbnail_index(thumbnail_index_mtime(POSTER_DIR)).get(movie_id)
+    if entry is None:
+        return None
+    if size_name(*RETINA_SIZE) in entry.get("sizes", []):
+        return thumbnail_path(POSTER_DIR, movie_id, *RETINA_SIZE)
+    return thumbnail_path(POSTER_DIR, movie_id, *CARD_SIZE)
+DEFAULT_POSTER_PATH = os.path.join(POSTER_DIR, "default.jpg")
+HAS_DEFAULT_POSTER = os.path.exists(DEFAULT_POSTER_PATH)
+
+# ================== LOAD MODEL ==================
+@st.cache_resource(show_spinner="Đang tải mô hình gợi ý...")
+def get_rcm():
+    """Mỗi process chỉ nạp mô hình một lần, và chỉ khi trang gợi ý cần tới.
+    Có MODEL_STORE thì gắn vào mô hình do model_host.py publish (các process dùng
+    chung một bản trong bộ nhớ) và tự chuyển sang phiên bản mới khi được publish"""
+    if MODEL_STORE:
+        return attach_recommender(MODEL_STORE)
+    return load_recommender()
 
 # ================== LOAD DATA ==================
-movies_df = pd.read_csv(MOVIE_PATH)
-movie_titles = movies_df["title"].tolist()
+@st.cache_resource(show_spinner=False)
+def get_title_index():
+    """Chỉ mục tên phim (n-gram + tiền tố) và bảng movieId <-> title, dựng một lần"""
+    return TitleIndex.from_frame(pd.read_csv(MOVIE_PATH))
 
-# ================== SEARCH GỢI Ý ==================
-def search_suggest(query, movies, exclude_list=None, limit=10):
-    if exclude_list is None:
-        exclude_list = []
+title_index = get_title_index()
 
-    exclude_set = set(exclude_list)
-    candidates = [m for m in movies if m not in exclude_set]
-
-    results = process.extract(
+# ================== SEARCH GỢI Ý ==================
+def search_suggest(query, exclude_ids=None, limit=10):
+    """Trả về [(movieId, title)]: chấm điểm fuzzy trên các ứng viên từ chỉ mục, quét toàn bộ khi truy vấn ngắn hoặc ứng viên khớp yếu"""
+    return title_index.search(
         query,
-        candidates,
-        score_cutoff=60,
-        limit=limit
+        limit=limit,
+        exclude_ids=exclude_ids,
+        score_cutoff=60
     )
-    return [r[0] for r in results]
 
 # ================== SESSION ==================
 st.set_page_config(layout="wide")
@@ -117,22 +134,11 @@ elif page == "movie":
             if query:
                 suggestions = search_suggest(
                     query,
-                    movie_titles,
-                    exclude_list=[
-                        movies_df.loc[
-                            movies_df["movieId"] == mid, "title"
-                        ].values[0]
-                        for mid in st.session_state.selected_movies.keys()
-                    ]
+                    exclude_ids=st.session_state.selected_movies.keys()
                 )
 
-                for title in suggestions:
-                    if st.button(f"➕ {title}", key=f"add_{title}"):
-                        movie_id = int(
-                            movies_df.loc[
-                                movies_df["title"] == title, "movieId"
-                            ].values[0]
-                        )
+                for movie_id, title in suggestions:
+                    if st.button(f"➕ {title}", key=f"add_{movie_id}"):
                         st.session_state.selected_movies[movie_id] = 5
                         st.rerun()
 
@@ -152,7 +158,7 @@ elif page == "movie":
                 ratings_user_safe = [2 if r <= 1 else r for r in ratings_user]
 
                 try:
-                    recommendations = rcm.recommend(
+                    recommendations = get_rcm().recommend(
                         (selected_movie_ids, ratings_user_safe)
                     )
 
@@ -172,13 +178,11 @@ elif page == "movie":
                     for movie, score in recommendations:
                         movie_id = movie.id
 
-                        poster_path = os.path.join(POSTER_DIR, f"{movie_id}.jpg")
-                        fallback_path = os.path.join(POSTER_DIR, "default.jpg")
-
-                        if os.path.exists(poster_path):
-                            show_path = poster_path
-                        elif os.path.exists(fallback_path):
-                            show_path = fallback_path
+                        # Tra manifest thay vì gọi os.path.exists cho từng phim
+                        if poster_manifest.has_poster(movie_id):
+                            show_path = poster_manifest.path(movie_id)
+                        elif HAS_DEFAULT_POSTER:
+                            show_path = DEFAULT_POSTER_PATH
                         else:
                             show_path = None
 
@@ -186,7 +190,12 @@ elif page == "movie":
                             col_img, col_info = st.columns([1, 2])
 
                             with col_img:
-                                if show_path:
+                                thumb = thumbnail_for(movie_id)
+                                if thumb:
+                                    # Thumbnail dựng sẵn: gửi thẳng file nhỏ, không giải mã ảnh.
+                                    # Bản 2x hiển thị ở 130px để nét trên màn hình retina
+                                    st.image(thumb, width=CARD_SIZE[0])
+                                elif show_path:
                                     st.image(load_poster_fit(show_path))
                                 else:
                                     st.write("🖼️ No poster")
@@ -206,9 +215,7 @@ elif page == "movie":
             st.info("Bạn chưa chọn phim nào")
         else:
             for movie_id, rating in st.session_state.selected_movies.items():
-                title = movies_df.loc[
-                    movies_df["movieId"] == movie_id, "title"
-                ].values[0]
+                title = title_index.id2title[movie_id]
 
                 with st.container(border=True):
                     col_info, col_rating, col_action = st.columns([4, 3, 1])
@@ -239,6 +246,14 @@ elif page == "user":
     MOVIES_ANALYSIS_PATH = os.path.join(DATA_DIR, "movie.csv")
     AVG_RATINGS_ANALYSIS_PATH = os.path.join(DATA_DIR, "avg_rating.csv")
     RATINGS_PATH = os.path.join(DATA_DIR, "rating.csv")
+    ANALYTICS_PATH = os.path.join(DATA_DIR, "cache", "analytics.json")
+
+    # Bảng tổng hợp chỉ dựng lại khi movie.csv / avg_rating.csv thay đổi
+    analytics = load_analytics(
+        MOVIES_ANALYSIS_PATH,
+        AVG_RATINGS_ANALYSIS_PATH,
+        ANALYTICS_PATH
+    )
 
     st.subheader("🎬 Top 10 phim được đánh giá cao theo năm")
     year = st.number_input(
@@ -249,23 +264,35 @@ elif page == "user":
         step=1
     )
 
-    visualize.plot_top10_movies_by_year(
-        movie_path=MOVIES_ANALYSIS_PATH,
-        rating_path=AVG_RATINGS_ANALYSIS_PATH,
-        year=year
+    png = visualize.figure_png(
+        visualize.plot_top10_movies_by_year,
+        analytics,
+        analytics["key"],
+        year=int(year)
     )
+    if png:
+        st.image(png, use_container_width=True)
 
     st.markdown("---")
     st.subheader("🏷️ Top 10 thể loại phim phổ biến")
-    visualize.plot_top_genres(MOVIES_ANALYSIS_PATH)
+    st.image(
+        visualize.figure_png(visualize.plot_top_genres, analytics, analytics["key"]),
+        use_container_width=True
+    )
 
     st.markdown("---")
     st.subheader("📈 Xu hướng số lượng phim theo năm")
-    visualize.plot_movies_per_year(MOVIES_ANALYSIS_PATH)
+    st.image(
+        visualize.figure_png(visualize.plot_movies_per_year, analytics, analytics["key"]),
+        use_container_width=True
+    )
 
     st.markdown("---")
     st.subheader("⭐ Phân bố điểm đánh giá trung bình")
-    visualize.plot_rating_distribution(AVG_RATINGS_ANALYSIS_PATH)
+    st.image(
+        visualize.figure_png(visualize.plot_rating_distribution, analytics, analytics["key"]),
+        use_container_width=True
+    )
 
     # ===== DONUT TRANH CÃI =====
     st.markdown("---")
@@ -273,10 +300,12 @@ elif page == "user":
 
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        fig = visualize.plot_rating_controversy_donut(
-            rating_path=RATINGS_PATH
+        png = visualize.figure_png(
+            visualize.plot_rating_controversy_donut,
+            RATINGS_PATH,
+            source_fingerprint(RATINGS_PATH)
         )
-        st.pyplot(fig, use_container_width=False)
+        st.image(png)
 
     # ===== DONUT KỶ NGUYÊN =====
     st.markdown("---")
@@ -284,7 +313,9 @@ elif page == "user":
 
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        fig = visualize.plot_movie_eras_donut(
-            movies_path=MOVIES_ANALYSIS_PATH
+        png = visualize.figure_png(
+            visualize.plot_movie_eras_donut,
+            analytics,
+            analytics["key"]
         )
-        st.pyplot(fig, use_container_width=False)
\ No newline at end of file
+        st.image(png)
\ No newline at end of file
@@ -0,0 +1,333 @@
+"""Model host mode: one loader process builds the model and publishes it to a store
+directory as plain .npy files, every Streamlit / API worker maps those files read-only.
+The OS keeps a single copy of the pages however many workers attach, so memory no
+longer grows with the number of workers. Put the store on /dev/shm to keep it in RAM.
+
+    python src/model_host.py publish --store /dev/shm/film-model     #loader, rerun to publish a new version
+    MODEL_STORE=/dev/shm/film-model streamlit run src/fe1.py          #workers
+    python src/server.py --model-store /dev/shm/film-model
+
+Every publish writes a new version directory and then flips the CURRENT file, so a
+worker sees the old or the new model, never half of one. Attached workers poll CURRENT
+and swap their Recommender state when it changes.
+"""
+import argparse
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from dataclasses import asdict
+from typing import Optional
+import numpy as np
+from scipy.sparse import csr_matrix
+from recommender import ModelState, PhaseTimer, Recommender, RecommenderConfig, load_recommender
+from services.cache import ResultCache
+from services.catalog import Catalog
+from services.embedding import EmbeddingIndex
+from services.index import SimilarityIndex
+from services.neighbors import NeighborTable
+from services.quantize import QuantizedIndex
+from services.rerank import RankFeatures, Reranker, RerankWeights
+from services.shard import ShardedIndex
+
+#Store directory the workers attach to, workers load their own model when unset
+MODEL_STORE = os.getenv("MODEL_STORE")
+CURRENT_NAME = "CURRENT"
+META_NAME = "meta.json"
+TITLES_NAME = "titles.bin"
+#Old versions kept after a publish, for workers that have not swapped yet
+KEEP_VERSIONS = 2
+POLL_SECONDS = 5.0
+
+
+def _scorer_layers(scorer, index: SimilarityIndex) -> tuple[list[dict], dict[str, np.ndarray]]:
+    """Describe the scorer stack from the outside in, plus the arrays it owns"""
+    layers, arrays = [], {}
+    while scorer is not index:
+        if isinstance(scorer, Reranker):
+            features = scorer.features
+            stats_ids, stats_counts, prior_count, half_life = features.source
+            layers.append({
+                "kind": "rerank",
+                "weights": asdict(scorer.weights),
+                "n_candidates": scorer.n_candidates,
+                #What realign() rebuilds the features from after an update
+                "stats": stats_ids is not None,
+                "prior_count": prior_count,
+                "half_life": half_life,
+            })
+            arrays["rerank_quality"] = features.quality
+            arrays["rerank_popularity"] = features.popularity
+            arrays["rerank_recency"] = features.recency
+            if stats_ids is not None:
+                arrays["rerank_stats_ids"] = stats_ids
+                arrays["rerank_stats_counts"] = stats_counts
+            scorer = scorer.scorer
+        elif isinstance(scorer, EmbeddingIndex):
+            layers.append({"kind": "svd"})
+            arrays["embedding_E"] = scorer.E
+            arrays["embedding_V"] = scorer.V
+            scorer = scorer.base
+        elif isinstance(scorer, ShardedIndex):
+            layers.append({"kind": "sharded", "workers": scorer.workers, "mode": scorer.mode, "min_shard_nnz": scorer.min_shard_nnz})
+            scorer = scorer.base
+        elif isinstance(scorer, QuantizedIndex):
+            layers.append({"kind": "quantized", "precision": scorer.precision})
+            arrays["quantized_data"] = scorer.data
+            if scorer.scale is not None:
+                arrays["quantized_scale"] = scorer.scale
+            scorer = scorer.base
+        else:
+            raise RuntimeError(f"Cannot publish a {type(scorer).__name__} scorer")
+    return layers, arrays
+
+def _build_scorer(layers: list[dict], index: SimilarityIndex, load):
+    scorer = index
+    for layer in reversed(layers):
+        kind = layer["kind"]
+        if kind == "svd":
+            scorer = EmbeddingIndex(index, load("embedding_E"), load("embedding_V"))
+        elif kind == "sharded":
+            scorer = ShardedIndex(index, layer["workers"], layer["mode"], layer["min_shard_nnz"])
+        elif kind == "quantized":
+            scale = load("quantized_scale") if layer["precision"] == "uint8" else None
+            scorer = QuantizedIndex.from_arrays(index, layer["precision"], load("quantized_data"), scale)
+        elif kind == "rerank":
+            features = RankFeatures(load("rerank_quality"), load("rerank_popularity"), load("rerank_recency"))
+            stats = (load("rerank_stats_ids"), load("rerank_stats_counts")) if layer["stats"] else (None, None)
+            features.source = (*stats, layer["prior_count"], layer["half_life"])
+            scorer = Reranker(scorer, features, RerankWeights(**layer["weights"]), layer["n_candidates"])
+        else:
+            raise RuntimeError(f"Unknown scorer layer {kind}")
+    return scorer
+
+def read_current(store_dir: str) -> Optional[str]:
+    """Name of the published version, None before the first publish"""
+    try:
+        with open(os.path.join(store_dir, CURRENT_NAME), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def publish(state: ModelState, store_dir: str, tag_threshold: float = None, keep: int = KEEP_VERSIONS) -> str:
+    """Write state as a new version of the store and make it current. Returns the version name"""
+    os.makedirs(store_dir, exist_ok=True)
+    name = str(time.time_ns())
+    tmp_dir = os.path.join(store_dir, f"{name}.{os.getpid()}.tmp")
+    os.makedirs(tmp_dir)
+
+    index, movies = state.index, state.movies
+    X = index.X
+    layers, scorer_arrays = _scorer_layers(state.scorer, index)
+    #A quantized scorer replaces the float64 normalized matrix: it is neither rebuilt nor stored
+    normalized = index.has_normalized and not any(layer["kind"] == "quantized" for layer in layers)
+    arrays = {
+        "X_data": X.data,
+        "X_indices": X.indices,
+        "X_indptr": X.indptr,
+        "norms": index.norms,
+        "movie_ids": index.movie_ids,
+        "catalog_ids": movies.ids,
+        "catalog_years": movies.years,
+        "catalog_avg": movies.avg,
+        "catalog_genre_mask": movies.genre_mask,
+        "catalog_genre_codes": movies.genre_codes,
+        "catalog_genre_offsets": movies.genre_offsets,
+        "catalog_title_offsets": movies.title_offsets,
+    }
+    if normalized:
+        #Xn is X with scaled values (scale_rows), only its values are stored
+        Xn = index.Xn
+        if not (np.array_equal(X.indptr, Xn.indptr) and np.array_equal(X.indices, Xn.indices)):
+            raise RuntimeError("Normalized matrix is not laid out like the genome matrix")
+        arrays["Xn_data"] = Xn.data
+
+    tag2idx = state.embeder[1]
+    tag_ids = np.zeros(len(tag2idx), dtype=np.int64)
+    tag_ids[list(tag2idx.values())] = list(tag2idx)
+    arrays["tag_ids"] = tag_ids
+
+    if state.neighbors is not None:
+        arrays["neighbor_ids"] = state.neighbors.ids
+        arrays["neighbor_scores"] = state.neighbors.scores
+    arrays.update(scorer_arrays)
+
+    for key, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{key}.npy"), np.asarray(arr))
+    with open(os.path.join(tmp_dir, TITLES_NAME), "wb") as f:
+        f.write(movies.title_blob)
+    meta = {
+        "version": state.version,
+        "shape": list(X.shape),
+        "sorted_indices": bool(X.has_sorted_indices),
+        "normalized": normalized,
+        "genre_names": list(movies.genre_names),
+        "neighbors": state.neighbors is not None,
+        "scorer": layers,
+        "tag_threshold": tag_threshold,
+        "published": time.time(),
+    }
+    #meta.json last: a version directory without it is incomplete
+    with open(os.path.join(tmp_dir, META_NAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_dir, os.path.join(store_dir, name))
+
+    current = os.path.join(store_dir, CURRENT_NAME)
+    tmp = f"{current}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(name)
+    os.replace(tmp, current)
+    prune(store_dir, keep)
+    return name
+
+def prune(store_dir: str, keep: int = KEEP_VERSIONS):
+    """Delete all but the newest keep versions. Workers still mapping a deleted
+    version keep its pages until they swap, the files are only unlinked"""
+    current = read_current(store_dir)
+    versions = sorted(d for d in os.listdir(store_dir) if d.isdigit())
+    for name in versions[:max(len(versions) - keep, 0)]:
+        if name != current:
+            #Platforms that refuse to delete mapped files keep the directory for next time
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+def _map_titles(path: str):
+    """The title blob as a read-only mmap, slicing it gives bytes like the in-memory blob"""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def attach(store_dir: str, name: str = None) -> tuple[ModelState, dict]:
+    """(ModelState over read-only memory maps of a published version, its meta).
+    name defaults to the current version. Only the movieId / tagId dicts and the
+    catalog's sort order are rebuilt in this process"""
+    name = name or read_current(store_dir)
+    if name is None:
+        raise RuntimeError(f"No model published in {store_dir}")
+    version_dir = os.path.join(store_dir, name)
+    meta_path = os.path.join(version_dir, META_NAME)
+    if not os.path.exists(meta_path):
+        raise RuntimeError(f"Model version {name} in {store_dir} is incomplete")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    def load(key):
+        return np.load(os.path.join(version_dir, f"{key}.npy"), mmap_mode="r")
+
+    shape = tuple(meta["shape"])
+    indices, indptr = load("X_indices"), load("X_indptr")
+    X = csr_matrix((load("X_data"), indices, indptr), shape=shape, copy=False)
+    X.has_sorted_indices = meta["sorted_indices"]
+    #Published without it (quantized scorer): the index is attached already released
+    Xn = None
+    if meta["normalized"]:
+        Xn = csr_matrix((load("Xn_data"), indices, indptr), shape=shape, copy=False)
+        Xn.has_sorted_indices = meta["sorted_indices"]
+
+    movie_ids = load("movie_ids")
+    movie2idx = {int(m): i for i, m in enumerate(movie_ids)}
+    tag2idx = {int(t): i for i, t in enumerate(load("tag_ids"))}
+    index = SimilarityIndex.from_normalized(X, Xn, load("norms"), movie2idx, movie_ids)
+
+    movies = Catalog(
+        ids=load("catalog_ids"),
+        years=load("catalog_years"),
+        avg=load("catalog_avg"),
+        genre_mask=load("catalog_genre_mask"),
+        genre_names=meta["genre_names"],
+        genre_codes=load("catalog_genre_codes"),
+        genre_offsets=load("catalog_genre_offsets"),
+        title_blob=_map_titles(os.path.join(version_dir, TITLES_NAME)),
+        title_offsets=load("catalog_title_offsets"),
+    )
+    neighbors = None
+    if meta["neighbors"]:
+        neighbors = NeighborTable(load("neighbor_ids"), load("neighbor_scores"), movie2idx)
+    scorer = _build_scorer(meta["scorer"], index, load)
+    state = ModelState(movies, (movie2idx, tag2idx, X), index, scorer, neighbors, version=meta["version"])
+    return state, meta
+
+
+class ModelHandle:
+    """A worker's attachment to a model store: one Recommender whose state is
+    swapped to the newest published version by refresh(). Requests already running
+    finish on the state they took, the result cache drops the old version's entries"""
+    def __init__(self, store_dir: str, cache: Optional[ResultCache] = None):
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        timer = PhaseTimer()
+        with timer.phase("Attach model"):
+            self.name = read_current(store_dir)
+            state, meta = attach(store_dir, self.name)
+        self.recommender = Recommender.from_state(state, cache)
+        self.recommender.timings = timer.timings
+        if meta["tag_threshold"] is not None:
+            self.recommender.tag_threshold = meta["tag_threshold"]
+
+    def refresh(self) -> bool:
+        """Swap in the current version if it changed, True when it did"""
+        name = read_current(self.store_dir)
+        if name is None or name == self.name:
+            return False
+        with self.lock:
+            if name == self.name:
+                return False
+            state, _ = attach(self.store_dir, name)
+            #Under the update lock so an update() in flight is not lost or applied to the old state.
+            #One reference assignment, readers see the old or the new state
+            with self.recommender._update_lock:
+                self.recommender.state = state
+            self.name = name
+        return True
+
+    def watch(self, interval: float = POLL_SECONDS) -> threading.Thread:
+        """Call refresh() every interval seconds in a daemon thread until close()"""
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    if self.refresh():
+                        print(f"Model store: attached version {self.name}")
+                except (OSError, RuntimeError) as e:
+                    #A version pruned or half written under us, try again next round
+                    print(f"Model store: refresh failed: {e}")
+
+        thread = threading.Thread(target=loop, name="model-store-watch", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self._stop.set()
+
+
+def attach_recommender(store_dir: str, interval: float = POLL_SECONDS) -> Recommender:
+    """Recommender over the store that follows new versions as they are published"""
+    handle = ModelHandle(store_dir)
+    if interval:
+        handle.watch(interval)
+    return handle.recommender
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish the recommender model for worker processes to attach")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pub = sub.add_parser("publish", help="load the model from the data files and publish a new version")
+    pub.add_argument("--store", default=MODEL_STORE, required=MODEL_STORE is None)
+    pub.add_argument("--keep", type=int, default=KEEP_VERSIONS, help="versions kept for workers still attached")
+    status = sub.add_parser("status", help="show the current version")
+    status.add_argument("--store", default=MODEL_STORE, required=MODEL_STORE is None)
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        config = RecommenderConfig()
+        rcm = load_recommender(config)
+        name = publish(rcm.state, args.store, config.tag_threshold, args.keep)
+        print(f"Published {rcm.version} as {name}")
+    else:
+        name = read_current(args.store)
+        if name is None:
+            raise SystemExit(f"No model published in {args.store}")
+        with open(os.path.join(args.store, name, META_NAME), "r", encoding="utf-8") as f:
+            print(json.dumps({"name": name, **json.load(f)}, indent=2))
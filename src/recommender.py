@@ -1,11 +1,25 @@
 from services.poster import get_poster,craw_poster_image, get_poster_path, POSTER_PATH
-from services.score import calc_avg_score
+from services.catalog import Movie, Catalog, build_catalog
+from services.score import calc_avg_score, load_rating_stats
 from services.tag import *
+from services.index import SimilarityIndex
+from services.neighbors import NeighborTable, load_neighbor_table
+from services.ann import IVFIndex
+from services.embedding import EmbeddingIndex, load_embedding_index
+from services.shard import MIN_SHARD_NNZ, ShardedIndex
+from services.rerank import Reranker, RankFeatures, RerankWeights, N_CANDIDATES
+from services.quantize import QuantizedIndex
+from services.update import genome_delta, upsert_rows, upsert_neighbors, upsert_embedding, catalog_delta
+from services.cache import ResultCache, canonical_profile
+from services.metrics import METRICS, PROFILE_DIR, REQUESTS_TOTAL, CACHE_TOTAL, LOAD_SECONDS, RequestProfile, stage
 from typing import Optional
 import os
-from dataclasses import dataclass
+import time
+import threading
 import pandas as pd
-import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from scipy.sparse import csr_matrix
 
 TAG_PATH = "src/data/genome_scores.csv"
@@ -13,97 +27,361 @@ LINK_MOVIE_TMDB = "src/data/link.csv"
 RATING_PATH = "src/data/rating.csv"
 MOVIE_PATH = "src/data/movie.csv"
 RESULT_RATING_PATH = "src/data/avg_rating.csv"
+MATRIX_CACHE_DIR = "src/data/cache/genome"
+NEIGHBOR_CACHE_DIR = "src/data/cache/neighbors"
+EMBEDDING_CACHE_DIR = "src/data/cache/embedding"
+TAG_THRESHOLD = 0.3
+#"sparse" scores with the exact genome matrix, "svd" with the low-rank float32 embedding,
+#"sharded" with the exact matrix split in row blocks over SCORING_WORKERS cores,
+#"quantized" with a SCORING_PRECISION copy of the exact matrix
+SCORING_BACKEND = os.getenv("SCORING_BACKEND", "sparse")
+EMBEDDING_RANK = int(os.getenv("EMBEDDING_RANK", "128"))
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "0")) or None
+SHARD_MODE = os.getenv("SHARD_MODE", "thread")
+#Fewest matrix nonzeros per shard, the matrix is scored in place below twice this
+SHARD_MIN_NNZ = int(os.getenv("SHARD_MIN_NNZ", str(MIN_SHARD_NNZ)))
+#Value type of the "quantized" backend: float32, float16 or uint8
+SCORING_PRECISION = os.getenv("SCORING_PRECISION", "float32")
+#Re-rank the tag similarity candidates with rating, popularity and recency
+RERANK = os.getenv("RERANK", "0") == "1"
+
+@dataclass(frozen=True)
+class ModelState:
+    """Everything a query reads. Swapped as a whole and never mutated, so a request
+    that took a reference sees one consistent model while an update is applied"""
+    movies: Catalog
+    embeder: tuple[dict[int, int], dict[int, int], csr_matrix]
+    index: SimilarityIndex
+    scorer: "SimilarityIndex | EmbeddingIndex | ShardedIndex | QuantizedIndex | Reranker"
+    neighbors: Optional[NeighborTable] = None
+    ann: Optional[IVFIndex] = None
+    #Identifies the model artefacts, cached results of another version are never served
+    version: str = "0"
+
+def _state_field(name: str) -> property:
+    def get(self):
+        return getattr(self.state, name)
+    def set(self, value):
+        with self._update_lock:
+            self.state = replace(self.state, **{name: value})
+    return property(get, set)
+
 
-@dataclass
-class Movie:
-    id: int
-    title: str
-    year: int
-    genres: list[str]
-    average_score: float
-    poster_path: Optional[str] = None
-
-    def show(self):
-        genres = ", ".join(self.genres)
-        poster = self.poster_path or "N/A"
-
-        print(
-            f" {self.id} {self.title} ({self.year})\n"
-            f" Rating: {self.average_score}\n"
-            f" Genres: {genres}\n"
-            f" Poster: {poster}"
-        )
 class Recommender:
-    movies : list[Movie]
-    embeder : tuple[dict[int, int], dict[int, int], csr_matrix]
-    movie_map: dict
-    def __init__(self, movies : list[Movie], embeder: tuple[dict[int, int], dict[int, int], csr_matrix]):
-        self.movies = movies
-        self.embeder = embeder
-        self.movie_map: dict[int, Movie] = {m.id: m for m in movies}
-    def get_movie(self, movie_id: int):
-        return self.movie_map.get(movie_id)
-    def recommend(self, rated_movie: tuple[list[int], list[int]])->list[tuple[Movie, float]]:
+    state: ModelState
+    timings: dict[str, float]
+    cache: Optional[ResultCache]
+    tag_threshold: float = TAG_THRESHOLD
+    profile_dir: Optional[str] = PROFILE_DIR
+    movies = _state_field("movies")
+    embeder = _state_field("embeder")
+    index = _state_field("index")
+    scorer = _state_field("scorer")
+    neighbors = _state_field("neighbors")
+    ann = _state_field("ann")
+    version = _state_field("version")
+    def __init__(
+        self,
+        movies : Catalog,
+        embeder: tuple[dict[int, int], dict[int, int], csr_matrix],
+        cache: Optional[ResultCache] = None,
+    ):
+        index = SimilarityIndex(embeder[2], embeder[0])
+        self._setup(ModelState(movies, embeder, index, index), cache)
+    @classmethod
+    def from_state(cls, state: ModelState, cache: Optional[ResultCache] = None) -> "Recommender":
+        """A recommender over an already built model, e.g. one attached from a model store"""
+        rcm = cls.__new__(cls)
+        rcm._setup(state, cache)
+        return rcm
+    def _setup(self, state: ModelState, cache: Optional[ResultCache]):
+        self.state = state
+        self.timings = {}
+        self.cache = cache if cache is not None else ResultCache()
+        self.updates = 0
+        self._update_lock = threading.RLock()
+        self._updater = None
+    def get_movie(self, movie_id: int) -> Optional[Movie]:
+        """A fresh Movie view of the catalog row, None for unknown ids"""
+        return self.state.movies.get(movie_id)
+    def recommend(
+        self,
+        rated_movie: tuple[list[int], list[int]],
+        k: int = 10,
+        approximate: bool = False,
+        n_probe: int = 8,
+    )->list[tuple[Movie, float]]:
         """Return a list of movie which similar to input list
         input list need to be a list of movie id and how many stars user rated
-        Example: ([1, 10, 20], [1, 4, 5]) mean get recommend for movie id 1 with 1 stars, etc """
-        results = get_top_k(rated_movie, self.embeder[2], self.embeder[0], k = 10)
-        q_res = []
-        for res in results:
-            movieid = res[0]
-            confident = res[1]
-            q_res.append(tuple([self.get_movie(movieid), confident]))
+        Example: ([1, 10, 20], [1, 4, 5]) mean get recommend for movie id 1 with 1 stars, etc
+        approximate=True searches only the n_probe nearest IVF lists (built on first use)
+        Results are cached per canonical profile, see cache_stats()
+        With PROFILE_DIR set every call is also cProfiled into a .prof file there"""
+        METRICS.inc(REQUESTS_TOTAL, kind="recommend")
+        with RequestProfile(self.profile_dir is not None) as prof:
+            results = self._recommend(self.state, rated_movie, k, approximate, n_probe)
+        prof.dump(self.profile_dir, "recommend")
+        return results
+    def _recommend(self, state: ModelState, rated_movie, k, approximate, n_probe)->list[tuple[Movie, float]]:
+        key = None
+        if self.cache is not None:
+            self.cache.set_version(state.version)
+            profile = canonical_profile(rated_movie[0], rated_movie[1], state.index.movie2idx)
+            if profile is not None:
+                key = (profile, k, type(state.scorer).__name__, n_probe if approximate else None)
+                results = self.cache.get(key)
+                METRICS.inc(CACHE_TOTAL, outcome="miss" if results is None else "hit")
+                if results is not None:
+                    with stage("materialize"):
+                        return [(state.movies.get(movieid), confident) for movieid, confident in results]
+
+        if approximate:
+            ann = state.ann
+            if ann is None:
+                exact = self._exact_scorer(state)
+                ann = IVFIndex(state.index, quantized=exact if isinstance(exact, QuantizedIndex) else None)
+                with self._update_lock:
+                    #Only attach it if no update replaced the model meanwhile
+                    if self.state is state:
+                        self.state = replace(state, ann=ann)
+            results = ann.top_k(rated_movie, k, n_probe)
+        else:
+            results = state.scorer.top_k(rated_movie, k)
+        if key is not None:
+            self.cache.put(key, results, version=state.version)
+        with stage("materialize"):
+            q_res = []
+            for res in results:
+                movieid = res[0]
+                confident = res[1]
+                q_res.append(tuple([state.movies.get(movieid), confident]))
         return q_res
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
+    def similar(self, movie_id: int, k: int = 10)->list[tuple[Movie, float]]:
+        """Movies most similar to a single movie, served from the precomputed
+        neighbour table when it is loaded and deep enough, else by a full scan"""
+        METRICS.inc(REQUESTS_TOTAL, kind="similar")
+        state = self.state
+        if k <= 0:
+            return []
+        if state.neighbors is not None and k <= state.neighbors.n_neighbors:
+            results = state.neighbors.similar(movie_id, k)
+        elif movie_id in state.index.movie2idx:
+            results = self._exact_scorer(state).top_k(([movie_id], [1]), k)
+        else:
+            results = []
+        with stage("materialize"):
+            return [(state.movies.get(movieid), confident) for movieid, confident in results]
+    @staticmethod
+    def _exact_scorer(state: ModelState):
+        """The float64 index, or the quantized copy that replaced it (never re-ranked)"""
+        if state.index.has_normalized:
+            return state.index
+        scorer = state.scorer.scorer if isinstance(state.scorer, Reranker) else state.scorer
+        if not isinstance(scorer, QuantizedIndex):
+            raise RuntimeError("The normalized matrix was released but no quantized scorer holds a copy")
+        return scorer
+    def recommend_many(self, rated_movies: list[tuple[list[int], list[int]]], k: int = 10)->list[list[tuple[Movie, float]]]:
+        """Batched recommend: one result list per (movieids, stars) profile, in input order.
+        Profiles are scored together with one sparse matmul per batch"""
+        METRICS.inc(REQUESTS_TOTAL, len(rated_movies), kind="recommend_many")
+        state = self.state
+        batch = state.scorer.top_k_many(rated_movies, k)
+        with stage("materialize", mode="batch"):
+            return [
+                [(state.movies.get(movieid), confident) for movieid, confident in results]
+                for results in batch
+            ]
+    def update(
+        self,
+        genome: Optional[pd.DataFrame] = None,
+        movies: Optional[pd.DataFrame] = None,
+        background: bool = False,
+    ) -> "str | Future":
+        """Add or replace movies without reloading anything.
+        genome: rows in genome_scores.csv layout (movieId, tagId, relevance), each movie
+        listed gets its whole tag vector replaced or is appended to the matrix.
+        movies: rows in movie.csv layout (movieId, title, genres, optional avg).
+        Only the changed rows are normalized; the neighbour table, the low-rank embedding
+        and the sharded blocks are patched or rebuilt from the new matrix, the IVF lists
+        are rebuilt on next use and the result cache is invalidated by the version bump.
+        Readers keep the previous ModelState until the new one is swapped in.
+        Returns the new version, or a Future of it when background=True"""
+        if background:
+            with self._update_lock:
+                if self._updater is None:
+                    self._updater = ThreadPoolExecutor(max_workers=1, thread_name_prefix="update")
+            return self._updater.submit(self.update, genome, movies)
+
+        with self._update_lock, stage("update"):
+            state = self.state
+            catalog = state.movies
+            if movies is not None and len(movies):
+                catalog = catalog.upsert(catalog_delta(movies, catalog))
+
+            index, embeder, scorer, neighbors, ann = state.index, state.embeder, state.scorer, state.neighbors, state.ann
+            if genome is not None and len(genome):
+                movie_ids, D, tag2idx = genome_delta(genome, state.embeder[1], self.tag_threshold)
+                unknown = movie_ids[catalog.rows_of(movie_ids) < 0]
+                if len(unknown):
+                    raise RuntimeError(f"Movies {unknown.tolist()} are not in the catalog, pass their movie rows too")
+                index, rows = upsert_rows(state.index, movie_ids, D)
+                replaced = movie_ids[rows < len(state.index)]
+                embeder = (index.movie2idx, tag2idx, index.X)
+                if neighbors is not None:
+                    neighbors = upsert_neighbors(neighbors, index, rows, replaced)
+                scorer = self._rescore(scorer, index, rows)
+                ann = None
+            if isinstance(scorer, Reranker):
+                #Features follow the matrix row order and the catalog averages
+                scorer = Reranker(
+                    scorer.scorer,
+                    scorer.features.realign(index.movie_ids, catalog),
+                    scorer.weights,
+                    scorer.n_candidates,
+                )
+
+            self.updates += 1
+            version = f"{state.version.partition('+')[0]}+u{self.updates}"
+            self.state = ModelState(catalog, embeder, index, scorer, neighbors, ann, version)
+            return version
+    def _rescore(self, scorer, index: SimilarityIndex, rows):
+        """The scorer of the same kind over the updated index"""
+        if isinstance(scorer, Reranker):
+            return Reranker(self._rescore(scorer.scorer, index, rows), scorer.features, scorer.weights, scorer.n_candidates)
+        if isinstance(scorer, EmbeddingIndex):
+            return upsert_embedding(scorer, index, rows)
+        if isinstance(scorer, ShardedIndex):
+            #The old pool is shut down once the last reader drops the old state
+            return ShardedIndex(index, scorer.workers, scorer.mode, scorer.min_shard_nnz)
+        if isinstance(scorer, QuantizedIndex):
+            quantized = QuantizedIndex(index, scorer.precision)
+            index.release_normalized()
+            return quantized
+        return index
+
+
+@dataclass
+class RecommenderConfig:
+    tag_path: str = TAG_PATH
+    movie_path: str = MOVIE_PATH
+    rating_path: str = RATING_PATH
+    result_rating_path: str = RESULT_RATING_PATH
+    matrix_cache_dir: str = MATRIX_CACHE_DIR
+    neighbor_cache_dir: str = NEIGHBOR_CACHE_DIR
+    embedding_cache_dir: str = EMBEDDING_CACHE_DIR
+    tag_threshold: float = TAG_THRESHOLD
+    scoring_backend: str = SCORING_BACKEND
+    embedding_rank: int = EMBEDDING_RANK
+    scoring_workers: Optional[int] = SCORING_WORKERS
+    shard_mode: str = SHARD_MODE
+    shard_min_nnz: int = SHARD_MIN_NNZ
+    precision: str = SCORING_PRECISION
+    rerank: bool = RERANK
+    rerank_candidates: int = N_CANDIDATES
+    rerank_weights: RerankWeights = field(default_factory=RerankWeights)
+    neighbors: bool = True
+
+
+class PhaseTimer:
+    """Wall time of each named startup phase, printed as it finishes and
+    exported as the recommender_load_seconds gauge"""
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        print(f"{name}....")
+        start = time.perf_counter()
+        yield
+        self.timings[name] = time.perf_counter() - start
+        METRICS.set(LOAD_SECONDS, self.timings[name], phase=name)
+        print(f"{name} done in {self.timings[name]:.3f}s")
+
+    def report(self) -> str:
+        total = sum(self.timings.values())
+        lines = [f" {name:<24}{sec:8.3f}s" for name, sec in self.timings.items()]
+        lines.append(f" {'total':<24}{total:8.3f}s")
+        return "\n".join(lines)
+
 
+def load_recommender(config: Optional[RecommenderConfig] = None) -> Recommender:
+    """Build a Recommender from the data files. Nothing is loaded at import time,
+    this is where all the expensive work happens; per phase timings end up in rcm.timings"""
+    if config is None:
+        config = RecommenderConfig()
+    timer = PhaseTimer()
 
-#Poster is enough
-print("Checking for poster....")
-#craw_poster_image(LINK_MOVEID_TMDB, max_workers=20)
-print("Poster init done")
+    with timer.phase("Average rating"):
+        #Only lines appended to rating.csv since the last run are aggregated
+        if os.path.exists(config.rating_path) or not os.path.exists(config.result_rating_path):
+            calc_avg_score(config.rating_path, config.result_rating_path)
 
+    with timer.phase("Tag matrix"):
+        movieidx, tagidx, matrx = load_matrix(config.tag_path, config.matrix_cache_dir, config.tag_threshold)
 
+    with timer.phase("Movie catalog"):
+        db = build_catalog(config.movie_path, config.result_rating_path)
 
-#Is average score caculated
-print("Checking for avarage rating from user...")
-if not os.path.exists(RESULT_RATING_PATH):
-    calc_avg_score(RATING_PATH, RESULT_RATING_PATH)
-print("Average score check done")
+    with timer.phase("Similarity index"):
+        rcm = Recommender(db, (movieidx, tagidx, matrx))
 
-#Init vector for tag
-print("Embeding tag....")
-movieidx, tagidx, matrx = init_matrix(TAG_PATH)
-print("Tag embed.")
+    key = matrix_fingerprint(config.tag_path, config.tag_threshold)
+    if config.neighbors:
+        #Item to item table for "more like this"
+        with timer.phase("Neighbour table"):
+            rcm.neighbors = load_neighbor_table(rcm.index, config.neighbor_cache_dir, key)
 
+    if config.scoring_backend == "svd":
+        with timer.phase("Low-rank embedding"):
+            rcm.scorer = load_embedding_index(rcm.index, config.embedding_cache_dir, key, config.embedding_rank)
+    elif config.scoring_backend == "sharded":
+        with timer.phase("Sharded index"):
+            rcm.scorer = ShardedIndex(rcm.index, config.scoring_workers, config.shard_mode, config.shard_min_nnz)
+    elif config.scoring_backend == "quantized":
+        with timer.phase("Quantized index"):
+            rcm.scorer = QuantizedIndex(rcm.index, config.precision)
+            #Queries score the reduced copy, the float64 one is dropped for good
+            rcm.index.release_normalized()
 
-#load all data to ram
-movies = pd.read_csv(MOVIE_PATH)
-ratings = pd.read_csv(RESULT_RATING_PATH)
+    if config.rerank:
+        with timer.phase("Re-rank features"):
+            #Rating counts come from the stats store the average phase just refreshed
+            stats = load_rating_stats(config.rating_path)
+            features = RankFeatures.build(rcm.index.movie_ids, rcm.movies, stats.movie_ids, stats.counts)
+            rcm.scorer = Reranker(rcm.scorer, features, config.rerank_weights, config.rerank_candidates)
 
-df = movies.merge(ratings, on="movieId", how="left")
+    rcm.tag_threshold = config.tag_threshold
+    rcm.timings = timer.timings
+    backend = config.scoring_backend + (f"-{config.precision}" if config.scoring_backend == "quantized" else "")
+    rcm.version = f"{key}-{backend}" + ("-rerank" if config.rerank else "")
+    print("Recommender ready:\n" + timer.report())
+    return rcm
 
-#Create in-ram database
-db = []
-for _, row in df.iterrows():
-    raw_title = row["title"]
 
-    m = re.search(r"\((\d{4})\)$", raw_title)
-    if m:
-        year = int(m.group(1))
-        title = raw_title[:m.start()].strip()
-    else:
-        year = None
-        title = raw_title
+_default: Optional[Recommender] = None
+_default_lock = threading.Lock()
 
-    new_movie = Movie(
-        id=row["movieId"],
-        title=title,
-        year=year,
-        genres=row["genres"].split("|"),
-        average_score=row["avg"],
-        poster_path=get_poster_path(row["movieId"]),
-    )
+def get_recommender(config: Optional[RecommenderConfig] = None) -> Recommender:
+    """Process wide recommender, loaded on the first call (thread safe)"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = load_recommender(config)
+    return _default
 
-    db.append(new_movie)
+def warm_up(config: Optional[RecommenderConfig] = None) -> threading.Thread:
+    """Start loading the process wide recommender in a background thread"""
+    thread = threading.Thread(target=get_recommender, args=(config,), daemon=True)
+    thread.start()
+    return thread
 
-#Create recommender
-rcm = Recommender(db, (movieidx, tagidx, matrx))
+def __getattr__(name: str):
+    #Old entry points did `from recommender import rcm, db`, keep them working but lazy
+    if name == "rcm":
+        return get_recommender()
+    if name == "db":
+        return get_recommender().movies
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
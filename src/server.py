@@ -0,0 +1,243 @@
+"""Standalone recommendation service.
+
+One warm model process that many front ends can share:
+    python src/server.py --port 8080
+
+POST /recommend        {"movie_ids": [1, 10], "stars": [5, 3], "k": 10}
+GET  /similar/{id}?k=10      k in [1, MAX_K], larger values are capped
+GET  /movie/{id}
+GET  /stats
+GET  /metrics          Prometheus text, ?format=json for json
+
+Add "profile": true to a /recommend body to get a cProfile report of that request
+With --model-store (or MODEL_STORE) the model is attached from model_host.py's store
+instead of loaded, so several service processes share one copy of it
+"""
+import argparse
+import asyncio
+import math
+import time
+from aiohttp import web
+from recommender import Recommender, RecommenderConfig, get_recommender
+from model_host import MODEL_STORE, attach_recommender
+from services.catalog import Movie
+from services.metrics import METRICS, RequestProfile
+
+METRICS.describe("http_request_seconds", "Wall time of one HTTP request by route")
+#Largest k a request may ask for, bounds the work and the response size
+MAX_K = 100
+
+try:
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    #orjson is in requirements.txt, stdlib json only keeps a bare environment serving
+    import json
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def movie_json(movie: Movie) -> dict:
+    score = movie.average_score
+    return {
+        "movieId": movie.id,
+        "title": movie.title,
+        "year": movie.year,
+        "genres": movie.genres,
+        "average_score": None if score is None or math.isnan(score) else score,
+        "poster_path": movie.poster_path,
+    }
+
+def results_json(results: list[tuple[Movie, float]]) -> list[dict]:
+    return [{**movie_json(movie), "score": score} for movie, score in results]
+
+def json_response(obj, status: int = 200) -> web.Response:
+    return web.Response(body=dumps(obj), status=status, content_type="application/json")
+
+
+class MicroBatcher:
+    """Collects concurrent recommend requests for up to window seconds (or max_batch
+    requests) and scores them with one Recommender.recommend_many call off the event loop"""
+    def __init__(self, rcm: Recommender, window: float = 0.005, max_batch: int = 256):
+        self.rcm = rcm
+        self.window = window
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.batches = 0
+        self.requests = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, profile: tuple[list[int], list[int]], k: int):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((profile, k, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            #One matmul per batch, so everything in it is scored up to the largest k
+            k = max(item[1] for item in batch)
+            profiles = [item[0] for item in batch]
+            try:
+                results = await loop.run_in_executor(None, self.rcm.recommend_many, profiles, k)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, item_k, future), res in zip(batch, results):
+                if not future.done():
+                    future.set_result(res[:item_k])
+
+
+async def recommend(request: web.Request) -> web.Response:
+    try:
+        body = await request.json()
+        movie_ids = [int(m) for m in body["movie_ids"]]
+        stars = [float(s) for s in body.get("stars", [5] * len(movie_ids))]
+        k = int(body.get("k", 10))
+    except (ValueError, KeyError, TypeError):
+        return json_response({"error": "expected {movie_ids: [...], stars: [...], k: int}"}, 400)
+    if len(movie_ids) != len(stars) or not movie_ids:
+        return json_response({"error": "movie_ids and stars must be non empty and the same length"}, 400)
+    if k <= 0:
+        return json_response({"error": "k must be positive"}, 400)
+    k = min(k, MAX_K)
+
+    if body.get("profile"):
+        #Scored on its own, outside the micro-batch, so the profile is this request only
+        def profiled():
+            with RequestProfile(True) as prof:
+                try:
+                    results = request.app["rcm"].recommend((movie_ids, stars), k)
+                except RuntimeError:
+                    #No known movie in the profile: empty results, as the batched path gives
+                    results = []
+            return results, prof.report()
+        results, report = await asyncio.get_running_loop().run_in_executor(None, profiled)
+        return json_response({"results": results_json(results), "profile": report})
+
+    results = await request.app["batcher"].submit((movie_ids, stars), k)
+    return json_response({"results": results_json(results)})
+
+async def similar(request: web.Request) -> web.Response:
+    try:
+        movie_id = int(request.match_info["movie_id"])
+        k = int(request.query.get("k", 10))
+    except ValueError:
+        return json_response({"error": "movie id and k must be integers"}, 400)
+    if k <= 0:
+        return json_response({"error": "k must be positive"}, 400)
+    k = min(k, MAX_K)
+    rcm: Recommender = request.app["rcm"]
+    if rcm.get_movie(movie_id) is None:
+        return json_response({"error": f"unknown movie {movie_id}"}, 404)
+    return json_response({"results": results_json(rcm.similar(movie_id, k))})
+
+async def movie(request: web.Request) -> web.Response:
+    try:
+        movie_id = int(request.match_info["movie_id"])
+    except ValueError:
+        return json_response({"error": "movie id must be an integer"}, 400)
+    found = request.app["rcm"].get_movie(movie_id)
+    if found is None:
+        return json_response({"error": f"unknown movie {movie_id}"}, 404)
+    return json_response(movie_json(found))
+
+async def stats(request: web.Request) -> web.Response:
+    batcher: MicroBatcher = request.app["batcher"]
+    rcm: Recommender = request.app["rcm"]
+    return json_response({
+        "uptime_s": time.monotonic() - request.app["started"],
+        "batches": batcher.batches,
+        "requests": batcher.requests,
+        "mean_batch": batcher.requests / batcher.batches if batcher.batches else 0,
+        "load_timings": rcm.timings,
+        "cache": rcm.cache_stats(),
+    })
+
+
+async def metrics(request: web.Request) -> web.Response:
+    if request.query.get("format") == "json":
+        return json_response(METRICS.to_dict())
+    return web.Response(text=METRICS.to_prometheus(), content_type="text/plain", charset="utf-8")
+
+@web.middleware
+async def timed(request: web.Request, handler):
+    #Labelled by route pattern, not raw path, to keep the series count bounded
+    route = request.match_info.route.resource
+    with METRICS.timer("http_request_seconds", route=route.canonical if route else "unmatched"):
+        return await handler(request)
+
+
+def create_app(
+    rcm: Recommender = None,
+    config: RecommenderConfig = None,
+    window: float = 0.005,
+    max_batch: int = 256,
+    model_store: str = MODEL_STORE,
+) -> web.Application:
+    """The model is loaded once at startup (in a worker thread), not per request"""
+    app = web.Application(middlewares=[timed])
+
+    async def on_startup(app):
+        model = rcm
+        if model is None and model_store:
+            model = await asyncio.get_running_loop().run_in_executor(None, attach_recommender, model_store)
+        elif model is None:
+            model = await asyncio.get_running_loop().run_in_executor(None, get_recommender, config)
+        app["rcm"] = model
+        app["batcher"] = MicroBatcher(model, window, max_batch)
+        app["batcher"].start()
+        app["started"] = time.monotonic()
+
+    async def on_cleanup(app):
+        await app["batcher"].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/recommend", recommend)
+    app.router.add_get("/similar/{movie_id}", similar)
+    app.router.add_get("/movie/{movie_id}", movie)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Movie recommendation service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--window-ms", type=float, default=5.0, help="micro-batch collection window")
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--model-store", default=MODEL_STORE, help="attach to a store published by model_host.py")
+    args = parser.parse_args()
+    app = create_app(window=args.window_ms / 1000, max_batch=args.max_batch, model_store=args.model_store)
+    web.run_app(app, host=args.host, port=args.port)
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from scipy.stats import gaussian_kde
+
+ANALYTICS_VERSION = 1
+YEAR_PATTERN = r"\((\d{4})\)"
+RATING_BINS = 20
+#(label, first year not in the era), same buckets as the era donut
+ERAS = [
+    ("Cổ điển (<1980)", 1980),
+    ("Giao thời (80s–90s)", 2000),
+    ("Hiện đại (2000s)", 2015),
+    ("Mới nhất (2015+)", None),
+]
+
+
+def source_fingerprint(*paths: str) -> str:
+    parts = [f"v{ANALYTICS_VERSION}"]
+    for path in paths:
+        st = os.stat(path)
+        parts.append(f"{st.st_size}-{st.st_mtime_ns}")
+    return "-".join(parts)
+
+def build_analytics(movie_path: str, rating_path: str) -> dict:
+    """Every aggregate the analytics page plots, computed in one pass over movie.csv
+    and avg_rating.csv. Plain lists and dicts so it serializes to a small json file"""
+    movies = pd.read_csv(movie_path)
+    ratings = pd.read_csv(rating_path)
+    movies["year"] = movies["title"].str.extract(YEAR_PATTERN, expand=False).astype(float)
+
+    #Top 10 of every year, same ranking as the old per-request groupby
+    df = movies.merge(ratings, on="movieId", how="inner").dropna(subset=["year"])
+    per_title = df.groupby(["year", "title"], as_index=False)["avg"].mean()
+    per_title = per_title.sort_values(["year", "avg"], ascending=[True, False], kind="stable")
+    top10 = per_title.groupby("year").head(10)
+    top10_by_year = {
+        str(int(year)): [[title, float(avg)] for title, avg in zip(group["title"], group["avg"])]
+        for year, group in top10.groupby("year")
+    }
+
+    genres = movies["genres"].str.split("|").explode()
+    genre_counts = genres.value_counts()
+
+    per_year = movies["year"].value_counts().sort_index()
+
+    avg = ratings["avg"].dropna().to_numpy(np.float64)
+    counts, edges = np.histogram(avg, bins=RATING_BINS)
+    #Same curve pandas' plot(kind="kde") draws: scott bandwidth on a 1000 point grid
+    lo, hi = avg.min(), avg.max()
+    grid = np.linspace(lo - 0.5 * (hi - lo), hi + 0.5 * (hi - lo), 1000)
+    density = gaussian_kde(avg)(grid) if len(avg) > 1 else np.zeros_like(grid)
+
+    years = movies["year"].dropna()
+    eras = []
+    prev = None
+    for label, stop in ERAS:
+        mask = np.ones(len(years), dtype=bool)
+        if prev is not None:
+            mask &= years >= prev
+        if stop is not None:
+            mask &= years < stop
+        eras.append([label, int(mask.sum())])
+        prev = stop
+
+    return {
+        "top10_by_year": top10_by_year,
+        "genre_counts": [[g, int(c)] for g, c in genre_counts.items()],
+        "movies_per_year": [[int(y), int(c)] for y, c in per_year.items()],
+        "rating_hist": {"counts": counts.tolist(), "edges": edges.tolist()},
+        "rating_kde": {"x": grid.tolist(), "y": density.tolist()},
+        "eras": eras,
+    }
+
+def save_analytics(out_path: str, key: str, analytics: dict):
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"key": key, **analytics}, f, ensure_ascii=False)
+    os.replace(tmp, out_path)
+
+
+_loaded: dict[str, tuple[str, dict]] = {}
+_loaded_lock = threading.Lock()
+
+def load_analytics(movie_path: str, rating_path: str, out_path: str) -> dict:
+    """The materialized aggregates for these sources. Rebuilt only when a source file
+    changed, read from disk once per process and then served from memory"""
+    key = source_fingerprint(movie_path, rating_path)
+    with _loaded_lock:
+        cached = _loaded.get(out_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        analytics = None
+        if os.path.exists(out_path):
+            with open(out_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("key") == key:
+                analytics = stored
+        if analytics is None:
+            #"key" doubles as the data version of everything drawn from it
+            analytics = {"key": key, **build_analytics(movie_path, rating_path)}
+            save_analytics(out_path, key, analytics)
+        _loaded[out_path] = (key, analytics)
+        return analytics
+
+
+if __name__ == "__main__":
+    import sys
+    movie_path, rating_path, out_path = sys.argv[1:4]
+    key = source_fingerprint(movie_path, rating_path)
+    save_analytics(out_path, key, build_analytics(movie_path, rating_path))
+    print(f"Analytics written to {out_path}")
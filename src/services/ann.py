@@ -0,0 +1,151 @@
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+from services.index import SimilarityIndex, top_k_indices
+from services.quantize import QuantizedIndex
+from services.metrics import stage
+
+
+def _normalize_dense(C: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(C, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return C / norms
+
+def assign_lists(Xn: csr_matrix, centroids: np.ndarray, block_size: int = 4096) -> np.ndarray:
+    """Nearest centroid (by cosine) of every row, block by block"""
+    assign = np.empty(Xn.shape[0], dtype=np.int32)
+    for start in range(0, Xn.shape[0], block_size):
+        stop = min(start + block_size, Xn.shape[0])
+        assign[start:stop] = np.argmax(Xn[start:stop] @ centroids.T, axis=1)
+    return assign
+
+def spherical_kmeans(
+    Xn: csr_matrix,
+    n_clusters: int,
+    n_iter: int = 10,
+    sample_size: int = 20000,
+    seed: int = 0,
+) -> np.ndarray:
+    """k-means on the unit sphere (cosine), trained on at most sample_size rows.
+    Returns float32 unit centroids shaped (n_clusters, n_tags)"""
+    rng = np.random.default_rng(seed)
+    n = Xn.shape[0]
+    sample = rng.choice(n, min(sample_size, n), replace=False)
+    D = Xn[np.sort(sample)].toarray().astype(np.float32)
+    n_clusters = min(n_clusters, len(D))
+
+    C = D[rng.choice(len(D), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(D @ C.T, axis=1)
+        M = csr_matrix(
+            (np.ones(len(D), dtype=np.float32), (assign, np.arange(len(D)))),
+            shape=(n_clusters, len(D))
+        )
+        C = np.asarray(M @ D)
+        #Re-seed clusters that lost all their members
+        empty = np.flatnonzero(M.getnnz(axis=1) == 0)
+        if len(empty):
+            C[empty] = D[rng.choice(len(D), len(empty), replace=False)]
+        C = _normalize_dense(C)
+    return C.astype(np.float32)
+
+
+class IVFIndex:
+    """Approximate cosine search: rows are bucketed by their nearest k-means centroid
+    and a query only scans the n_probe closest buckets.
+    More probes means better recall and higher latency; n_probe = n_lists is exact"""
+    base: SimilarityIndex
+    centroids: np.ndarray
+    Xp: csr_matrix
+    quantized: QuantizedIndex
+    order: np.ndarray
+    offsets: np.ndarray
+
+    def __init__(
+        self,
+        base: SimilarityIndex,
+        n_lists: int = None,
+        n_iter: int = 10,
+        seed: int = 0,
+        quantized: QuantizedIndex = None,
+    ):
+        """quantized: the reduced precision copy that replaced base's released Xn. The lists
+        then score its rows in place instead of keeping a float64 copy of the matrix"""
+        if not base.has_normalized and quantized is None:
+            raise RuntimeError("The normalized matrix was released, pass the quantized index that holds it")
+        self.base = base
+        self.quantized = None if base.has_normalized else quantized
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(base))))
+        #Transient when base released Xn for a quantized copy, only used to build the lists
+        Xn = base.normalized()
+        self.centroids = spherical_kmeans(Xn, n_lists, n_iter=n_iter, seed=seed)
+        assign = assign_lists(Xn, self.centroids)
+
+        #Store rows grouped by list so each list is a contiguous CSR slice
+        self.order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=len(self.centroids))
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        #A quantized index keeps its rows in place, a query gathers the probed ones
+        self.Xp = Xn[self.order] if self.quantized is None else None
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def top_k(self, q: tuple[list[int], list[int]], k: int = 10, n_probe: int = 8) -> list[tuple[int, float]]:
+        """Same contract as SimilarityIndex.top_k, restricted to the n_probe nearest lists"""
+        qv = self.base.query_vector(q[0], q[1]).toarray().ravel()
+        with stage("score", backend="ivf"):
+            probes = top_k_indices(self.centroids @ qv.astype(np.float32), n_probe)
+
+            #Gather every probed list in one CSR row selection, lists are contiguous in Xp
+            pos = np.concatenate([np.arange(self.offsets[p], self.offsets[p + 1]) for p in np.sort(probes)])
+            if len(pos) == 0:
+                return []
+            rows = self.order[pos]
+            if self.quantized is None:
+                sim = self.Xp[pos] @ qv
+            else:
+                sim = self.quantized.matmul_rows(rows, qv.astype(np.float32))
+
+        with stage("top_k", backend="ivf"):
+            excluded = np.isin(rows, self.base.exclude_rows(q[0]))
+            sim[excluded] = -np.inf
+            top = top_k_indices(sim, k)
+            return [
+                (int(self.base.movie_ids[rows[i]]), float(sim[i]))
+                for i in top if sim[i] != -np.inf
+            ]
+
+
+def evaluate_recall(
+    ivf: IVFIndex,
+    profiles: list[tuple[list[int], list[int]]],
+    k: int = 10,
+    n_probes: tuple[int, ...] = (1, 2, 4, 8, 16, 32),
+) -> list[dict]:
+    """Recall@k against the exact index and mean latency for each probe count"""
+    exact = [{m for m, _ in ivf.base.top_k(q, k)} for q in profiles]
+    start = time.perf_counter()
+    for q in profiles:
+        ivf.base.top_k(q, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / max(len(profiles), 1)
+
+    report = []
+    for n_probe in n_probes:
+        hits = 0
+        total = 0
+        start = time.perf_counter()
+        approx = [ivf.top_k(q, k, n_probe) for q in profiles]
+        elapsed = time.perf_counter() - start
+        for truth, res in zip(exact, approx):
+            hits += len(truth & {m for m, _ in res})
+            total += len(truth)
+        report.append({
+            "n_probe": n_probe,
+            "recall": hits / total if total else 1.0,
+            "latency_ms": elapsed * 1000 / max(len(profiles), 1),
+            "exact_latency_ms": exact_ms,
+        })
+    return report
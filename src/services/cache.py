@@ -0,0 +1,130 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def canonical_profile(movieids: list[int], stars: list[float], known: dict = None) -> Optional[tuple]:
+    """Order independent form of a (movieids, stars) query: duplicate ids merged,
+    weights scaled to sum to 1, sorted by id. Ids missing from `known` are dropped since
+    the scorer ignores them. None when the profile can not be scored (zero total weight)"""
+    if len(movieids) != len(stars):
+        return None
+    merged: dict[int, float] = {}
+    for movid, star in zip(movieids, stars):
+        if known is not None and movid not in known:
+            continue
+        merged[int(movid)] = merged.get(int(movid), 0.0) + float(star)
+    total = sum(merged.values())
+    if not merged or total == 0:
+        return None
+    return tuple(sorted((m, round(w / total, 9)) for m, w in merged.items()))
+
+def estimate_size(value: Any) -> int:
+    """Rough bytes held by a cached result list of (id, score) tuples"""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            size += sys.getsizeof(item)
+            if isinstance(item, tuple):
+                size += sum(sys.getsizeof(x) for x in item)
+    return size
+
+
+class ResultCache:
+    """Thread safe LRU + TTL cache bounded by entry count and (optionally) bytes.
+    Entries belong to a model version; set_version drops everything when it changes"""
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.version: Optional[Hashable] = None
+        self.entries: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set_version(self, version: Hashable):
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.entries.clear()
+                self.bytes = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, size, value = entry
+            if expires is not None and expires <= self.clock():
+                del self.entries[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None, version: Optional[Hashable] = None):
+        """version, if given, is the model version value was computed with;
+        a result that finished after the model was swapped is dropped"""
+        if version is not None and version != self.version:
+            return
+        if size is None:
+            size = estimate_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (expires, size, value)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "version": self.version,
+        }
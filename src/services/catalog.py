@@ -0,0 +1,192 @@
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass
+from typing import Optional
+from services.poster import get_poster_path
+from services.metrics import stage
+
+
+@dataclass(slots=True)
+class Movie:
+    id: int
+    title: str
+    year: int
+    genres: list[str]
+    average_score: float
+    poster_path: Optional[str] = None
+
+    def show(self):
+        genres = ", ".join(self.genres)
+        poster = self.poster_path or "N/A"
+
+        print(
+            f" {self.id} {self.title} ({self.year})\n"
+            f" Rating: {self.average_score}\n"
+            f" Genres: {genres}\n"
+            f" Poster: {poster}"
+        )
+
+
+class Catalog:
+    """Column store of the movie table. Titles live in one utf-8 blob with offsets.
+    Genres are stored twice: a bitmask over genre_names for filtering, and per movie
+    codes in movie.csv order (genre_codes[genre_offsets[row]:genre_offsets[row + 1]])
+    for display. Movie objects are only made by movie()/get()"""
+    ids: np.ndarray
+    years: np.ndarray
+    avg: np.ndarray
+    genre_mask: np.ndarray
+    genre_names: list[str]
+    genre_codes: np.ndarray
+    genre_offsets: np.ndarray
+    title_blob: bytes
+    title_offsets: np.ndarray
+
+    def __init__(self, ids, years, avg, genre_mask, genre_names, genre_codes, genre_offsets, title_blob, title_offsets):
+        self.ids = ids
+        self.years = years
+        self.avg = avg
+        self.genre_mask = genre_mask
+        self.genre_names = genre_names
+        self.genre_codes = genre_codes
+        self.genre_offsets = genre_offsets
+        self.title_blob = title_blob
+        self.title_offsets = title_offsets
+        self._sorted = np.argsort(ids, kind="stable")
+        self._sorted_ids = ids[self._sorted]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row: int) -> Movie:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("catalog row out of range")
+        return self.movie(row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.movie(row)
+
+    def title(self, row: int) -> str:
+        return self.title_blob[self.title_offsets[row]:self.title_offsets[row + 1]].decode("utf-8")
+
+    def genres(self, row: int) -> list[str]:
+        codes = self.genre_codes[self.genre_offsets[row]:self.genre_offsets[row + 1]]
+        return [self.genre_names[c] for c in codes.tolist()]
+
+    def rows_of(self, movie_ids) -> np.ndarray:
+        """Catalog row of every id, -1 where the id is unknown"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, movie_ids)
+        pos = np.minimum(pos, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[pos] == movie_ids
+        return np.where(found, self._sorted[pos], -1)
+
+    def row_of(self, movie_id: int) -> int:
+        return int(self.rows_of([movie_id])[0]) if len(self) else -1
+
+    def movie(self, row: int) -> Movie:
+        movie_id = int(self.ids[row])
+        year = int(self.years[row])
+        return Movie(
+            id=movie_id,
+            title=self.title(row),
+            year=year if year > 0 else None,
+            genres=self.genres(row),
+            average_score=float(self.avg[row]),
+            poster_path=get_poster_path(movie_id),
+        )
+
+    def get(self, movie_id: int) -> Optional[Movie]:
+        row = self.row_of(movie_id)
+        return self.movie(row) if row >= 0 else None
+
+    def upsert(self, delta: "Catalog") -> "Catalog":
+        """A new catalog where delta's rows replace rows with the same movieId and the
+        others are appended. self is not modified, readers holding it are unaffected"""
+        keep = ~np.isin(self.ids, delta.ids)
+        lengths = np.diff(self.title_offsets)
+        kept_blob = np.frombuffer(self.title_blob, dtype=np.uint8)[np.repeat(keep, lengths)].tobytes()
+        title_offsets = np.zeros(int(keep.sum()) + len(delta) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate((lengths[keep], np.diff(delta.title_offsets))), out=title_offsets[1:])
+
+        #delta numbers its genre bits on its own, move them onto ours
+        genre_names = list(self.genre_names)
+        delta_mask = np.zeros(len(delta), dtype=np.uint64)
+        remap = np.zeros(len(delta.genre_names), dtype=np.uint8)
+        for bit, name in enumerate(delta.genre_names):
+            if name not in genre_names:
+                genre_names.append(name)
+            remap[bit] = genre_names.index(name)
+            has = np.right_shift(delta.genre_mask, np.uint64(bit)) & np.uint64(1)
+            delta_mask |= np.left_shift(has, np.uint64(remap[bit]))
+        if len(genre_names) > 64:
+            raise RuntimeError("Too many genres for a 64 bit mask")
+        genre_lengths = np.diff(self.genre_offsets)
+        genre_offsets = np.zeros(int(keep.sum()) + len(delta) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate((genre_lengths[keep], np.diff(delta.genre_offsets))), out=genre_offsets[1:])
+
+        return Catalog(
+            ids=np.concatenate((self.ids[keep], delta.ids)),
+            years=np.concatenate((self.years[keep], delta.years)),
+            avg=np.concatenate((self.avg[keep], delta.avg)),
+            genre_mask=np.concatenate((self.genre_mask[keep], delta_mask)),
+            genre_names=genre_names,
+            genre_codes=np.concatenate((self.genre_codes[np.repeat(keep, genre_lengths)], remap[delta.genre_codes])),
+            genre_offsets=genre_offsets,
+            title_blob=kept_blob + delta.title_blob,
+            title_offsets=title_offsets,
+        )
+
+
+def build_catalog(movie_path: str, result_rating_path: str) -> Catalog:
+    with stage("csv_parse", source="movie"):
+        movies = pd.read_csv(movie_path)
+    with stage("csv_parse", source="avg_rating"):
+        ratings = pd.read_csv(result_rating_path)
+
+    with stage("catalog_build"):
+        return catalog_from_frames(movies, ratings)
+
+def catalog_from_frames(movies: pd.DataFrame, ratings: pd.DataFrame) -> Catalog:
+    """Catalog of movie.csv rows (movieId, title, genres) joined with avg_rating.csv rows (movieId, avg)"""
+    df = movies.merge(ratings, on="movieId", how="left")
+
+    raw = df["title"].astype(str)
+    year = raw.str.extract(r"\((\d{4})\)$", expand=False)
+    has_year = year.notna()
+    title = raw.where(~has_year, raw.str.replace(r"\((\d{4})\)$", "", regex=True).str.strip())
+
+    #One bit per distinct genre, in order of first appearance. explode keeps each
+    #movie's own order, the codes are stored in it next to the mask
+    genres = df["genres"].fillna("").str.split("|").explode()
+    genres = genres[genres != ""]
+    codes, genre_names = pd.factorize(genres)
+    genre_offsets = np.zeros(len(df) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(genres.index.to_numpy(), minlength=len(df)), out=genre_offsets[1:])
+    if len(genre_names) > 64:
+        raise RuntimeError("Too many genres for a 64 bit mask")
+    genre_mask = np.zeros(len(df), dtype=np.uint64)
+    np.bitwise_or.at(
+        genre_mask,
+        genres.index.to_numpy(),
+        np.left_shift(np.uint64(1), codes.astype(np.uint64))
+    )
+
+    encoded = [t.encode("utf-8") for t in title]
+    title_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in encoded], out=title_offsets[1:])
+
+    return Catalog(
+        ids=df["movieId"].to_numpy(np.int64),
+        years=year.fillna(0).astype(np.int32).to_numpy(),
+        avg=df["avg"].to_numpy(np.float64),
+        genre_mask=genre_mask,
+        genre_names=list(genre_names),
+        genre_codes=codes.astype(np.uint8),
+        genre_offsets=genre_offsets,
+        title_blob=b"".join(encoded),
+        title_offsets=title_offsets,
+    )
@@ -0,0 +1,171 @@
+import time
+import numpy as np
+import os
+import json
+from scipy.sparse import csr_matrix
+from services.tag import save_array
+from services.index import SimilarityIndex, top_k_indices, top_k_rows
+from services.metrics import stage
+
+
+def randomized_svd(X: csr_matrix, rank: int, n_oversamples: int = 10, n_iter: int = 4, seed: int = 0):
+    """Truncated SVD X ~ U diag(S) Vt by random range finding (Halko et al.)
+    Only touches X through sparse mat-mats, never densifies it"""
+    rng = np.random.default_rng(seed)
+    rank = min(rank, min(X.shape))
+    l = min(rank + n_oversamples, min(X.shape))
+
+    Q, _ = np.linalg.qr(X @ rng.standard_normal((X.shape[1], l)))
+    for _ in range(n_iter):
+        Z, _ = np.linalg.qr(X.T @ Q)
+        Q, _ = np.linalg.qr(X @ Z)
+
+    B = np.asarray(X.T @ Q).T
+    Ub, S, Vt = np.linalg.svd(B, full_matrices=False)
+    return (Q @ Ub)[:, :rank], S[:rank], Vt[:rank]
+
+def build_embedding(index: SimilarityIndex, rank: int = 128, seed: int = 0):
+    """Factorize the row-normalized matrix. Returns float32 (E, V) with
+    E = U diag(S) the movie embeddings and V the tag -> latent projection,
+    so E[i] @ (q @ V) approximates the exact cosine Xn[i] @ q"""
+    U, S, Vt = randomized_svd(index.Xn, rank, seed=seed)
+    E = (U * S).astype(np.float32)
+    V = np.ascontiguousarray(Vt.T, dtype=np.float32)
+    return E, V
+
+def save_embedding(cache_dir: str, key: str, E: np.ndarray, V: np.ndarray):
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    save_array(os.path.join(cache_dir, "E.npy"), E)
+    save_array(os.path.join(cache_dir, "V.npy"), V)
+    tmp = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "rank": E.shape[1]}, f)
+    os.replace(tmp, meta_path)
+
+def load_embedding(cache_dir: str, key: str):
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("key") != key:
+        return None
+    E = np.load(os.path.join(cache_dir, "E.npy"), mmap_mode="r")
+    V = np.load(os.path.join(cache_dir, "V.npy"), mmap_mode="r")
+    return E, V
+
+
+class EmbeddingIndex:
+    """Dense low-rank scoring backend with the same top_k / top_k_many contract
+    as SimilarityIndex. Scores are approximate cosines computed with float32 BLAS"""
+    base: SimilarityIndex
+    E: np.ndarray
+    V: np.ndarray
+
+    def __init__(self, base: SimilarityIndex, E: np.ndarray, V: np.ndarray):
+        self.base = base
+        self.E = E
+        self.V = V
+
+    @property
+    def rank(self):
+        return self.E.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.E.nbytes + self.V.nbytes
+
+    def project(self, query: csr_matrix) -> np.ndarray:
+        return np.asarray(query @ self.V, dtype=np.float32)
+
+    def candidates(self, q: tuple[list[int], list[int]], n: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """Matrix rows and approximate cosines of the n best movies, best first"""
+        qe = self.project(self.base.query_vector(q[0], q[1])).ravel()
+        with stage("score", backend="svd"):
+            sim = self.E @ qe
+        with stage("top_k", backend="svd"):
+            sim[self.base.exclude_rows(q[0])] = -np.inf
+            top_idx = top_k_indices(sim, n)
+            top_idx = top_idx[sim[top_idx] != -np.inf]
+            return top_idx, sim[top_idx]
+
+    def top_k(self, q: tuple[list[int], list[int]], k: int = 10) -> list[tuple[int, float]]:
+        rows, scores = self.candidates(q, k)
+        return [(int(self.base.movie_ids[r]), float(s)) for r, s in zip(rows, scores)]
+
+    def top_k_many(
+        self,
+        profiles: list[tuple[list[int], list[int]]],
+        k: int = 10,
+        batch_size: int = 256,
+    ) -> list[list[tuple[int, float]]]:
+        results = []
+        for start in range(0, len(profiles), batch_size):
+            chunk = profiles[start:start + batch_size]
+            with stage("query_vector", mode="batch"):
+                Q, empty = self.base.query_matrix(chunk)
+            with stage("score", mode="batch", backend="svd"):
+                sim = self.project(Q) @ self.E.T
+            with stage("top_k", mode="batch", backend="svd"):
+                for i, (movieids, _) in enumerate(chunk):
+                    sim[i, self.base.exclude_rows(movieids)] = -np.inf
+                top_idx = top_k_rows(sim, k)
+                for i in range(len(chunk)):
+                    if empty[i]:
+                        results.append([])
+                        continue
+                    row = sim[i]
+                    results.append([
+                        (int(self.base.movie_ids[j]), float(row[j]))
+                        for j in top_idx[i] if row[j] != -np.inf
+                    ])
+        return results
+
+
+def load_embedding_index(index: SimilarityIndex, cache_dir: str, key: str, rank: int = 128) -> EmbeddingIndex:
+    """Load the factorization for this matrix version, computing and caching it if stale"""
+    key = f"{key}-r{rank}"
+    cached = load_embedding(cache_dir, key)
+    if cached is None:
+        save_embedding(cache_dir, key, *build_embedding(index, rank))
+        cached = load_embedding(cache_dir, key)
+    return EmbeddingIndex(index, cached[0], cached[1])
+
+def compare_rankings(
+    emb: EmbeddingIndex,
+    profiles: list[tuple[list[int], list[int]]],
+    k: int = 10,
+) -> dict:
+    """How far the low-rank backend drifts from the exact sparse path:
+    mean top-k overlap, mean |score error| on shared items, latency and memory"""
+    start = time.perf_counter()
+    exact = [emb.base.top_k(q, k) for q in profiles]
+    exact_s = time.perf_counter() - start
+    start = time.perf_counter()
+    approx = [emb.top_k(q, k) for q in profiles]
+    approx_s = time.perf_counter() - start
+
+    overlaps, errors = [], []
+    for a, b in zip(exact, approx):
+        if not a:
+            continue
+        a_scores = dict(a)
+        shared = [(m, s) for m, s in b if m in a_scores]
+        overlaps.append(len(shared) / len(a))
+        errors.extend(abs(a_scores[m] - s) for m, s in shared)
+
+    Xn = emb.base.Xn
+    n = max(len(profiles), 1)
+    return {
+        "rank": emb.rank,
+        "k": k,
+        "overlap": float(np.mean(overlaps)) if overlaps else 1.0,
+        "mean_abs_score_error": float(np.mean(errors)) if errors else 0.0,
+        "exact_latency_ms": exact_s * 1000 / n,
+        "embedding_latency_ms": approx_s * 1000 / n,
+        "exact_bytes": Xn.data.nbytes + Xn.indices.nbytes + Xn.indptr.nbytes,
+        "embedding_bytes": emb.nbytes,
+    }
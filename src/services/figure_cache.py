@@ -0,0 +1,34 @@
+import io
+from typing import Callable, Hashable, Optional
+import matplotlib.pyplot as plt
+from services.cache import ResultCache
+
+
+class FigureCache:
+    """Rendered figure bytes keyed by (plot, params, data version), LRU bounded by bytes.
+    A figure is closed right after it is rendered so pyplot never accumulates them"""
+    def __init__(self, max_bytes: int = 32 << 20, fmt: str = "png", dpi: int = 200):
+        self.fmt = fmt
+        self.dpi = dpi
+        self.cache = ResultCache(max_entries=1 << 16, max_bytes=max_bytes, ttl=None)
+
+    def render(self, fig) -> bytes:
+        buf = io.BytesIO()
+        try:
+            fig.savefig(buf, format=self.fmt, dpi=self.dpi, bbox_inches="tight")
+        finally:
+            plt.close(fig)
+        return buf.getvalue()
+
+    def get_or_render(self, key: Hashable, make_fig: Callable) -> Optional[bytes]:
+        data = self.cache.get(key)
+        if data is None:
+            fig = make_fig()
+            if fig is None:
+                return None
+            data = self.render(fig)
+            self.cache.put(key, data, len(data))
+        return data
+
+    def stats(self) -> dict:
+        return self.cache.stats()
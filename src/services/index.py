@@ -0,0 +1,193 @@
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from services.tag import build_query_vector
+from services.metrics import stage
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first, without sorting the whole array"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise top_k_indices for a (n_queries, n_movies) score matrix"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-part, axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+def scale_rows(X: csr_matrix, norms: np.ndarray) -> csr_matrix:
+    """X with every row divided by its norm (zero rows stay zero). Shares X's indices
+    and indptr, only the values are new, so Xn keeps X's exact layout"""
+    inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms != 0)
+    Xn = csr_matrix((X.data * np.repeat(inv, np.diff(X.indptr)), X.indices, X.indptr), shape=X.shape, copy=False)
+    Xn.has_sorted_indices = X.has_sorted_indices
+    return Xn
+
+def normalize_rows(X: csr_matrix) -> tuple[csr_matrix, np.ndarray]:
+    norms = np.sqrt(X.multiply(X).sum(axis=1)).A1
+    return scale_rows(X, norms), norms
+
+
+class SimilarityIndex:
+    """Cosine index over the genome matrix, built once and queried many times.
+    Rows are normalized up front so a query is one mat-vec plus a partial sort."""
+    X: csr_matrix
+    norms: np.ndarray
+    movie_ids: np.ndarray
+    movie2idx: dict[int, int]
+
+    def __init__(self, X: csr_matrix, movie2idx: dict[int, int]):
+        self.X = X
+        self.movie2idx = movie2idx
+        self.Xn, self.norms = normalize_rows(X)
+        self.movie_ids = np.empty(X.shape[0], dtype=np.int64)
+        for m, i in movie2idx.items():
+            self.movie_ids[i] = m
+
+    @classmethod
+    def from_normalized(cls, X: csr_matrix, Xn: csr_matrix, norms: np.ndarray, movie2idx: dict[int, int], movie_ids: np.ndarray):
+        """An index over already normalized rows, skips the full pass over X.
+        Xn=None gives an index already released, as after release_normalized()"""
+        index = cls.__new__(cls)
+        index.X = X
+        index.Xn = Xn
+        index.norms = norms
+        index.movie2idx = movie2idx
+        index.movie_ids = movie_ids
+        return index
+
+    @property
+    def Xn(self) -> csr_matrix:
+        if self._Xn is None:
+            raise RuntimeError("The normalized matrix was released for a reduced precision copy, use normalized()")
+        return self._Xn
+
+    @Xn.setter
+    def Xn(self, Xn: csr_matrix):
+        self._Xn = Xn
+
+    @property
+    def has_normalized(self) -> bool:
+        """False once release_normalized() dropped Xn, exact float64 scoring is then unavailable"""
+        return self._Xn is not None
+
+    def normalized(self) -> csr_matrix:
+        """Xn, or after release_normalized() a transient copy rebuilt from X that is not kept.
+        For one-off passes (IVF build, neighbour rows), never for per query scoring"""
+        return self._Xn if self._Xn is not None else scale_rows(self.X, self.norms)
+
+    def release_normalized(self):
+        """Drop the float64 normalized matrix once another scorer holds its own copy.
+        Xn raises from then on, so nothing rebuilds and keeps it behind that scorer's back"""
+        self._Xn = None
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def query_vector(self, movieids: list[int], stars: list[int]) -> csr_matrix:
+        return build_query_vector(movieids, stars, self.X, self.movie2idx)
+
+    def exclude_rows(self, movieids: list[int]) -> np.ndarray:
+        return np.array(
+            [self.movie2idx[m] for m in movieids if m in self.movie2idx],
+            dtype=np.int64
+        )
+
+    def scores(self, query: csr_matrix) -> np.ndarray:
+        return self.Xn @ query.toarray().ravel()
+
+    def query_matrix(self, profiles: list[tuple[list[int], list[int]]]) -> tuple[csr_matrix, np.ndarray]:
+        """Stack every profile into one sparse (n_profiles, n_tags) matrix.
+        Row i is the star weighted mean of the rated movie vectors, normalized like combine.
+        Also returns a mask of profiles that had no usable movie or zero total stars"""
+        rows, cols, vals = [], [], []
+        for i, (movieids, stars) in enumerate(profiles):
+            if len(movieids) != len(stars):
+                raise RuntimeError("Movie list must have the same lenth of star list")
+            for movid, star in zip(movieids, stars):
+                if movid not in self.movie2idx:
+                    continue
+                rows.append(i)
+                cols.append(self.movie2idx[movid])
+                vals.append(star)
+        W = csr_matrix(
+            (np.asarray(vals, dtype=np.float64), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(len(profiles), len(self))
+        )
+        w = W.sum(axis=1).A1
+        empty = w == 0
+        W = diags(np.divide(1.0, w, out=np.zeros_like(w), where=~empty)) @ W
+        Q, _ = normalize_rows(W @ self.X)
+        return Q, empty
+
+    def candidates_many(
+        self,
+        profiles: list[tuple[list[int], list[int]]],
+        n: int = 10,
+        batch_size: int = 256,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Batched candidates: every chunk of batch_size profiles is scored with one sparse matmul.
+        Profiles without any known movie get empty arrays instead of raising"""
+        results = []
+        for start in range(0, len(profiles), batch_size):
+            chunk = profiles[start:start + batch_size]
+            with stage("query_vector", mode="batch"):
+                Q, empty = self.query_matrix(chunk)
+            with stage("score", mode="batch"):
+                sim = np.ascontiguousarray((self.Xn @ Q.T.toarray()).T)
+
+            with stage("top_k", mode="batch"):
+                ex_rows, ex_cols = [], []
+                for i, (movieids, _) in enumerate(chunk):
+                    cols = self.exclude_rows(movieids)
+                    ex_rows.append(np.full(len(cols), i, dtype=np.int64))
+                    ex_cols.append(cols)
+                if ex_rows:
+                    sim[np.concatenate(ex_rows), np.concatenate(ex_cols)] = -np.inf
+
+                top_idx = top_k_rows(sim, n)
+                for i in range(len(chunk)):
+                    if empty[i]:
+                        results.append((np.empty(0, dtype=np.int64), np.empty(0)))
+                        continue
+                    scores = sim[i, top_idx[i]]
+                    found = scores != -np.inf
+                    results.append((top_idx[i][found], scores[found]))
+        return results
+
+    def top_k_many(
+        self,
+        profiles: list[tuple[list[int], list[int]]],
+        k: int = 10,
+        batch_size: int = 256,
+    ) -> list[list[tuple[int, float]]]:
+        """Batched top_k, one (movieId, cosine) list per profile in input order"""
+        return [
+            [(int(self.movie_ids[r]), float(s)) for r, s in zip(rows, scores)]
+            for rows, scores in self.candidates_many(profiles, k, batch_size)
+        ]
+
+    def candidates(self, q: tuple[list[int], list[int]], n: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """Matrix rows and cosines of the n best movies for (movieids, stars), best first.
+        The rated movies themselves are never returned"""
+        query = self.query_vector(q[0], q[1])
+        with stage("score"):
+            sim = self.scores(query)
+        with stage("top_k"):
+            sim[self.exclude_rows(q[0])] = -np.inf
+            top_idx = top_k_indices(sim, n)
+            top_idx = top_idx[sim[top_idx] != -np.inf]
+            return top_idx, sim[top_idx]
+
+    def top_k(self, q: tuple[list[int], list[int]], k: int = 10) -> list[tuple[int, float]]:
+        """Same contract as get_top_k: top-k (movieId, cosine) for (movieids, stars),
+        the rated movies themselves are never returned"""
+        rows, scores = self.candidates(q, k)
+        return [(int(self.movie_ids[r]), float(s)) for r, s in zip(rows, scores)]
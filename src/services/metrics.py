@@ -0,0 +1,213 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+#Seconds, from 50us (one cached lookup) to 10s (a cold matrix build)
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+STAGE_SECONDS = "recommender_stage_seconds"
+LOAD_SECONDS = "recommender_load_seconds"
+REQUESTS_TOTAL = "recommender_requests_total"
+CACHE_TOTAL = "recommender_cache_total"
+#Directory for per request .prof files, profiling is off when unset
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+
+class Histogram:
+    """Cumulative bucket counts plus sum, as Prometheus expects them"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        out, total = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            out.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return out
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _label_text(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escape = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    """Thread safe registry of counters, gauges and histograms keyed by name + labels"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        self.help: dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.buckets)
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self.lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges), ("histogram", self.histograms)):
+                by_name: dict[str, list] = {}
+                for (name, labels), value in sorted(series.items()):
+                    by_name.setdefault(name, []).append((labels, value))
+                for name, items in by_name.items():
+                    if name in self.help:
+                        lines.append(f"# HELP {name} {self.help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in items:
+                        if kind != "histogram":
+                            lines.append(f"{name}{_label_text(labels)} {value}")
+                            continue
+                        for le, n in value.cumulative():
+                            lines.append(f"{name}_bucket{_label_text(labels, (('le', le),))} {n}")
+                        lines.append(f"{name}_sum{_label_text(labels)} {value.sum}")
+                        lines.append(f"{name}_count{_label_text(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        """Same data as to_prometheus, as json friendly dicts"""
+        def series(items, fmt):
+            return [{"name": name, "labels": dict(labels), **fmt(value)} for (name, labels), value in sorted(items)]
+
+        with self.lock:
+            return {
+                "counters": series(self.counters.items(), lambda v: {"value": v}),
+                "gauges": series(self.gauges.items(), lambda v: {"value": v}),
+                "histograms": series(self.histograms.items(), lambda h: {
+                    "count": h.count,
+                    "sum": h.sum,
+                    "mean": h.sum / h.count if h.count else None,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                    "buckets": h.cumulative(),
+                }),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+
+#Process wide registry the services report into
+METRICS = Metrics()
+METRICS.describe(STAGE_SECONDS, "Wall time of one pipeline stage")
+METRICS.describe(LOAD_SECONDS, "Wall time of each recommender startup phase")
+METRICS.describe(REQUESTS_TOTAL, "Recommender queries served")
+METRICS.describe(CACHE_TOTAL, "Result cache lookups by outcome")
+
+def stage(name: str, **labels):
+    """Time a block as one stage of the load or query pipeline"""
+    return METRICS.timer(STAGE_SECONDS, stage=name, **labels)
+
+
+#cProfile hooks do not nest: Python 3.12+ raises, older versions silently drop the outer one
+_profiling = threading.Lock()
+
+class RequestProfile:
+    """Opt-in cProfile of one request. Disabled it costs nothing; enabled, report()
+    gives the top functions and dump() writes a .prof file for snakeviz/pstats.
+    Only one profile runs at a time in the process: one entered while another is
+    active (nested, or on another thread) does nothing and reports why"""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.profiler = None
+
+    def __enter__(self):
+        if self.enabled and self.profiler is None and _profiling.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profiling.release()
+        return False
+
+    def report(self, limit: int = 25, sort: str = "cumulative") -> str:
+        if not self.enabled:
+            return ""
+        if self.profiler is None:
+            return "not profiled: another profile was already running"
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self, out_dir: str, name: str) -> Optional[str]:
+        if self.profiler is None:
+            return None
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"{name}-{time.time_ns()}.prof")
+        self.profiler.dump_stats(path)
+        return path
@@ -0,0 +1,90 @@
+import numpy as np
+import os
+import json
+from services.tag import save_array
+from services.index import SimilarityIndex, top_k_rows
+
+
+def build_neighbors(index: SimilarityIndex, n_neighbors: int = 50, block_size: int = 512):
+    """Top n_neighbors of every movie by cosine, computed block_size rows at a time
+    so peak memory is block_size x n_movies floats instead of the full similarity matrix.
+    Returns (neighbor movieIds int32, scores float32), both shaped (n_movies, n_neighbors)"""
+    n = len(index)
+    n_neighbors = min(n_neighbors, max(n - 1, 0))
+    return neighbors_of_rows(index, np.arange(n), n_neighbors, block_size)
+
+def neighbors_of_rows(index: SimilarityIndex, rows: np.ndarray, n_neighbors: int, block_size: int = 512):
+    """build_neighbors restricted to the given matrix rows, in that order"""
+    rows = np.asarray(rows, dtype=np.int64)
+    ids = np.empty((len(rows), n_neighbors), dtype=np.int32)
+    scores = np.empty((len(rows), n_neighbors), dtype=np.float32)
+    Xn = index.normalized()
+    XnT = Xn.T.tocsc()
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        sim = (Xn[block] @ XnT).toarray()
+        #A movie is not its own neighbour
+        sim[np.arange(len(block)), block] = -np.inf
+        top_idx = top_k_rows(sim, n_neighbors)
+        ids[start:start + len(block)] = index.movie_ids[top_idx]
+        scores[start:start + len(block)] = np.take_along_axis(sim, top_idx, axis=1)
+    return ids, scores
+
+def save_neighbors(cache_dir: str, key: str, ids: np.ndarray, scores: np.ndarray):
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    save_array(os.path.join(cache_dir, "ids.npy"), ids)
+    save_array(os.path.join(cache_dir, "scores.npy"), scores)
+    tmp = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "shape": list(ids.shape)}, f)
+    os.replace(tmp, meta_path)
+
+def load_neighbors(cache_dir: str, key: str):
+    """(ids, scores) memory-mapped read-only, or None when missing or stale"""
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("key") != key:
+        return None
+    ids = np.load(os.path.join(cache_dir, "ids.npy"), mmap_mode="r")
+    scores = np.load(os.path.join(cache_dir, "scores.npy"), mmap_mode="r")
+    return ids, scores
+
+
+class NeighborTable:
+    """Precomputed "more like this" lists: a lookup is one dict access and a row slice"""
+    ids: np.ndarray
+    scores: np.ndarray
+    movie2idx: dict[int, int]
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray, movie2idx: dict[int, int]):
+        self.ids = ids
+        self.scores = scores
+        self.movie2idx = movie2idx
+
+    @property
+    def n_neighbors(self):
+        return self.ids.shape[1]
+
+    def similar(self, movie_id: int, k: int = 10) -> list[tuple[int, float]]:
+        row = self.movie2idx.get(movie_id)
+        if row is None:
+            return []
+        return list(zip(self.ids[row, :k].tolist(), self.scores[row, :k].tolist()))
+
+
+def load_neighbor_table(index: SimilarityIndex, cache_dir: str, key: str, n_neighbors: int = 50) -> NeighborTable:
+    """Load the table for this matrix version, building and caching it first if stale.
+    key should identify the matrix, e.g. matrix_fingerprint of the genome csv"""
+    key = f"{key}-n{n_neighbors}"
+    cached = load_neighbors(cache_dir, key)
+    if cached is None:
+        save_neighbors(cache_dir, key, *build_neighbors(index, n_neighbors))
+        cached = load_neighbors(cache_dir, key)
+    return NeighborTable(cached[0], cached[1], index.movie2idx)
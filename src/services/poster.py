@@ -1,5 +1,7 @@
 import pandas as pd
+import numpy as np
 import os
+import threading
 from dotenv import load_dotenv
 import requests
 from tqdm import tqdm
@@ -13,10 +15,110 @@ SIZE="w500"
 
 
 POSTER_PATH = "data/poster"
-with open("data/poster/not_exist.txt", "r", encoding="utf-8") as f:
-        not_found = list(map(int, f.read().splitlines()))
+NOT_EXIST_NAME = "not_exist.txt"
+MANIFEST_NAME = "manifest.npz"
+
+#Manifest status codes
+PRESENT = 1
+MISSING = 2
+
+
+class PosterManifest:
+    """Which movie ids have a poster on disk (and its size) and which are known
+    to have none. Kept in memory as a dict, stored as flat arrays in manifest.npz,
+    so lookups never touch the filesystem. Rebuild with PosterManifest.scan(dir).save()"""
+    poster_dir: str
+    entries: dict[int, tuple[int, int]]
+
+    def __init__(self, poster_dir: str = POSTER_PATH, entries: dict[int, tuple[int, int]] = None):
+        self.poster_dir = poster_dir
+        self.entries = entries if entries is not None else {}
+        self.lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.poster_dir, MANIFEST_NAME)
+
+    @classmethod
+    def scan(cls, poster_dir: str = POSTER_PATH):
+        """Build from a single directory listing plus the legacy not_exist.txt"""
+        manifest = cls(poster_dir)
+        not_exist = os.path.join(poster_dir, NOT_EXIST_NAME)
+        if os.path.exists(not_exist):
+            with open(not_exist, "r", encoding="utf-8") as f:
+                for line in f.read().splitlines():
+                    if line.strip():
+                        manifest.entries[int(line)] = (MISSING, 0)
+        if os.path.isdir(poster_dir):
+            with os.scandir(poster_dir) as it:
+                for entry in it:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext == ".jpg" and stem.isdigit():
+                        manifest.entries[int(stem)] = (PRESENT, entry.stat().st_size)
+        return manifest
+
+    @classmethod
+    def load(cls, poster_dir: str = POSTER_PATH):
+        """Read manifest.npz, or scan the directory once and save it when there is none"""
+        path = os.path.join(poster_dir, MANIFEST_NAME)
+        if not os.path.exists(path):
+            manifest = cls.scan(poster_dir)
+            if os.path.isdir(poster_dir):
+                manifest.save()
+            return manifest
+        with np.load(path) as data:
+            ids = data["movie_ids"].tolist()
+            status = data["status"].tolist()
+            sizes = data["sizes"].tolist()
+        return cls(poster_dir, dict(zip(ids, zip(status, sizes))))
+
+    def save(self):
+        """Atomic write: readers see the old or the new manifest, never half of one"""
+        with self.lock:
+            ids = np.fromiter(self.entries.keys(), dtype=np.int64, count=len(self.entries))
+            values = np.array(list(self.entries.values()), dtype=np.int64).reshape(-1, 2)
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, movie_ids=ids, status=values[:, 0].astype(np.uint8), sizes=values[:, 1])
+        os.replace(tmp, self.manifest_path)
+
+    def mark_present(self, movie_id: int, size: int):
+        with self.lock:
+            self.entries[int(movie_id)] = (PRESENT, int(size))
+
+    def mark_missing(self, movie_id: int):
+        with self.lock:
+            self.entries[int(movie_id)] = (MISSING, 0)
+
+    def status(self, movie_id: int) -> int:
+        """PRESENT, MISSING or 0 when the id was never looked at"""
+        return self.entries.get(int(movie_id), (0, 0))[0]
+
+    def has_poster(self, movie_id: int) -> bool:
+        return self.status(movie_id) == PRESENT
+
+    def is_missing(self, movie_id: int) -> bool:
+        return self.status(movie_id) == MISSING
+
+    def size(self, movie_id: int) -> int:
+        return self.entries.get(int(movie_id), (0, 0))[1]
+
+    def path(self, movie_id: int) -> str:
+        return f"{self.poster_dir}/{int(movie_id)}.jpg"
+
+
+_manifests: dict[str, PosterManifest] = {}
+_manifests_lock = threading.Lock()
+def get_manifest(poster_dir: str = POSTER_PATH) -> PosterManifest:
+    """Manifest of poster_dir, loaded once per process"""
+    if poster_dir not in _manifests:
+        with _manifests_lock:
+            if poster_dir not in _manifests:
+                _manifests[poster_dir] = PosterManifest.load(poster_dir)
+    return _manifests[poster_dir]
+
 def get_poster_path(movie_id: int):
-    if movie_id in not_found:
+    if get_manifest().is_missing(movie_id):
         return "Non-Poster-Film"
     return f"{POSTER_PATH}/{movie_id}.jpg"
 def get_poster(tmdb_id: int, movie_id: int):
@@ -40,34 +142,31 @@ def get_poster(tmdb_id: int, movie_id: int):
 
         with open(f"{POSTER_PATH}/{int(movie_id)}.jpg", "wb") as f:
             f.write(image.content)
+        get_manifest().mark_present(movie_id, len(image.content))
         print(f"Saved poster image for move {movie_id}")
     except Exception as e:
         print(f"Movie {movie_id} poster not exist")
-        with open("data/poster/not_exist.txt", "a", encoding="utf-8") as f:
-            f.write(f"{movie_id}\n")
+        get_manifest().mark_missing(movie_id)
         return
 def craw_poster_image(move_id_link_path: str, offset=1, max_workers=8):
     df = pd.read_csv(move_id_link_path)
-    existing = {
-        int(f.split(".")[0])
-        for f in os.listdir(POSTER_PATH)
-        if f.endswith(".jpg")
-    }
+    manifest = get_manifest()
     tasks = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for idx, row in df.iterrows():
-            if idx + 1 < offset:
-                continue
-            
-            tmdb_id = row["tmdbId"]
-            movie_id = int(row["movieId"])
-            if movie_id in existing or movie_id in not_found:
-                continue
-            tasks.append(
-                executor.submit(get_poster, tmdb_id, movie_id)
-            )
-        for _ in tqdm(as_completed(tasks), total = len(tasks), desc="Poster sync"):
-            pass
-
-
-        
\ No newline at end of file
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for idx, row in df.iterrows():
+                if idx + 1 < offset:
+                    continue
+
+                tmdb_id = row["tmdbId"]
+                movie_id = int(row["movieId"])
+                if manifest.status(movie_id):
+                    continue
+                tasks.append(
+                    executor.submit(get_poster, tmdb_id, movie_id)
+                )
+            for _ in tqdm(as_completed(tasks), total = len(tasks), desc="Poster sync"):
+                pass
+    finally:
+        os.makedirs(POSTER_PATH, exist_ok=True)
+        manifest.save()
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import random
+import time
+import os
+import pandas as pd
+import aiohttp
+from tqdm import tqdm
+from services.poster import (
+    KEY, API_IMAGE, API_RESOURCE_URL, SIZE, POSTER_PATH,
+    PosterManifest, get_manifest,
+)
+
+
+class NoBackdrop(Exception):
+    """The API answered but there is no image for this movie, retrying will not help"""
+
+class TransientError(Exception):
+    """Network error, timeout, 429, 5xx or a malformed body: worth another try later"""
+
+
+class TokenBucket:
+    """At most `rate` acquisitions per second on average, bursts up to `capacity`"""
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def _get_json(session: aiohttp.ClientSession, url: str, params: dict):
+    try:
+        async with session.get(url, params=params) as res:
+            if res.status == 404:
+                raise NoBackdrop(f"{url} not found")
+            if res.status == 429 or res.status >= 500:
+                raise TransientError(f"HTTP {res.status}")
+            res.raise_for_status()
+            body = await res.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise TransientError(str(e)) from e
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        #An HTML error page or a cut off body, fails this movie only
+        raise TransientError(f"{url} returned invalid json: {e}") from e
+    if not isinstance(body, dict):
+        raise TransientError(f"{url} returned {type(body).__name__}, expected an object")
+    return body
+
+async def _download(session: aiohttp.ClientSession, url: str, path: str) -> int:
+    """Stream the image to path.part then rename, so a killed run never leaves half a jpg.
+    path.part is removed on any failure, an empty body counts as a transient failure"""
+    tmp = f"{path}.part"
+    size = 0
+    saved = False
+    try:
+        try:
+            async with session.get(url) as res:
+                if res.status == 404:
+                    raise NoBackdrop(f"{url} not found")
+                if res.status == 429 or res.status >= 500:
+                    raise TransientError(f"HTTP {res.status}")
+                res.raise_for_status()
+                with open(tmp, "wb") as f:
+                    async for block in res.content.iter_chunked(64 << 10):
+                        f.write(block)
+                        size += len(block)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransientError(str(e)) from e
+        if size == 0:
+            raise TransientError(f"{url} returned an empty body")
+        os.replace(tmp, path)
+        saved = True
+    finally:
+        if not saved and os.path.exists(tmp):
+            os.remove(tmp)
+    return size
+
+async def fetch_poster(
+    session: aiohttp.ClientSession,
+    bucket: TokenBucket,
+    tmdb_id: int,
+    movie_id: int,
+    poster_dir: str,
+    api_image_url: str,
+    api_resource_url: str,
+    retries: int = 4,
+    backoff: float = 0.5,
+) -> int:
+    """Download the best rated backdrop of one movie, returns its size in bytes.
+    Raises NoBackdrop straight away, TransientError once the retries are used up"""
+    request_url = api_image_url.replace("{movie_id}", str(tmdb_id))
+    for attempt in range(retries + 1):
+        try:
+            await bucket.acquire()
+            res = await _get_json(session, request_url, {"api_key": KEY} if KEY else {})
+            backdrops = res.get("backdrops") or []
+            backdrops = [b for b in backdrops if isinstance(b, dict)] if isinstance(backdrops, list) else []
+            if not backdrops:
+                raise NoBackdrop(f"Movie {movie_id} has no backdrop")
+            best = max(backdrops, key=lambda x: x.get("vote_average") or 0)
+            best_path = best.get("file_path")
+            if not best_path or not isinstance(best_path, str):
+                raise NoBackdrop(f"Movie {movie_id} has no backdrop path")
+            image_url = api_resource_url.replace("{size}", SIZE).replace("{file_path}", best_path[1:])
+
+            await bucket.acquire()
+            return await _download(session, image_url, os.path.join(poster_dir, f"{int(movie_id)}.jpg"))
+        except TransientError:
+            if attempt == retries:
+                raise
+            #Exponential backoff with jitter
+            await asyncio.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+
+async def crawl_posters(
+    move_id_link_path: str,
+    poster_dir: str = POSTER_PATH,
+    concurrency: int = 20,
+    rate: float = 40,
+    retries: int = 4,
+    timeout: float = 15,
+    checkpoint_every: int = 50,
+    api_image_url: str = None,
+    api_resource_url: str = None,
+    manifest: PosterManifest = None,
+) -> dict[str, int]:
+    """Fetch every poster of link.csv not yet in the manifest.
+    The manifest is the checkpoint: it is saved every checkpoint_every results and on exit,
+    so an interrupted run resumes exactly where it stopped. Only NoBackdrop marks a movie
+    missing; transient failures stay unrecorded and are retried by the next run"""
+    api_image_url = api_image_url or API_IMAGE
+    api_resource_url = api_resource_url or API_RESOURCE_URL
+    if manifest is None:
+        manifest = get_manifest(poster_dir)
+    os.makedirs(poster_dir, exist_ok=True)
+
+    df = pd.read_csv(move_id_link_path, usecols=["movieId", "tmdbId"]).dropna()
+    todo = [
+        (int(tmdb_id), int(movie_id))
+        for movie_id, tmdb_id in zip(df["movieId"], df["tmdbId"])
+        if not manifest.status(int(movie_id))
+    ]
+    summary = {"saved": 0, "missing": 0, "failed": 0}
+    if not todo:
+        return summary
+
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+    progress = tqdm(total=len(todo), desc="Poster sync")
+
+    async def worker(session, tmdb_id, movie_id):
+        nonlocal done
+        async with semaphore:
+            try:
+                size = await fetch_poster(
+                    session, bucket, tmdb_id, movie_id, poster_dir,
+                    api_image_url, api_resource_url, retries=retries,
+                )
+                manifest.mark_present(movie_id, size)
+                summary["saved"] += 1
+            except NoBackdrop:
+                manifest.mark_missing(movie_id)
+                summary["missing"] += 1
+            except (TransientError, OSError):
+                #Disk errors too: one movie failing must not abort the gather
+                summary["failed"] += 1
+            done += 1
+            progress.update()
+            if done % checkpoint_every == 0:
+                manifest.save()
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+            await asyncio.gather(*(worker(session, t, m) for t, m in todo))
+    finally:
+        progress.close()
+        manifest.save()
+    return summary
+
+def craw_poster_image_async(move_id_link_path: str, **kwargs) -> dict[str, int]:
+    """Blocking entry point, same role as craw_poster_image"""
+    return asyncio.run(crawl_posters(move_id_link_path, **kwargs))
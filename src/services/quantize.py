@@ -0,0 +1,197 @@
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+from services.index import SimilarityIndex, top_k_indices, top_k_rows
+from services.metrics import stage
+
+PRECISIONS = ("float32", "float16", "uint8")
+#Rows dequantized at a time: the float32 copy of a block stays small enough for the CPU cache
+BLOCK_ROWS = 2048
+
+
+def quantize_rows(X: csr_matrix, precision: str) -> tuple[np.ndarray, np.ndarray]:
+    """(data, per row scale) of X at the given precision. uint8 codes are
+    round(x / scale) with scale = row max / 255; the other modes have no scale"""
+    if precision not in PRECISIONS:
+        raise RuntimeError(f"Unknown precision {precision}, expected one of {', '.join(PRECISIONS)}")
+    if precision != "uint8":
+        return X.data.astype(precision), None
+    lengths = np.diff(X.indptr)
+    row_max = np.zeros(X.shape[0])
+    nonempty = lengths > 0
+    row_max[nonempty] = np.maximum.reduceat(np.abs(X.data), X.indptr[:-1][nonempty])
+    scale = (row_max / 255).astype(np.float32)
+    inv = np.divide(1.0, scale, out=np.zeros(len(scale)), where=scale != 0)
+    codes = np.rint(X.data * np.repeat(inv, lengths))
+    return np.clip(codes, 0, 255).astype(np.uint8), scale
+
+
+class QuantizedIndex:
+    """Exact-path scoring over a reduced precision copy of the normalized matrix,
+    same top_k / top_k_many contract as SimilarityIndex. Genome relevances lie in
+    [0, 1], so 8 to 16 bits keep the rankings while the data array shrinks 2x to 8x.
+
+    float32 is scored directly by SciPy. SciPy has no float16 / uint8 kernels, so
+    those are widened to float32 BLOCK_ROWS rows at a time: less memory, more work
+    per query. Index arrays are shared with base.X, only the values are copied"""
+    base: SimilarityIndex
+    precision: str
+    data: np.ndarray
+    scale: np.ndarray
+
+    def __init__(self, base: SimilarityIndex, precision: str = "float32"):
+        self.base = base
+        self.precision = precision
+        X = base.X
+        #Xn is laid out like X, transient when base already released it
+        self.data, self.scale = quantize_rows(base.normalized(), precision)
+        self.indices, self.indptr = X.indices, X.indptr
+        self.sorted_indices = X.has_sorted_indices
+        self.shape = X.shape
+
+    @classmethod
+    def from_arrays(cls, base: SimilarityIndex, precision: str, data: np.ndarray, scale: np.ndarray = None):
+        """An index over already quantized values laid out like base.X"""
+        index = cls.__new__(cls)
+        index.base = base
+        index.precision = precision
+        index.data, index.scale = data, scale
+        index.indices, index.indptr = base.X.indices, base.X.indptr
+        index.sorted_indices = base.X.has_sorted_indices
+        index.shape = base.X.shape
+        return index
+
+    @property
+    def nbytes(self):
+        scale = self.scale.nbytes if self.scale is not None else 0
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes + scale
+
+    def block(self, start: int, stop: int) -> csr_matrix:
+        """Rows [start, stop) as a float32 csr, unscaled for uint8"""
+        lo, hi = self.indptr[start], self.indptr[stop]
+        block = csr_matrix(
+            (self.data[lo:hi].astype(np.float32, copy=False), self.indices[lo:hi], self.indptr[start:stop + 1] - lo),
+            shape=(stop - start, self.shape[1]),
+            copy=False
+        )
+        block.has_sorted_indices = self.sorted_indices
+        return block
+
+    def take(self, rows: np.ndarray) -> csr_matrix:
+        """The given rows as a float32 csr, unscaled for uint8. Only their values are copied"""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        pos = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return csr_matrix(
+            (self.data[pos].astype(np.float32, copy=False), self.indices[pos], indptr),
+            shape=(len(rows), self.shape[1]),
+            copy=False
+        )
+
+    def matmul_rows(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        """Xq[rows] @ q for a dense float32 (n_tags,) vector"""
+        out = self.take(rows) @ q
+        if self.scale is not None:
+            out *= self.scale[rows]
+        return out
+
+    def matmul(self, Q: np.ndarray) -> np.ndarray:
+        """Xq @ Q for a dense float32 (n_tags,) vector or (n_tags, n_queries) matrix"""
+        if self.precision == "float32":
+            return self.block(0, self.shape[0]) @ Q
+        out = np.empty((self.shape[0],) + Q.shape[1:], dtype=np.float32)
+        for start in range(0, self.shape[0], BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, self.shape[0])
+            out[start:stop] = self.block(start, stop) @ Q
+        if self.scale is not None:
+            out *= self.scale.reshape((-1,) + (1,) * (Q.ndim - 1))
+        return out
+
+    def candidates(self, q: tuple[list[int], list[int]], n: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """Matrix rows and cosines of the n best movies, best first"""
+        qv = self.base.query_vector(q[0], q[1]).toarray().ravel().astype(np.float32)
+        with stage("score", backend=self.precision):
+            sim = self.matmul(qv)
+        with stage("top_k", backend=self.precision):
+            sim[self.base.exclude_rows(q[0])] = -np.inf
+            top_idx = top_k_indices(sim, n)
+            top_idx = top_idx[sim[top_idx] != -np.inf]
+            return top_idx, sim[top_idx]
+
+    def top_k(self, q: tuple[list[int], list[int]], k: int = 10) -> list[tuple[int, float]]:
+        rows, scores = self.candidates(q, k)
+        return [(int(self.base.movie_ids[r]), float(s)) for r, s in zip(rows, scores)]
+
+    def top_k_many(
+        self,
+        profiles: list[tuple[list[int], list[int]]],
+        k: int = 10,
+        batch_size: int = 256,
+    ) -> list[list[tuple[int, float]]]:
+        results = []
+        for start in range(0, len(profiles), batch_size):
+            chunk = profiles[start:start + batch_size]
+            with stage("query_vector", mode="batch"):
+                Q, empty = self.base.query_matrix(chunk)
+            with stage("score", mode="batch", backend=self.precision):
+                sim = np.ascontiguousarray(self.matmul(Q.T.toarray().astype(np.float32)).T)
+            with stage("top_k", mode="batch", backend=self.precision):
+                for i, (movieids, _) in enumerate(chunk):
+                    sim[i, self.base.exclude_rows(movieids)] = -np.inf
+                top_idx = top_k_rows(sim, k)
+                for i in range(len(chunk)):
+                    if empty[i]:
+                        results.append([])
+                        continue
+                    row = sim[i]
+                    results.append([
+                        (int(self.base.movie_ids[j]), float(row[j]))
+                        for j in top_idx[i] if row[j] != -np.inf
+                    ])
+        return results
+
+
+def compare_precisions(
+    base: SimilarityIndex,
+    profiles: list[tuple[list[int], list[int]]],
+    k: int = 10,
+    precisions: tuple[str, ...] = PRECISIONS,
+) -> dict:
+    """Every precision against the float64 index: bytes of the scoring matrix, the
+    share saved and what dropping the float64 copy frees, mean latency per query and its ratio to float64, mean top-k
+    overlap and mean |score error| on the movies both rankings share"""
+    Xn = base.Xn
+    exact_bytes = Xn.data.nbytes + Xn.indices.nbytes + Xn.indptr.nbytes
+    n = max(len(profiles), 1)
+    start = time.perf_counter()
+    exact = [base.top_k(q, k) for q in profiles]
+    exact_ms = (time.perf_counter() - start) * 1000 / n
+
+    report = {"k": k, "float64": {"bytes": exact_bytes, "latency_ms": exact_ms}}
+    for precision in precisions:
+        index = QuantizedIndex(base, precision)
+        start = time.perf_counter()
+        found = [index.top_k(q, k) for q in profiles]
+        latency_ms = (time.perf_counter() - start) * 1000 / n
+
+        overlaps, errors = [], []
+        for a, b in zip(exact, found):
+            if not a:
+                continue
+            a_scores = dict(a)
+            shared = [(m, s) for m, s in b if m in a_scores]
+            overlaps.append(len(shared) / len(a))
+            errors.extend(abs(a_scores[m] - s) for m, s in shared)
+        report[precision] = {
+            "bytes": index.nbytes,
+            "bytes_saved": 1 - index.nbytes / exact_bytes if exact_bytes else 0.0,
+            #What release_normalized frees: Xn's index arrays are X's and stay, its float64
+            #values go and the quantized values (plus uint8 row scales) take their place
+            "released_bytes": Xn.data.nbytes - index.data.nbytes - (index.scale.nbytes if index.scale is not None else 0),
+            "latency_ms": latency_ms,
+            "latency_ratio": latency_ms / exact_ms if exact_ms else float("nan"),
+            "overlap": float(np.mean(overlaps)) if overlaps else 1.0,
+            "mean_abs_score_error": float(np.mean(errors)) if errors else 0.0,
+        }
+    return report
@@ -0,0 +1,151 @@
+import numpy as np
+from dataclasses import dataclass
+from services.catalog import Catalog
+from services.index import top_k_indices
+from services.metrics import stage
+
+#Candidates fetched from the tag index before re-ranking
+N_CANDIDATES = 300
+#Ratings of prior weight when shrinking a movie's average toward the global one
+PRIOR_COUNT = 50
+RECENCY_HALF_LIFE = 15.0
+
+
+@dataclass
+class RerankWeights:
+    """Blend of the re-rank score, every feature lies in [0, 1]"""
+    similarity: float = 1.0
+    rating: float = 0.1
+    popularity: float = 0.05
+    recency: float = 0.02
+
+
+class RankFeatures:
+    """Per-movie re-rank features as float32 arrays aligned to the matrix row order,
+    so a candidate's features are plain array reads by row"""
+    quality: np.ndarray
+    popularity: np.ndarray
+    recency: np.ndarray
+    source: tuple
+
+    def __init__(self, quality: np.ndarray, popularity: np.ndarray, recency: np.ndarray):
+        self.quality = quality
+        self.popularity = popularity
+        self.recency = recency
+        self.source = (None, None, PRIOR_COUNT, RECENCY_HALF_LIFE)
+
+    def __len__(self):
+        return len(self.quality)
+
+    @classmethod
+    def build(
+        cls,
+        movie_ids: np.ndarray,
+        catalog: Catalog,
+        stats_ids: np.ndarray = None,
+        stats_counts: np.ndarray = None,
+        prior_count: int = PRIOR_COUNT,
+        half_life: float = RECENCY_HALF_LIFE,
+    ):
+        """movie_ids: movieId of every matrix row. stats_ids (sorted) / stats_counts:
+        number of ratings per movie from the rating stats store, when available"""
+        rows = catalog.rows_of(movie_ids)
+        known = rows >= 0
+        avg = np.full(len(movie_ids), np.nan)
+        avg[known] = catalog.avg[rows[known]]
+        years = np.zeros(len(movie_ids), dtype=np.int32)
+        years[known] = catalog.years[rows[known]]
+
+        counts = np.zeros(len(movie_ids), dtype=np.float64)
+        if stats_ids is not None and len(stats_ids):
+            pos = np.minimum(np.searchsorted(stats_ids, movie_ids), len(stats_ids) - 1)
+            found = stats_ids[pos] == movie_ids
+            counts[found] = stats_counts[pos[found]]
+
+        rated = ~np.isnan(avg)
+        if counts[rated].sum() > 0:
+            prior = float(np.average(avg[rated], weights=counts[rated]))
+        elif rated.any():
+            prior = float(avg[rated].mean())
+        else:
+            #Middle of the 0.5 - 5.0 scale
+            prior = 2.75
+        if counts.sum() > 0:
+            #Bayesian average: a 5.0 from three people should not beat a 4.3 from thousands
+            filled = np.where(rated, avg, prior)
+            avg = (counts * filled + prior_count * prior) / (counts + prior_count)
+        else:
+            avg = np.where(rated, avg, prior)
+        quality = np.clip((avg - 0.5) / 4.5, 0, 1)
+
+        top = counts.max() if len(counts) else 0
+        popularity = np.log1p(counts) / np.log1p(top) if top > 0 else np.zeros(len(counts))
+
+        dated = years > 0
+        newest = years[dated].max() if dated.any() else 0
+        recency = np.zeros(len(movie_ids))
+        recency[dated] = 0.5 ** ((newest - years[dated]) / half_life)
+
+        features = cls(quality.astype(np.float32), popularity.astype(np.float32), recency.astype(np.float32))
+        features.source = (stats_ids, stats_counts, prior_count, half_life)
+        return features
+
+    def realign(self, movie_ids: np.ndarray, catalog: Catalog) -> "RankFeatures":
+        """Features for a changed matrix row order or catalog, same rating counts"""
+        return RankFeatures.build(movie_ids, catalog, *self.source)
+
+
+def blend(rows: np.ndarray, sims: np.ndarray, features: RankFeatures, weights: RerankWeights) -> np.ndarray:
+    """Re-rank score of the candidate rows, a few array gathers and fused adds"""
+    return (
+        weights.similarity * sims
+        + weights.rating * features.quality[rows]
+        + weights.popularity * features.popularity[rows]
+        + weights.recency * features.recency[rows]
+    )
+
+
+class Reranker:
+    """Two stage scorer with the top_k / top_k_many contract of the other backends.
+    Stage one asks the wrapped scorer for n_candidates rows by tag similarity,
+    stage two orders them by blend(); returned scores are the blended scores"""
+    def __init__(self, scorer, features: RankFeatures, weights: RerankWeights = None, n_candidates: int = N_CANDIDATES):
+        self.scorer = scorer
+        self.features = features
+        self.weights = weights or RerankWeights()
+        self.n_candidates = n_candidates
+
+    @property
+    def base(self):
+        #The exact index, whatever the candidate backend
+        return getattr(self.scorer, "base", self.scorer)
+
+    def rerank(self, rows: np.ndarray, sims: np.ndarray, k: int) -> list[tuple[int, float]]:
+        with stage("rerank"):
+            score = blend(rows, sims, self.features, self.weights)
+            top = top_k_indices(score, k)
+            movie_ids = self.base.movie_ids
+            return [(int(movie_ids[rows[i]]), float(score[i])) for i in top]
+
+    def top_k(self, q: tuple[list[int], list[int]], k: int = 10) -> list[tuple[int, float]]:
+        rows, sims = self.scorer.candidates(q, max(k, self.n_candidates))
+        return self.rerank(rows, sims, k)
+
+    def top_k_many(
+        self,
+        profiles: list[tuple[list[int], list[int]]],
+        k: int = 10,
+        batch_size: int = 256,
+    ) -> list[list[tuple[int, float]]]:
+        n = max(k, self.n_candidates)
+        if hasattr(self.scorer, "candidates_many"):
+            found = self.scorer.candidates_many(profiles, n, batch_size)
+        else:
+            found = []
+            for q in profiles:
+                try:
+                    found.append(self.scorer.candidates(q, n))
+                except RuntimeError:
+                    #Same as the batched path: a profile without usable movies gets no results
+                    found.append((np.empty(0, dtype=np.int64), np.empty(0)))
+        return [self.rerank(rows, sims, k) for rows, sims in found]
@@ -1,15 +1,190 @@
 import pandas as pd
+import numpy as np
+import io
+import os
+from services.metrics import stage
 
 
+#MovieLens ratings are half stars from 0.5 to 5.0
+RATING_LEVELS = np.arange(1, 11) / 2
 
-def calc_avg_score(rating_path, result_path):
-    df = pd.read_csv(rating_path, usecols=["movieId", "rating"])
 
-    avg_df = (
-        df.groupby("movieId", as_index=False)["rating"]
-        .mean()
-        .rename(columns={"rating": "avg"})
-    )
+class RatingStats:
+    """Columnar per-movie rating statistics built in one streaming pass over an
+    append-only rating csv: count, mean, variance (Welford / Chan merge), min, max
+    and a histogram over RATING_LEVELS. The state remembers how many bytes of the
+    csv it has consumed, so a later update only parses the lines appended since then"""
+    movie_ids: np.ndarray
+    counts: np.ndarray
+    means: np.ndarray
+    m2: np.ndarray
+    mins: np.ndarray
+    maxs: np.ndarray
+    hist: np.ndarray
+    offset: int
+    header: bytes
 
-    avg_df.to_csv(result_path, index=False)
+    _columns = ("counts", "means", "m2", "mins", "maxs", "hist")
 
+    def __init__(self):
+        self.movie_ids = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.means = np.empty(0, dtype=np.float64)
+        self.m2 = np.empty(0, dtype=np.float64)
+        self.mins = np.empty(0, dtype=np.float64)
+        self.maxs = np.empty(0, dtype=np.float64)
+        self.hist = np.empty((0, len(RATING_LEVELS)), dtype=np.int64)
+        self.offset = 0
+        self.header = b""
+
+    @classmethod
+    def load(cls, state_path: str):
+        stats = cls()
+        if os.path.exists(state_path):
+            with np.load(state_path) as state:
+                stats.movie_ids = state["movie_ids"]
+                for name in cls._columns:
+                    setattr(stats, name, state[name])
+                stats.offset = int(state["offset"])
+                stats.header = state["header"].tobytes()
+        return stats
+
+    def save(self, state_path: str):
+        tmp = f"{state_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                movie_ids=self.movie_ids,
+                offset=np.int64(self.offset),
+                header=np.frombuffer(self.header, dtype=np.uint8),
+                **{name: getattr(self, name) for name in self._columns},
+            )
+        os.replace(tmp, state_path)
+
+    def _grow(self, ids: np.ndarray):
+        """Make room for movie ids not seen yet, keeping movie_ids sorted"""
+        new = np.setdiff1d(ids, self.movie_ids)
+        if len(new) == 0:
+            return
+        merged = np.union1d(self.movie_ids, new)
+        pos = np.searchsorted(merged, self.movie_ids)
+        for name in self._columns:
+            old = getattr(self, name)
+            fill = {"mins": np.inf, "maxs": -np.inf}.get(name, 0)
+            grown = np.full((len(merged),) + old.shape[1:], fill, dtype=old.dtype)
+            grown[pos] = old
+            setattr(self, name, grown)
+        self.movie_ids = merged
+
+    def add(self, movie_ids: np.ndarray, ratings: np.ndarray):
+        uniq, inv = np.unique(movie_ids, return_inverse=True)
+        self._grow(uniq)
+        pos = np.searchsorted(self.movie_ids, uniq)
+
+        #Stats of this chunk alone
+        n_b = np.bincount(inv, minlength=len(uniq))
+        mean_b = np.bincount(inv, weights=ratings, minlength=len(uniq)) / n_b
+        m2_b = np.bincount(inv, weights=(ratings - mean_b[inv]) ** 2, minlength=len(uniq))
+
+        #Merge into the running stats (Chan et al. parallel variance)
+        n_a = self.counts[pos]
+        n = n_a + n_b
+        delta = mean_b - self.means[pos]
+        self.means[pos] += delta * n_b / n
+        self.m2[pos] += m2_b + delta ** 2 * n_a * n_b / n
+        self.counts[pos] = n
+
+        np.minimum.at(self.mins, pos[inv], ratings)
+        np.maximum.at(self.maxs, pos[inv], ratings)
+        level = np.clip(np.rint(ratings * 2).astype(np.int64) - 1, 0, len(RATING_LEVELS) - 1)
+        np.add.at(self.hist, (pos[inv], level), 1)
+
+    def update(self, rating_path: str, block_bytes: int = 64 << 20) -> int:
+        """Consume every complete line appended after the saved offset.
+        Peak memory is one block of block_bytes, returns the number of new bytes read"""
+        size = os.path.getsize(rating_path)
+        with open(rating_path, "rb") as f:
+            header = f.readline()
+            #The file was replaced or truncated, the old stats mean nothing any more
+            if header != self.header or size < self.offset:
+                self.__init__()
+                self.header = header
+            if self.offset == 0:
+                self.offset = f.tell()
+
+            start = self.offset
+            f.seek(self.offset)
+            while True:
+                block = f.read(block_bytes)
+                if not block:
+                    break
+                cut = block.rfind(b"\n")
+                if cut == -1:
+                    #A line longer than the block or a half written last line
+                    if len(block) < block_bytes:
+                        break
+                    block_bytes *= 2
+                    f.seek(self.offset)
+                    continue
+                f.seek(self.offset + cut + 1)
+                with stage("csv_parse", source="rating"):
+                    chunk = pd.read_csv(io.BytesIO(header + block[:cut + 1]), usecols=["movieId", "rating"])
+                with stage("rating_aggregate"):
+                    self.add(chunk["movieId"].to_numpy(np.int64), chunk["rating"].to_numpy(np.float64))
+                self.offset += cut + 1
+        return self.offset - start
+
+    def variance(self, ddof: int = 1) -> np.ndarray:
+        """Per-movie rating variance, nan where count <= ddof (same as pandas)"""
+        denom = (self.counts - ddof).astype(np.float64)
+        out = np.full(len(self.counts), np.nan)
+        np.divide(self.m2, denom, out=out, where=denom > 0)
+        return out
+
+    def std(self, ddof: int = 1) -> np.ndarray:
+        return np.sqrt(self.variance(ddof))
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "movieId": self.movie_ids,
+            "count": self.counts,
+            "avg": self.means,
+            "std": self.std(),
+            "min": self.mins,
+            "max": self.maxs,
+        })
+
+
+def rating_stats_path(rating_path: str) -> str:
+    return f"{rating_path}.stats.npz"
+
+def load_rating_stats(rating_path: str, state_path: str = None) -> RatingStats:
+    """The shared stats store for rating_path, brought up to date with any appended lines"""
+    if state_path is None:
+        state_path = rating_stats_path(rating_path)
+    stats = RatingStats.load(state_path)
+    if os.path.exists(rating_path) and stats.update(rating_path) > 0:
+        stats.save(state_path)
+    return stats
+
+
+def calc_avg_score(rating_path, result_path, state_path=None):
+    """Write per-movie average rating to result_path from the shared stats store
+    (default rating_path + ".stats.npz"), only aggregating newly appended ratings"""
+    if state_path is None:
+        state_path = rating_stats_path(rating_path)
+    if not os.path.exists(rating_path):
+        #Same as reading the csv directly: never replace result_path with an empty table
+        raise FileNotFoundError(f"Rating file {rating_path} not found")
+
+    stats = load_rating_stats(rating_path, state_path)
+    if (
+        os.path.exists(result_path)
+        and os.path.exists(state_path)
+        and os.path.getmtime(result_path) >= os.path.getmtime(state_path)
+    ):
+        return
+
+    tmp = f"{result_path}.{os.getpid()}.tmp"
+    stats.to_frame()[["movieId", "avg"]].to_csv(tmp, index=False)
+    os.replace(tmp, result_path)
@@ -0,0 +1,138 @@
+import bisect
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from rapidfuzz import process
+
+#A query's k-th best candidate scoring under this is most likely a typo match the trigrams
+#missed (an exact substring scores 90 and up), so every title is scored instead
+FULL_SCAN_BELOW = 75
+
+
+def normalize_title(text: str) -> str:
+    """Lower case, accents stripped, punctuation folded to single spaces"""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+def trigrams(norm: str) -> set[str]:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def query_trigrams(norm: str) -> set[str]:
+    """Trigrams inside the query, unpadded: a query typed from the middle of a word still matches it"""
+    return {norm[i:i + 3] for i in range(len(norm) - 2)}
+
+
+class TitleIndex:
+    """Built once from the movie table. Candidate titles for a query come from a
+    character trigram inverted index plus a prefix lookup, and only those few hundred
+    are fuzzy scored. Short queries and queries whose candidates match poorly fall back
+    to scoring every title. Also holds the O(1) movieId <-> title maps the UI needs"""
+    ids: np.ndarray
+    titles: list[str]
+    id2title: dict[int, str]
+    title2id: dict[str, int]
+
+    def __init__(self, movie_ids, titles):
+        self.ids = np.asarray(movie_ids, dtype=np.int64)
+        self.titles = [str(t) for t in titles]
+        self.id2title = dict(zip(self.ids.tolist(), self.titles))
+        self.title2id = {}
+        for movie_id, title in zip(self.ids.tolist(), self.titles):
+            #Same as the old .values[0]: the first row wins for duplicate titles
+            self.title2id.setdefault(title, movie_id)
+
+        norms = [normalize_title(t) for t in self.titles]
+
+        #Sorted normalized titles for prefix search
+        self._prefix_order = sorted(range(len(norms)), key=norms.__getitem__)
+        self._prefix_keys = [norms[i] for i in self._prefix_order]
+
+        #Inverted index as CSR: postings[offsets[g]:offsets[g + 1]] are the rows holding gram g
+        grams, rows = [], []
+        for row, norm in enumerate(norms):
+            for g in trigrams(norm):
+                grams.append(g)
+                rows.append(row)
+        codes, uniques = pd.factorize(pd.Series(grams, dtype=object))
+        self._gram_ids = {g: i for i, g in enumerate(uniques)}
+        order = np.argsort(codes, kind="stable")
+        self._postings = np.asarray(rows, dtype=np.int32)[order]
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(uniques)))))
+        self._gram_counts = np.bincount(np.asarray(rows, dtype=np.int64), minlength=len(self.titles))
+
+    @classmethod
+    def from_frame(cls, movies_df: pd.DataFrame):
+        return cls(movies_df["movieId"].to_numpy(), movies_df["title"].tolist())
+
+    def __len__(self):
+        return len(self.titles)
+
+    def prefix(self, query: str, limit: int = 50) -> list[int]:
+        """Rows whose normalized title starts with the normalized query"""
+        q = normalize_title(query)
+        if not q:
+            return []
+        start = bisect.bisect_left(self._prefix_keys, q)
+        out = []
+        for pos in range(start, min(start + limit, len(self._prefix_keys))):
+            if not self._prefix_keys[pos].startswith(q):
+                break
+            out.append(self._prefix_order[pos])
+        return out
+
+    def candidates(self, query: str, max_candidates: int = 1000) -> np.ndarray:
+        """Rows with the highest trigram overlap with the query, at most max_candidates of them.
+        Overlap is shared / max(query, title) trigrams, so long titles sharing a few common
+        grams do not crowd out close short ones"""
+        grams = query_trigrams(normalize_title(query))
+        gram_ids = [self._gram_ids[g] for g in grams if g in self._gram_ids]
+        if not gram_ids:
+            return np.empty(0, dtype=np.int64)
+        hits = np.bincount(
+            np.concatenate([self._postings[self._offsets[g]:self._offsets[g + 1]] for g in gram_ids]),
+            minlength=len(self.titles)
+        )
+        rows = np.flatnonzero(hits)
+        if len(rows) > max_candidates:
+            overlap = hits[rows] / np.maximum(len(grams), self._gram_counts[rows])
+            rows = rows[np.argpartition(-overlap, max_candidates - 1)[:max_candidates]]
+        return rows
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        exclude_ids=None,
+        score_cutoff: float = 60,
+        max_candidates: int = 1000,
+        full_scan_below: float = FULL_SCAN_BELOW,
+    ) -> list[tuple[int, str]]:
+        """(movieId, title) of the best fuzzy matches (rapidfuzz WRatio, as the old full scan).
+        Only prefix and trigram candidates are scored when they give limit matches of at
+        least full_scan_below; otherwise every title is. The candidate path is approximate:
+        a typo query can still miss a title the full scan ranks in"""
+        exclude_ids = set(exclude_ids or ())
+        if len(normalize_title(query)) >= 3:
+            rows = set(self.prefix(query))
+            rows.update(self.candidates(query, max_candidates).tolist())
+            #Row order, so equal scores come out in the full scan's order
+            choices = {
+                row: self.titles[row]
+                for row in sorted(rows)
+                if int(self.ids[row]) not in exclude_ids
+            }
+            results = process.extract(query, choices, score_cutoff=score_cutoff, limit=limit)
+            if len(results) == limit and results[-1][1] >= full_scan_below:
+                return [(int(self.ids[row]), title) for title, _, row in results]
+
+        #Short query, too few or only weak candidates: score every title
+        choices = {
+            row: title
+            for row, title in enumerate(self.titles)
+            if int(self.ids[row]) not in exclude_ids
+        }
+        results = process.extract(query, choices, score_cutoff=score_cutoff, limit=limit)
+        return [(int(self.ids[row]), title) for title, _, row in results]
@@ -0,0 +1,231 @@
+import heapq
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from multiprocessing import get_context, shared_memory
+import numpy as np
+from scipy.sparse import csr_matrix
+from services.index import SimilarityIndex, top_k_indices, top_k_rows
+from services.metrics import stage
+
+#Below this many nonzeros per shard the pool round trip costs more than the scan saves.
+#Scoring cost follows nnz, not rows: ML-20M's genome (~10k movies) still splits in several shards
+MIN_SHARD_NNZ = 100_000
+
+
+def row_blocks(n_rows: int, n_shards: int) -> list[tuple[int, int]]:
+    """[start, stop) row ranges of near equal size"""
+    bounds = np.linspace(0, n_rows, n_shards + 1).astype(np.int64)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def csr_block(X: csr_matrix, start: int, stop: int) -> csr_matrix:
+    """Rows [start, stop) of X sharing X's data and indices buffers (no copy)"""
+    lo, hi = X.indptr[start], X.indptr[stop]
+    block = csr_matrix(
+        (X.data[lo:hi], X.indices[lo:hi], X.indptr[start:stop + 1] - lo),
+        shape=(stop - start, X.shape[1]),
+        copy=False
+    )
+    block.has_sorted_indices = X.has_sorted_indices
+    return block
+
+def local_top_k(block: csr_matrix, start: int, q: np.ndarray, k: int, exclude: np.ndarray) -> list[tuple[float, int]]:
+    """(score, global row) of the block's k best rows, best first"""
+    sim = block @ q
+    local = exclude[(exclude >= start) & (exclude < start + block.shape[0])] - start
+    sim[local] = -np.inf
+    top = top_k_indices(sim, k)
+    return [(float(sim[i]), start + int(i)) for i in top if sim[i] != -np.inf]
+
+def local_top_k_rows(block: csr_matrix, start: int, Q: np.ndarray, k: int, ex_rows: np.ndarray, ex_cols: np.ndarray):
+    """Batched local_top_k: (scores, global rows) arrays of shape (n_queries, <=k)"""
+    sim = np.ascontiguousarray((block @ Q.T).T)
+    inside = (ex_cols >= start) & (ex_cols < start + block.shape[0])
+    sim[ex_rows[inside], ex_cols[inside] - start] = -np.inf
+    top = top_k_rows(sim, k)
+    return np.take_along_axis(sim, top, axis=1), top + start
+
+def merge_top_k(parts: list[list[tuple[float, int]]], k: int) -> list[tuple[float, int]]:
+    """k best of several best-first lists, by a heap merge"""
+    return list(islice(heapq.merge(*parts, key=lambda item: -item[0]), k))
+
+
+class SharedCSR:
+    """A CSR matrix copied once into named shared memory blocks, one per array.
+    spec() is what another process needs to attach() to the same pages read-only"""
+    def __init__(self, X: csr_matrix):
+        self.shape = X.shape
+        self.segments = {}
+        self.arrays = {}
+        for name in ("data", "indices", "indptr"):
+            arr = getattr(X, name)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+            view[:] = arr
+            self.segments[name] = shm
+            self.arrays[name] = view
+
+    def spec(self) -> dict:
+        return {
+            "shape": self.shape,
+            "arrays": {
+                name: (self.segments[name].name, arr.shape, arr.dtype.str)
+                for name, arr in self.arrays.items()
+            },
+        }
+
+    @staticmethod
+    def attach(spec: dict):
+        """(csr_matrix over the shared pages, segments to keep alive)"""
+        segments, arrays = [], {}
+        for name, (shm_name, shape, dtype) in spec["arrays"].items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            segments.append(shm)
+            arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            arr.flags.writeable = False
+            arrays[name] = arr
+        X = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(spec["shape"]), copy=False)
+        X.has_sorted_indices = True
+        return X, segments
+
+    def close(self):
+        self.arrays.clear()
+        for shm in self.segments.values():
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.segments.clear()
+
+
+#Per worker process state of the process pool
+_worker_shards: list[tuple[int, csr_matrix]] = []
+_worker_segments: list = []
+
+def _attach_shards(specs: list[tuple[int, dict]]):
+    for start, spec in specs:
+        X, segments = SharedCSR.attach(spec)
+        _worker_shards.append((start, X))
+        _worker_segments.extend(segments)
+
+def _score_shard(shard: int, q: np.ndarray, k: int, exclude: np.ndarray):
+    start, block = _worker_shards[shard]
+    return local_top_k(block, start, q, k, exclude)
+
+def _score_shard_many(shard: int, Q: np.ndarray, k: int, ex_rows: np.ndarray, ex_cols: np.ndarray):
+    start, block = _worker_shards[shard]
+    return local_top_k_rows(block, start, Q, k, ex_rows, ex_cols)
+
+def _shutdown(pool, shared: list[SharedCSR]):
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+    for block in shared:
+        block.close()
+
+
+class ShardedIndex:
+    """Exact cosine scoring spread over row blocks of the normalized matrix, same
+    top_k / top_k_many contract as SimilarityIndex. Each block is scored on a pool
+    worker and keeps only its local top-k; the partial lists are heap merged.
+
+    mode="thread" scores zero-copy views of base.Xn; SciPy's sparse mat-vec drops the
+    GIL so blocks run on separate cores. mode="process" copies the blocks once into
+    shared memory and workers attach to them, for when the GIL still limits threads.
+    A matrix too small for two shards is scored in place: no pool, no shared memory"""
+    base: SimilarityIndex
+    blocks: list[tuple[int, csr_matrix]]
+
+    def __init__(self, base: SimilarityIndex, workers: int = None, mode: str = "thread", min_shard_nnz: int = MIN_SHARD_NNZ):
+        if mode not in ("thread", "process"):
+            raise RuntimeError(f"Unknown shard mode {mode}")
+        self.base = base
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.min_shard_nnz = min_shard_nnz
+        n_shards = max(1, min(self.workers, len(base), base.X.nnz // max(min_shard_nnz, 1)))
+        self.blocks = [(start, csr_block(base.Xn, start, stop)) for start, stop in row_blocks(len(base), n_shards)]
+        self.shared: list[SharedCSR] = []
+        self.pool = None
+        if self.n_shards > 1 and mode == "thread":
+            self.pool = ThreadPoolExecutor(max_workers=len(self.blocks), thread_name_prefix="shard")
+        elif self.n_shards > 1:
+            self.shared = [SharedCSR(block) for _, block in self.blocks]
+            specs = [(start, shared.spec()) for (start, _), shared in zip(self.blocks, self.shared)]
+            self.pool = ProcessPoolExecutor(
+                max_workers=len(self.blocks),
+                mp_context=get_context("spawn"),
+                initializer=_attach_shards,
+                initargs=(specs,),
+            )
+        self._finalizer = weakref.finalize(self, _shutdown, self.pool, self.shared)
+
+    @property
+    def n_shards(self):
+        return len(self.blocks)
+
+    def close(self):
+        self._finalizer()
+
+    def _map(self, local_fn, worker_fn, *args):
+        """Run one task per block, in place when there is a single block"""
+        if self.n_shards == 1:
+            start, block = self.blocks[0]
+            return [local_fn(block, start, *args)]
+        if self.mode == "thread":
+            futures = [self.pool.submit(local_fn, block, start, *args) for start, block in self.blocks]
+        else:
+            futures = [self.pool.submit(worker_fn, shard, *args) for shard in range(self.n_shards)]
+        return [f.result() for f in futures]
+
+    def candidates(self, q: tuple[list[int], list[int]], n: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """Matrix rows and cosines of the n best movies, best first"""
+        qv = self.base.query_vector(q[0], q[1]).toarray().ravel()
+        exclude = self.base.exclude_rows(q[0])
+        with stage("score", backend="sharded"):
+            parts = self._map(local_top_k, _score_shard, qv, n, exclude)
+        with stage("top_k", backend="sharded"):
+            merged = merge_top_k(parts, n)
+            return (
+                np.array([row for _, row in merged], dtype=np.int64),
+                np.array([score for score, _ in merged], dtype=np.float64),
+            )
+
+    def top_k(self, q: tuple[list[int], list[int]], k: int = 10) -> list[tuple[int, float]]:
+        rows, scores = self.candidates(q, k)
+        return [(int(self.base.movie_ids[r]), float(s)) for r, s in zip(rows, scores)]
+
+    def top_k_many(
+        self,
+        profiles: list[tuple[list[int], list[int]]],
+        k: int = 10,
+        batch_size: int = 256,
+    ) -> list[list[tuple[int, float]]]:
+        results = []
+        for start in range(0, len(profiles), batch_size):
+            chunk = profiles[start:start + batch_size]
+            with stage("query_vector", mode="batch"):
+                Q, empty = self.base.query_matrix(chunk)
+                Q = Q.toarray()
+            ex_rows, ex_cols = [], []
+            for i, (movieids, _) in enumerate(chunk):
+                cols = self.base.exclude_rows(movieids)
+                ex_rows.append(np.full(len(cols), i, dtype=np.int64))
+                ex_cols.append(cols)
+            ex_rows = np.concatenate(ex_rows) if ex_rows else np.empty(0, dtype=np.int64)
+            ex_cols = np.concatenate(ex_cols) if ex_cols else np.empty(0, dtype=np.int64)
+
+            with stage("score", mode="batch", backend="sharded"):
+                parts = self._map(local_top_k_rows, _score_shard_many, Q, k, ex_rows, ex_cols)
+            with stage("top_k", mode="batch", backend="sharded"):
+                for i in range(len(chunk)):
+                    if empty[i]:
+                        results.append([])
+                        continue
+                    lists = [
+                        [(float(s), int(r)) for s, r in zip(scores[i], rows[i]) if s != -np.inf]
+                        for scores, rows in parts
+                    ]
+                    results.append([(int(self.base.movie_ids[row]), score) for score, row in merge_top_k(lists, k)])
+        return results
@@ -1,6 +1,11 @@
 import pandas as pd
 import numpy as np
+import os
+import json
 from scipy.sparse import csr_matrix
+from services.metrics import stage
+
+MATRIX_CACHE_VERSION = 1
 
 
 def cosine(a: csr_matrix, b: csr_matrix):
@@ -33,38 +38,109 @@ def build_query_vector(
 ) -> csr_matrix:
     if len(movieids) != len(stars):
         raise RuntimeError("Movie list must have the same lenth of star list")
-    vecs = []
-    scales = []
-    for movid, star in zip(movieids, stars):
-        if movid not in movie2idx:
-            continue
-        vecs.append(X[movie2idx[movid]])
-        scales.append(star)
-    return combine(vecs, scales)
+    with stage("query_vector"):
+        vecs = []
+        scales = []
+        for movid, star in zip(movieids, stars):
+            if movid not in movie2idx:
+                continue
+            vecs.append(X[movie2idx[movid]])
+            scales.append(star)
+        return combine(vecs, scales)
+
+def init_matrix(tag_path: str, threshold: float = 0.3):
+    with stage("csv_parse", source="genome"):
+        df = pd.read_csv(tag_path)
+
+    with stage("matrix_build"):
+        df = df[df["relevance"] > threshold]
 
-def init_matrix(tag_path: str):
-    df = pd.read_csv(tag_path)
-    df = df[df["relevance"] > 0.3]
 
+        movies = df["movieId"].unique()
+        tags = df["tagId"].unique()
 
-    movies = df["movieId"].unique()
-    tags = df["tagId"].unique()
+        movie2idx = {m: i for i, m in enumerate(movies)}
+        tag2idx = {m: i for i, m in enumerate(tags)}
 
-    movie2idx = {m: i for i, m in enumerate(movies)}
-    tag2idx = {m: i for i, m in enumerate(tags)}
 
+        rows = df["movieId"].map(movie2idx).to_numpy()
+        cols = df["tagId"].map(tag2idx).to_numpy()
+        data = df["relevance"].to_numpy()
 
-    rows = df["movieId"].map(movie2idx).to_numpy()
-    cols = df["tagId"].map(tag2idx).to_numpy()
-    data = df["relevance"].to_numpy()
+        X = csr_matrix(
+            (data, (rows, cols)),
+            shape=(len(movies), len(tags))
+        )
+
+    return movie2idx, tag2idx, X
+
+
+def matrix_fingerprint(tag_path: str, threshold: float) -> str:
+    """Cheap identity of the source csv: size + mtime + threshold, no full read"""
+    st = os.stat(tag_path)
+    return f"v{MATRIX_CACHE_VERSION}-{st.st_size}-{st.st_mtime_ns}-{threshold}"
+
+def save_array(path: str, arr: np.ndarray):
+    # Write to a temp file then rename so processes still mapping the old file keep their pages
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+def save_matrix_cache(cache_dir: str, key: str, movie2idx: dict, tag2idx: dict, X: csr_matrix):
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    #Drop the meta first so a crash half way never leaves a valid looking cache
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    X = X.tocsr()
+    X.sort_indices()
+    save_array(os.path.join(cache_dir, "data.npy"), X.data)
+    save_array(os.path.join(cache_dir, "indices.npy"), X.indices)
+    save_array(os.path.join(cache_dir, "indptr.npy"), X.indptr)
+    save_array(os.path.join(cache_dir, "movies.npy"), np.array(list(movie2idx), dtype=np.int64))
+    save_array(os.path.join(cache_dir, "tags.npy"), np.array(list(tag2idx), dtype=np.int64))
+
+    tmp = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "shape": list(X.shape)}, f)
+    os.replace(tmp, meta_path)
+
+def load_matrix_cache(cache_dir: str, key: str):
+    """Return (movie2idx, tag2idx, X) with X backed by read-only memory maps,
+    or None if the cache is missing or was built from another source"""
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("key") != key:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(cache_dir, name), mmap_mode="r")
 
     X = csr_matrix(
-        (data, (rows, cols)),
-        shape=(len(movies), len(tags))
+        (load("data.npy"), load("indices.npy"), load("indptr.npy")),
+        shape=tuple(meta["shape"]),
+        copy=False
     )
-
+    X.has_sorted_indices = True
+    movie2idx = {int(m): i for i, m in enumerate(load("movies.npy"))}
+    tag2idx = {int(t): i for i, t in enumerate(load("tags.npy"))}
     return movie2idx, tag2idx, X
 
+def load_matrix(tag_path: str, cache_dir: str, threshold: float = 0.3):
+    """Same result as init_matrix but served from the on-disk cache when it is fresh"""
+    key = matrix_fingerprint(tag_path, threshold)
+    cached = load_matrix_cache(cache_dir, key)
+    if cached is not None:
+        return cached
+    movie2idx, tag2idx, X = init_matrix(tag_path, threshold)
+    save_matrix_cache(cache_dir, key, movie2idx, tag2idx, X)
+    return load_matrix_cache(cache_dir, key)
+
 
 def get_top_k(
     q: tuple[list[int], list[int]],
@@ -78,16 +154,19 @@ def get_top_k(
 
     query = build_query_vector(q[0], q[1], X, movie2idx)
 
-    scores = (X @ query.T).toarray().ravel()
+    with stage("score"):
+        scores = (X @ query.T).toarray().ravel()
 
-    movie_norms = np.sqrt(X.multiply(X).sum(axis=1)).A1
+        movie_norms = np.sqrt(X.multiply(X).sum(axis=1)).A1
 
-    sim = np.zeros_like(scores)
-    mask = movie_norms != 0
-    sim[mask] = scores[mask] / movie_norms[mask]
+        sim = np.zeros_like(scores)
+        mask = movie_norms != 0
+        sim[mask] = scores[mask] / movie_norms[mask]
 
-    top_idx = np.argsort(sim)[-(k+len(q[0])):][::-1]
+    with stage("top_k"):
+        top_idx = np.argsort(sim)[-(k+len(q[0])):][::-1]
 
-    idx2movie = {v: m for m, v in movie2idx.items()}
+    with stage("materialize"):
+        idx2movie = {v: m for m, v in movie2idx.items()}
 
-    return [(idx2movie[i], sim[i]) for i in top_idx if idx2movie[i] not in q[0]]
+        return [(idx2movie[i], sim[i]) for i in top_idx if idx2movie[i] not in q[0]]
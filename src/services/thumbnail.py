@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+from PIL import Image
+from services.poster import POSTER_PATH, PRESENT, get_manifest
+
+#(width, height) of every pre-rendered size: the result card and its 2x retina version
+CARD_SIZE = (130, 180)
+RETINA_SIZE = (260, 360)
+THUMB_SIZES = [CARD_SIZE, RETINA_SIZE]
+THUMB_INDEX_NAME = "thumbs.json"
+
+
+def fit_image(img: Image.Image, target_w: int, target_h: int) -> Image.Image:
+    """Center-crop to the target ratio then resize, the image fills the frame without distortion"""
+    w, h = img.size
+
+    target_ratio = target_w / target_h
+    src_ratio = w / h
+
+    if src_ratio > target_ratio:
+        new_w = int(h * target_ratio)
+        left = (w - new_w) // 2
+        img = img.crop((left, 0, left + new_w, h))
+    else:
+        new_h = int(w / target_ratio)
+        top = (h - new_h) // 2
+        img = img.crop((0, top, w, top + new_h))
+
+    return img.resize((target_w, target_h), Image.LANCZOS)
+
+def thumbnail_dir(poster_dir: str, w: int, h: int) -> str:
+    return os.path.join(poster_dir, f"thumb_{w}x{h}")
+
+def thumbnail_path(poster_dir: str, movie_id: int, w: int = 130, h: int = 180) -> str:
+    return os.path.join(thumbnail_dir(poster_dir, w, h), f"{int(movie_id)}.jpg")
+
+def file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def thumbnail_index_mtime(poster_dir: str = POSTER_PATH) -> int:
+    """mtime_ns of the thumbnail index, 0 when there is none. A cache key for load_thumbnail_index"""
+    try:
+        return os.stat(os.path.join(poster_dir, THUMB_INDEX_NAME)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def size_name(w: int, h: int) -> str:
+    return f"{w}x{h}"
+
+def load_thumbnail_index(poster_dir: str = POSTER_PATH) -> dict[int, dict]:
+    """movie_id -> {"sha1", "size", "mtime_ns", "sizes"} of the poster the thumbnails
+    were made from; "sizes" lists the rendered "wxh" names (missing in older indexes)"""
+    path = os.path.join(poster_dir, THUMB_INDEX_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+def save_thumbnail_index(poster_dir: str, index: dict[int, dict]):
+    path = os.path.join(poster_dir, THUMB_INDEX_NAME)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({str(k): v for k, v in index.items()}, f)
+    os.replace(tmp, path)
+
+
+def _render(job: tuple) -> tuple:
+    """Worker: render every size of one poster. Runs in a pool process.
+    Returns (movie_id, index entry, error, whether anything was decoded and written)"""
+    poster_dir, movie_id, sizes, known_sha1 = job
+    src = os.path.join(poster_dir, f"{movie_id}.jpg")
+    try:
+        st = os.stat(src)
+        sha1 = file_sha1(src)
+        outputs = [thumbnail_path(poster_dir, movie_id, w, h) for w, h in sizes]
+        entry = {"sha1": sha1, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sizes": [size_name(w, h) for w, h in sizes]}
+        #Same content as last time (only the mtime moved) and nothing deleted: no decode needed
+        if sha1 == known_sha1 and all(os.path.exists(p) for p in outputs):
+            return movie_id, entry, None, False
+
+        with Image.open(src) as img:
+            img = img.convert("RGB")
+            for (w, h), out in zip(sizes, outputs):
+                tmp = f"{out}.{os.getpid()}.tmp"
+                fit_image(img, w, h).save(tmp, "JPEG", quality=85, optimize=True)
+                os.replace(tmp, out)
+        return movie_id, entry, None, True
+    except Exception as e:
+        return movie_id, None, str(e), False
+
+def build_thumbnails(
+    poster_dir: str = POSTER_PATH,
+    sizes: list[tuple[int, int]] = None,
+    processes: int = None,
+    force: bool = False,
+) -> dict[str, int]:
+    """Pre-render thumbnails of every poster in the manifest with a process pool.
+    A poster whose size and mtime match the index is skipped without being read,
+    one whose bytes hash to the recorded sha1 is skipped without being decoded"""
+    sizes = sizes or THUMB_SIZES
+    for w, h in sizes:
+        os.makedirs(thumbnail_dir(poster_dir, w, h), exist_ok=True)
+
+    manifest = get_manifest(poster_dir)
+    index = load_thumbnail_index(poster_dir)
+    jobs = []
+    skipped = 0
+    for movie_id, (status, _) in list(manifest.entries.items()):
+        if status != PRESENT:
+            continue
+        known = index.get(movie_id)
+        if known and not force:
+            try:
+                st = os.stat(os.path.join(poster_dir, f"{movie_id}.jpg"))
+            except FileNotFoundError:
+                continue
+            if st.st_size == known["size"] and st.st_mtime_ns == known["mtime_ns"] and all(
+                os.path.exists(thumbnail_path(poster_dir, movie_id, w, h)) for w, h in sizes
+            ):
+                skipped += 1
+                continue
+        jobs.append((poster_dir, movie_id, sizes, None if force or not known else known["sha1"]))
+
+    summary = {"rendered": 0, "skipped": skipped, "failed": 0}
+    if not jobs:
+        return summary
+
+    with Pool(processes) as pool:
+        for movie_id, entry, error, rendered in pool.imap_unordered(_render, jobs, chunksize=16):
+            if error is not None:
+                print(f"Thumbnail for movie {movie_id} failed: {error}")
+                summary["failed"] += 1
+                continue
+            index[movie_id] = entry
+            #A poster whose hash had not changed was only re-stat'ed, not rendered
+            summary["rendered" if rendered else "skipped"] += 1
+    save_thumbnail_index(poster_dir, index)
+    return summary
+
+
+if __name__ == "__main__":
+    print(build_thumbnails())
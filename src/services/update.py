@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, diags
+from services.index import SimilarityIndex, scale_rows, top_k_rows
+from services.neighbors import NeighborTable, neighbors_of_rows
+from services.embedding import EmbeddingIndex
+from services.catalog import Catalog, catalog_from_frames
+
+
+def genome_delta(frame: pd.DataFrame, tag2idx: dict[int, int], threshold: float = 0.3):
+    """Tag vectors of the movies in frame (genome_scores.csv layout), built like init_matrix.
+    Every movie listed gets its whole vector replaced, a movie whose relevances are all
+    under threshold becomes an empty row. Unknown tagIds get new columns.
+    Returns (movieIds, delta rows csr, tag2idx including the new tags)"""
+    movie_ids = pd.unique(frame["movieId"]).astype(np.int64)
+    kept = frame[frame["relevance"] > threshold]
+
+    tag2idx = dict(tag2idx)
+    for tag in pd.unique(kept["tagId"]):
+        if tag not in tag2idx:
+            tag2idx[tag] = len(tag2idx)
+
+    row_of = {m: i for i, m in enumerate(movie_ids.tolist())}
+    D = csr_matrix(
+        (
+            kept["relevance"].to_numpy(np.float64),
+            (kept["movieId"].map(row_of).to_numpy(), kept["tagId"].map(tag2idx).to_numpy()),
+        ),
+        shape=(len(movie_ids), len(tag2idx))
+    )
+    D.sum_duplicates()
+    return movie_ids, D, tag2idx
+
+def _pad(X: csr_matrix, n_rows: int, n_cols: int) -> csr_matrix:
+    """X with empty rows appended and the column count raised, arrays shared"""
+    extra = np.full(n_rows - X.shape[0], X.indptr[-1], dtype=X.indptr.dtype)
+    return csr_matrix((X.data, X.indices, np.concatenate((X.indptr, extra))), shape=(n_rows, n_cols), copy=False)
+
+def upsert_rows(index: SimilarityIndex, movie_ids: np.ndarray, D: csr_matrix) -> tuple[SimilarityIndex, np.ndarray]:
+    """A new index with the rows of known movies replaced by D's rows and the others
+    appended. Existing rows keep their position and their normalized values, only
+    D is normalized; the old index is left untouched for readers still using it.
+    Returns (new index, matrix row of every movie in movie_ids)"""
+    n_old = len(index)
+    movie2idx = dict(index.movie2idx)
+    rows = np.empty(len(movie_ids), dtype=np.int64)
+    for i, movie_id in enumerate(movie_ids.tolist()):
+        row = movie2idx.get(movie_id)
+        if row is None:
+            row = movie2idx[movie_id] = len(movie2idx)
+        rows[i] = row
+    n = len(movie2idx)
+    n_tags = max(D.shape[1], index.X.shape[1])
+
+    #Zero the replaced rows, then add D scattered onto its target rows
+    keep = np.ones(n)
+    keep[rows] = 0
+    scatter = csr_matrix((np.ones(len(rows)), (rows, np.arange(len(rows)))), shape=(n, len(rows)))
+    D = _pad(D, D.shape[0], n_tags)
+    dnorms = np.sqrt(D.multiply(D).sum(axis=1)).A1
+
+    X = (diags(keep) @ _pad(index.X, n, n_tags) + scatter @ D).tocsr()
+    X.sort_indices()
+
+    norms = np.concatenate((index.norms, np.zeros(n - n_old)))
+    norms[rows] = dnorms
+    #Same norms, same values for the rows kept, laid out like X
+    Xn = scale_rows(X, norms)
+    ids = np.concatenate((index.movie_ids, np.zeros(n - n_old, dtype=index.movie_ids.dtype)))
+    ids[rows] = movie_ids
+    return SimilarityIndex.from_normalized(X, Xn, norms, movie2idx, ids), rows
+
+def upsert_neighbors(table: NeighborTable, index: SimilarityIndex, rows: np.ndarray, replaced_ids: np.ndarray) -> NeighborTable:
+    """Neighbour table of the updated index without recomputing every row.
+    Changed rows and rows whose list holds a replaced movie (its score moved) are
+    recomputed; every other list only has to consider the changed movies as newcomers"""
+    n_neighbors = table.n_neighbors
+    n_old = table.ids.shape[0]
+    ids = np.empty((len(index), n_neighbors), dtype=np.int32)
+    scores = np.empty((len(index), n_neighbors), dtype=np.float32)
+    ids[:n_old] = table.ids
+    scores[:n_old] = table.scores
+
+    stale = np.flatnonzero(np.isin(ids[:n_old], replaced_ids).any(axis=1))
+    redo = np.union1d(rows, stale)
+    rest = np.setdiff1d(np.arange(n_old), redo)
+
+    if len(rest) and len(rows) and n_neighbors:
+        Xn = index.normalized()
+        new_scores = (Xn @ Xn[rows].T).toarray()[rest].astype(np.float32)
+        cand_scores = np.hstack((scores[rest], new_scores))
+        cand_ids = np.hstack((ids[rest], np.broadcast_to(index.movie_ids[rows].astype(np.int32), new_scores.shape)))
+        top = top_k_rows(cand_scores, n_neighbors)
+        ids[rest] = np.take_along_axis(cand_ids, top, axis=1)
+        scores[rest] = np.take_along_axis(cand_scores, top, axis=1)
+    if len(redo) and n_neighbors:
+        ids[redo], scores[redo] = neighbors_of_rows(index, redo, n_neighbors)
+    return NeighborTable(ids, scores, index.movie2idx)
+
+def upsert_embedding(emb: EmbeddingIndex, index: SimilarityIndex, rows: np.ndarray) -> EmbeddingIndex:
+    """Fold the changed rows into the existing factorization: E = Xn V holds for the
+    rows V was fitted on, new rows are projected the same way. New tags get zero weight"""
+    V = emb.V
+    if V.shape[0] < index.Xn.shape[1]:
+        V = np.vstack((V, np.zeros((index.Xn.shape[1] - V.shape[0], V.shape[1]), dtype=V.dtype)))
+    E = np.zeros((len(index), emb.rank), dtype=emb.E.dtype)
+    E[:len(emb.E)] = emb.E
+    E[rows] = np.asarray(index.Xn[rows] @ V, dtype=E.dtype)
+    return EmbeddingIndex(index, E, V)
+
+def catalog_delta(movies: pd.DataFrame, catalog: Catalog) -> Catalog:
+    """Catalog rows for movies (movie.csv layout, optional avg column). Without avg,
+    a movie already in the catalog keeps its average and a new one has none"""
+    if "avg" in movies.columns:
+        ratings = movies[["movieId", "avg"]]
+    else:
+        rows = catalog.rows_of(movies["movieId"].to_numpy())
+        avg = np.where(rows >= 0, catalog.avg[np.maximum(rows, 0)], np.nan)
+        ratings = pd.DataFrame({"movieId": movies["movieId"].to_numpy(), "avg": avg})
+    return catalog_from_frames(movies[["movieId", "title", "genres"]], ratings)
@@ -2,27 +2,30 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import streamlit as st
+from services.score import load_rating_stats
+from services.figure_cache import FigureCache
 
-# Top 10 bộ phim đánh giá cao theo năm (người dùng nhập)
-def plot_top10_movies_by_year(movie_path, rating_path, year):
-    movies = pd.read_csv(movie_path)
-    ratings = pd.read_csv(rating_path)
+# Ảnh PNG đã vẽ, dùng chung cho mọi lần chạy lại trong process
+FIGURE_CACHE = FigureCache()
+
+def figure_png(plot_fn, data, version, **params):
+    """Bytes PNG của plot_fn(data, **params); chỉ vẽ lại khi hàm, tham số
+    hoặc phiên bản dữ liệu (version) thay đổi. None nếu hàm không tạo hình"""
+    key = (plot_fn.__name__, version, tuple(sorted(params.items())))
+    return FIGURE_CACHE.get_or_render(key, lambda: plot_fn(data, **params))
 
-    df = movies.merge(ratings, on="movieId", how="inner")
-    df["year"] = df["title"].str.extract(r"\((\d{4})\)").astype(float)
-    df_year = df[df["year"] == year]
+# Các hàm vẽ chỉ đọc bảng tổng hợp dựng sẵn (services/analytics.py),
+# không đọc lại file csv ở mỗi lần Streamlit chạy lại
+
+# Top 10 bộ phim đánh giá cao theo năm (người dùng nhập)
+def plot_top10_movies_by_year(analytics, year):
+    rows = analytics["top10_by_year"].get(str(int(year)))
 
-    if df_year.empty:
+    if not rows:
         st.warning(f"Không có dữ liệu cho năm {year}")
-        return
-
-    top10 = (
-        df_year.groupby("title", as_index=False)["avg"]
-        .mean()
-        .sort_values("avg", ascending=False)
-        .head(10)
-        .reset_index(drop=True)
-    )
+        return None
+
+    top10 = pd.DataFrame(rows, columns=["title", "avg"])
 
     fig, ax = plt.subplots(figsize=(12, 6))
     y_pos = np.arange(len(top10))
@@ -73,13 +76,13 @@ def plot_top10_movies_by_year(movie_path, rating_path, year):
     ax.spines["right"].set_visible(False)
 
     plt.tight_layout()
-    st.pyplot(fig)
+    return fig
 
 # top 10 thể loại phổ biến
-def plot_top_genres(movies_path):
-    movies = pd.read_csv(movies_path)
-    genres = movies["genres"].str.split("|").explode()
-    genre_count = genres.value_counts().head(10)
+def plot_top_genres(analytics):
+    genre_count = pd.DataFrame(
+        analytics["genre_counts"], columns=["genre", "count"]
+    ).set_index("genre")["count"].head(10)
 
     fig, ax = plt.subplots(figsize=(10, 6))
     colors = plt.cm.Blues(np.linspace(0.8, 0.4, len(genre_count)))
@@ -122,13 +125,13 @@ def plot_top_genres(movies_path):
     ax.spines["right"].set_visible(False)
 
     plt.tight_layout()
-    st.pyplot(fig)
+    return fig
 
 # số lượng phim theo năm
-def plot_movies_per_year(movies_path):
-    movies = pd.read_csv(movies_path)
-    movies["year"] = movies["title"].str.extract(r"\((\d{4})\)").astype(float)
-    movie_per_year = movies["year"].value_counts().sort_index()
+def plot_movies_per_year(analytics):
+    movie_per_year = pd.DataFrame(
+        analytics["movies_per_year"], columns=["year", "count"]
+    ).set_index("year")["count"]
 
     fig, ax = plt.subplots(figsize=(12, 6))
 
@@ -165,16 +168,19 @@ def plot_movies_per_year(movies_path):
     ax.spines["right"].set_visible(False)
 
     plt.tight_layout()
-    st.pyplot(fig)
+    return fig
 
 # Phân bố điểm đánh giá
-def plot_rating_distribution(rating_path):
-    ratings = pd.read_csv(rating_path)
+def plot_rating_distribution(analytics):
+    hist = analytics["rating_hist"]
+    kde = analytics["rating_kde"]
 
     fig, ax = plt.subplots(figsize=(10, 6))
+    bins = np.asarray(hist["edges"])
     counts, bins, patches = ax.hist(
-        ratings["avg"],
-        bins=20,
+        bins[:-1],
+        bins=bins,
+        weights=hist["counts"],
         edgecolor="white",
         linewidth=0.5,
         alpha=0.85
@@ -188,8 +194,10 @@ def plot_rating_distribution(rating_path):
         else:
             patch.set_facecolor("#a0d7ff")
 
-    ratings["avg"].plot(kind='kde', ax=ax, secondary_y=True, color="#a84e00", linewidth=2)
-    ax.right_ax.set_yticks([])
+    right_ax = ax.twinx()
+    right_ax.plot(kde["x"], kde["y"], color="#a84e00", linewidth=2)
+    right_ax.set_ylim(bottom=0)
+    right_ax.set_yticks([])
 
     ax.set_xlabel("Điểm đánh giá trung bình", fontsize=12, fontweight='bold')
     ax.set_ylabel("Số lượng phim (Tần suất)", fontsize=12, fontweight='bold')
@@ -202,14 +210,13 @@ def plot_rating_distribution(rating_path):
     ax.spines["right"].set_visible(False)
 
     plt.tight_layout()
-    st.pyplot(fig)
+    return fig
 
 
 # Đánh giá sự tranh cãi
 def plot_rating_controversy_donut(rating_path):
-    ratings = pd.read_csv(rating_path)
-
-    stats = ratings.groupby("movieId")["rating"].agg(["std", "count"])
+    # Dùng kho thống kê chung (score.py), chỉ tổng hợp các dòng rating mới thêm
+    stats = load_rating_stats(rating_path).to_frame()
     stats = stats[stats["count"] > 50]
 
     def label_opinion(std):
@@ -271,33 +278,12 @@ def plot_rating_controversy_donut(rating_path):
 
     return fig
 # Biểu đồ Phân bổ Kỷ nguyên Điện ảnh
-def plot_movie_eras_donut(movies_path):
-    import pandas as pd
-    import matplotlib.pyplot as plt
-
-    movies = pd.read_csv(movies_path)
-    movies["year"] = movies["title"].str.extract(r"\((\d{4})\)").astype("Int64")
-    movies = movies.dropna(subset=["year"])
-
-    def categorize_era(year):
-        if year < 1980:
-            return "Cổ điển (<1980)"
-        elif year < 2000:
-            return "Giao thời (80s–90s)"
-        elif year < 2015:
-            return "Hiện đại (2000s)"
-        else:
-            return "Mới nhất (2015+)"
-
-    era_data = movies["year"].apply(categorize_era).value_counts()
-
-    order = [
-        "Cổ điển (<1980)",
-        "Giao thời (80s–90s)",
-        "Hiện đại (2000s)",
-        "Mới nhất (2015+)"
-    ]
-    era_data = era_data.reindex(order).dropna()
+def plot_movie_eras_donut(analytics):
+    era_data = pd.DataFrame(
+        analytics["eras"], columns=["era", "count"]
+    ).set_index("era")["count"]
+    # Giống value_counts + reindex + dropna cũ: bỏ kỷ nguyên không có phim
+    era_data = era_data[era_data > 0]
 
     colors = ["#1D3557", "#457B9D", "#A8DADC", "#F1FAEE"]
 
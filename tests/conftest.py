@@ -0,0 +1,5 @@
+import os
+import sys
+
+#The code imports its modules the way the scripts in src/ do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
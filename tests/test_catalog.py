@@ -0,0 +1,61 @@
+import re
+import numpy as np
+import pandas as pd
+from benchmark.synth import gen_movies
+from services.catalog import build_catalog, catalog_from_frames
+from services.update import catalog_delta
+
+
+def baseline_movies(movies: pd.DataFrame, ratings: pd.DataFrame) -> list[tuple]:
+    """(id, title, year, genres, avg) per row, built like the original list of Movie objects"""
+    out = []
+    for _, row in movies.merge(ratings, on="movieId", how="left").iterrows():
+        raw_title = row["title"]
+        m = re.search(r"\((\d{4})\)$", raw_title)
+        if m:
+            year, title = int(m.group(1)), raw_title[:m.start()].strip()
+        else:
+            year, title = None, raw_title
+        out.append((int(row["movieId"]), title, year, row["genres"].split("|"), row["avg"]))
+    return out
+
+def as_tuples(catalog) -> list[tuple]:
+    return [(m.id, m.title, m.year, m.genres, m.average_score) for m in catalog]
+
+def frames(n: int = 600, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    movies = gen_movies(rng, n)
+    movies.loc[0, "genres"] = "Children|Animation"
+    movies.loc[1, "genres"] = "(no genres listed)"
+    ratings = pd.DataFrame({"movieId": movies["movieId"], "avg": rng.uniform(0.5, 5, n).round(2)})
+    #Movies without ratings get nan like the left merge did
+    return movies, ratings.iloc[: n - 20]
+
+def test_catalog_matches_baseline_loader(tmp_path):
+    movies, ratings = frames()
+    movies.to_csv(tmp_path / "movie.csv", index=False)
+    ratings.to_csv(tmp_path / "avg.csv", index=False)
+    expected = baseline_movies(movies, ratings)
+    got = as_tuples(build_catalog(str(tmp_path / "movie.csv"), str(tmp_path / "avg.csv")))
+    assert len(got) == len(expected)
+    for a, b in zip(got, expected):
+        assert a[:4] == b[:4]
+        assert a[4] == b[4] or (np.isnan(a[4]) and np.isnan(b[4]))
+    assert got[0][3] == ["Children", "Animation"]
+
+def test_upsert_keeps_genre_order():
+    movies, ratings = frames()
+    catalog = catalog_from_frames(movies, ratings)
+    delta = pd.DataFrame({
+        "movieId": [int(movies["movieId"][2]), 10**7],
+        "title": ["Replaced (2001)", "Brand New (2020)"],
+        "genres": ["Western|Action", "Newgenre|Drama"],
+    })
+    updated = catalog.upsert(catalog_delta(delta, catalog))
+    assert updated.get(int(movies["movieId"][2])).genres == ["Western", "Action"]
+    assert updated.get(10**7).genres == ["Newgenre", "Drama"]
+    assert updated.get(int(movies["movieId"][0])).genres == ["Children", "Animation"]
+    bit = updated.genre_names.index("Newgenre")
+    assert int(updated.genre_mask[updated.row_of(10**7)]) >> bit & 1
+    untouched = [m for m in as_tuples(updated) if m[0] not in (int(movies["movieId"][2]), 10**7)]
+    assert [m[3] for m in untouched] == [m[3] for m in as_tuples(catalog) if m[0] != int(movies["movieId"][2])]
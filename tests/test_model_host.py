@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import random as sparse_random
+from benchmark.synth import gen_movies
+from model_host import ModelHandle, publish
+from recommender import ModelState, Recommender
+from services.catalog import catalog_from_frames
+from services.index import SimilarityIndex
+from services.rerank import RankFeatures, Reranker
+
+
+def reranked_state(n: int = 300, n_tags: int = 80, seed: int = 0) -> ModelState:
+    rng = np.random.default_rng(seed)
+    movies = gen_movies(rng, n)
+    ratings = pd.DataFrame({"movieId": movies["movieId"], "avg": rng.uniform(0.5, 5, n).round(2)})
+    X = sparse_random(n, n_tags, density=0.2, format="csr", random_state=seed)
+    X.sort_indices()
+    movie2idx = {int(m): i for i, m in enumerate(movies["movieId"])}
+    index = SimilarityIndex(X, movie2idx)
+    catalog = catalog_from_frames(movies, ratings)
+    stats_ids = np.sort(movies["movieId"].to_numpy())
+    stats_counts = rng.integers(1, 5000, n)
+    features = RankFeatures.build(index.movie_ids, catalog, stats_ids, stats_counts, prior_count=20, half_life=8.0)
+    tag2idx = {t: t for t in range(n_tags)}
+    return ModelState(catalog, (movie2idx, tag2idx, X), index, Reranker(index, features), version="test")
+
+def test_attached_rerank_features_survive_update(tmp_path):
+    state = reranked_state()
+    loader = Recommender.from_state(state)
+    publish(state, str(tmp_path))
+    worker = ModelHandle(str(tmp_path)).recommender
+    assert worker.scorer.features.source[2:] == (20, 8.0)
+
+    movie_id = int(state.index.movie_ids[4])
+    genome = pd.DataFrame({"movieId": [movie_id] * 3, "tagId": [1, 2, 3], "relevance": [0.9, 0.8, 0.7]})
+    movies = pd.DataFrame({"movieId": [10**7], "title": ["Brand New (2030)"], "genres": ["Drama"]})
+    for rcm in (loader, worker):
+        rcm.update(genome=genome, movies=movies)
+
+    expected, got = loader.scorer.features, worker.scorer.features
+    assert got.popularity.max() == 1.0
+    for name in ("quality", "popularity", "recency"):
+        np.testing.assert_array_equal(getattr(got, name), getattr(expected, name))
+    q = ([movie_id, int(state.index.movie_ids[9])], [5, 3])
+    assert worker.scorer.top_k(q, 10) == loader.scorer.top_k(q, 10)
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import random as sparse_random
+from benchmark.synth import gen_movies
+from model_host import attach, publish
+from recommender import ModelState, Recommender
+from services.catalog import catalog_from_frames
+from services.index import SimilarityIndex
+from services.quantize import QuantizedIndex, compare_precisions
+
+
+def model_state(quantized: bool, n: int = 400, n_tags: int = 120, seed: int = 0) -> ModelState:
+    rng = np.random.default_rng(seed)
+    movies = gen_movies(rng, n)
+    ratings = pd.DataFrame({"movieId": movies["movieId"], "avg": rng.uniform(0.5, 5, n).round(2)})
+    X = sparse_random(n, n_tags, density=0.2, format="csr", random_state=seed)
+    X.sort_indices()
+    movie2idx = {int(m): i for i, m in enumerate(movies["movieId"])}
+    index = SimilarityIndex(X, movie2idx)
+    scorer = index
+    if quantized:
+        scorer = QuantizedIndex(index, "uint8")
+        index.release_normalized()
+    tag2idx = {t: t for t in range(n_tags)}
+    return ModelState(catalog_from_frames(movies, ratings), (movie2idx, tag2idx, X), index, scorer, version="test")
+
+def npy_sizes(store_dir: str, name: str) -> dict[str, int]:
+    version_dir = os.path.join(store_dir, name)
+    return {f[:-4]: os.path.getsize(os.path.join(version_dir, f)) for f in os.listdir(version_dir) if f.endswith(".npy")}
+
+def test_released_index_stays_released():
+    state = model_state(quantized=True)
+    index, scorer = state.index, state.scorer
+    assert not index.has_normalized
+    with pytest.raises(RuntimeError):
+        index.Xn
+    #Only the uint8 values and their row scales are new, the structure is X's
+    assert np.shares_memory(scorer.indices, index.X.indices)
+    assert scorer.data.dtype == np.uint8
+
+    rcm = Recommender.from_state(state)
+    movie_id = int(index.movie_ids[0])
+    #No neighbour table: similar falls back to a full scan, of the quantized copy
+    assert len(rcm.similar(movie_id, 5)) == 5
+    assert rcm.recommend(([movie_id], [5]), 5, approximate=True)
+    assert rcm.recommend(([movie_id], [5]), 5)
+    assert not rcm.state.index.has_normalized
+
+    #The IVF lists score the uint8 rows in place: no float64 copy of the matrix behind them
+    ann = rcm.state.ann
+    assert ann.quantized is scorer and ann.Xp is None
+    held = [v for v in vars(ann).values() if isinstance(v, np.ndarray)]
+    assert not [a for a in held if a.dtype == np.float64 and a.size >= index.X.nnz]
+    q = ([movie_id, int(index.movie_ids[1])], [5, 2])
+    assert [m for m, _ in ann.top_k(q, 10, ann.n_lists)] == [m for m, _ in scorer.top_k(q, 10)]
+
+def test_publish_quantized_skips_normalized_matrix(tmp_path):
+    sparse = model_state(quantized=False)
+    quantized = model_state(quantized=True)
+    sparse_sizes = npy_sizes(str(tmp_path / "sparse"), publish(sparse, str(tmp_path / "sparse")))
+    sizes = npy_sizes(str(tmp_path / "quantized"), publish(quantized, str(tmp_path / "quantized")))
+
+    assert "Xn_data" not in sizes and "Xn_indices" not in sizes and "Xn_indptr" not in sizes
+    assert "Xn_indices" not in sparse_sizes and "Xn_indptr" not in sparse_sizes
+    #The float64 values are swapped for the uint8 codes and scales, nothing else changes
+    assert sum(sparse_sizes.values()) - sum(sizes.values()) == (
+        sparse_sizes["Xn_data"] - sizes["quantized_data"] - sizes["quantized_scale"]
+    )
+
+    state, meta = attach(str(tmp_path / "quantized"))
+    assert not meta["normalized"]
+    assert not state.index.has_normalized
+    assert isinstance(state.scorer, QuantizedIndex)
+    q = ([int(m) for m in state.index.movie_ids[:3]], [5, 3, 1])
+    assert state.scorer.top_k(q, 10) == quantized.scorer.top_k(q, 10)
+
+def test_released_bytes_count_only_values():
+    state = model_state(quantized=False)
+    index = state.index
+    profiles = [([int(m)], [5]) for m in index.movie_ids[:5]]
+    report = compare_precisions(index, profiles, 5)
+    values = index.Xn.data.nbytes
+    assert report["float32"]["released_bytes"] == values // 2
+    assert report["float16"]["released_bytes"] == values * 3 // 4
+    assert report["uint8"]["released_bytes"] == values * 7 // 8 - len(index) * 4
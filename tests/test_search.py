@@ -0,0 +1,33 @@
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.fuzz import WRatio
+from benchmark.run import make_search_queries
+from benchmark.synth import gen_movies
+from services.search import TitleIndex
+
+#Typed prefixes, single words, one letter typos, and queries too short for a trigram
+SHORT_QUERIES = ["ry", "a", "", "Lo", "zz", "ka"]
+
+
+def full_scan(titles: list[str], query: str, limit: int = 10, exclude: set = frozenset()) -> list[float]:
+    """Scores of the old search_suggest: WRatio over every title"""
+    choices = [t for t in titles if t not in exclude]
+    return [round(score, 6) for _, score, _ in process.extract(query, choices, score_cutoff=60, limit=limit)]
+
+def test_search_matches_full_scan():
+    movies = gen_movies(np.random.default_rng(0), 5000)
+    index = TitleIndex.from_frame(movies)
+    queries = make_search_queries(index.titles, 150) + SHORT_QUERIES
+    for query in queries:
+        found = index.search(query, limit=10, score_cutoff=60)
+        #Equal scores may pick different titles, the score profile must be the same
+        assert [round(WRatio(query, title), 6) for _, title in found] == full_scan(index.titles, query), query
+
+def test_search_excludes_ids():
+    movies = gen_movies(np.random.default_rng(1), 2000)
+    index = TitleIndex.from_frame(movies)
+    title = index.titles[7]
+    exclude = {int(index.ids[7])}
+    found = index.search(title, limit=5, exclude_ids=exclude)
+    assert int(index.ids[7]) not in [movie_id for movie_id, _ in found]
+    assert [round(WRatio(title, t), 6) for _, t in found] == full_scan(index.titles, title, 5, {title})
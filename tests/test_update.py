@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from benchmark.synth import gen_movies
+from recommender import ModelState, Recommender
+from services.catalog import catalog_from_frames
+from services.index import SimilarityIndex
+from services.neighbors import NeighborTable, build_neighbors
+from services.rerank import RankFeatures, Reranker
+from services.tag import init_matrix
+
+N_NEIGHBORS = 20
+NEW_MOVIE = 10**7
+NEW_TAG = 999
+
+
+def genome_frame(movie_ids: np.ndarray, tag_ids: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+    """genome_scores.csv rows: every (movie, tag) pair with a random relevance"""
+    movie_col, tag_col = np.meshgrid(movie_ids, tag_ids, indexing="ij")
+    return pd.DataFrame({
+        "movieId": movie_col.ravel(),
+        "tagId": tag_col.ravel(),
+        "relevance": rng.uniform(0, 1, movie_col.size).round(4),
+    })
+
+def build_state(genome_path: str, movies: pd.DataFrame, ratings: pd.DataFrame, stats: tuple) -> ModelState:
+    """The loader's path: matrix, index and neighbour table from the csv, re-ranked scorer"""
+    movie2idx, tag2idx, X = init_matrix(genome_path)
+    index = SimilarityIndex(X, movie2idx)
+    neighbors = NeighborTable(*build_neighbors(index, N_NEIGHBORS), index.movie2idx)
+    catalog = catalog_from_frames(movies, ratings)
+    features = RankFeatures.build(index.movie_ids, catalog, *stats)
+    return ModelState(catalog, (movie2idx, tag2idx, X), index, Reranker(index, features), neighbors, version="test")
+
+def test_update_matches_rebuild(tmp_path):
+    rng = np.random.default_rng(0)
+    movies = gen_movies(rng, 150)
+    ratings = pd.DataFrame({"movieId": movies["movieId"], "avg": rng.uniform(0.5, 5, len(movies)).round(2)})
+    #Rating counts of the stats store, the update does not change them
+    stats = (np.sort(movies["movieId"].to_numpy()), rng.integers(1, 5000, len(movies)))
+    genome = genome_frame(movies["movieId"].to_numpy(), np.arange(1, 41), rng)
+    genome.to_csv(tmp_path / "genome.csv", index=False)
+    rcm = Recommender.from_state(build_state(str(tmp_path / "genome.csv"), movies, ratings, stats))
+    old = rcm.index
+
+    #A changed movie that gains a new tag, and a new movie
+    changed = int(movies["movieId"][3])
+    delta = pd.concat([
+        genome_frame(np.array([changed]), np.append(np.arange(1, 41, 2), NEW_TAG), rng),
+        genome_frame(np.array([NEW_MOVIE]), np.arange(1, 41), rng),
+    ])
+    new_movie = pd.DataFrame({"movieId": [NEW_MOVIE], "title": ["Brand New (2030)"], "genres": ["Drama|Sci-Fi"]})
+    rcm.update(genome=delta, movies=new_movie)
+
+    #From scratch over the same rows: movie.csv and avg_rating.csv including the new movie
+    merged = pd.concat([genome[genome["movieId"] != changed], delta])
+    merged.to_csv(tmp_path / "merged.csv", index=False)
+    all_movies = pd.concat([movies, new_movie], ignore_index=True)
+    all_ratings = pd.concat([ratings, pd.DataFrame({"movieId": [NEW_MOVIE], "avg": [np.nan]})], ignore_index=True)
+    ref = build_state(str(tmp_path / "merged.csv"), all_movies, all_ratings, stats)
+
+    index = rcm.index
+    assert NEW_TAG in rcm.embeder[1]
+    assert index.X.shape[1] == old.X.shape[1] + 1
+    #Kept rows keep their position and their normalized values, bit for bit
+    kept = int(movies["movieId"][10])
+    row = old.movie2idx[kept]
+    assert index.movie2idx[kept] == row
+    np.testing.assert_array_equal(index.Xn[row].toarray()[0, :old.X.shape[1]], old.Xn[row].toarray()[0])
+
+    profiles = [([changed], [5]), ([NEW_MOVIE, kept], [4, 2]), ([int(m) for m in movies["movieId"][20:25]], [5, 4, 3, 2, 1])]
+    for q in profiles:
+        got, expected = index.top_k(q, 15), ref.index.top_k(q, 15)
+        assert [m for m, _ in got] == [m for m, _ in expected]
+        np.testing.assert_allclose([s for _, s in got], [s for _, s in expected], rtol=1e-9)
+
+    for movie_id in all_movies["movieId"]:
+        got, expected = rcm.neighbors.similar(int(movie_id), N_NEIGHBORS), ref.neighbors.similar(int(movie_id), N_NEIGHBORS)
+        assert [m for m, _ in got] == [m for m, _ in expected]
+        np.testing.assert_allclose([s for _, s in got], [s for _, s in expected], rtol=1e-6)
+
+    assert rcm.get_movie(NEW_MOVIE).genres == ["Drama", "Sci-Fi"]
+    features = rcm.scorer.features
+    expected = ref.scorer.features
+    realigned = np.array([ref.index.movie2idx[int(m)] for m in index.movie_ids])
+    for name in ("quality", "popularity", "recency"):
+        np.testing.assert_allclose(getattr(features, name), getattr(expected, name)[realigned], rtol=1e-6)
+    for q in profiles:
+        assert [m for m, _ in rcm.scorer.top_k(q, 10)] == [m for m, _ in ref.scorer.top_k(q, 10)]